@@ -5,15 +5,21 @@ Connects to Gemini API for real crypto analysis
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
 import google.generativeai as genai
-import requests
+import httpx
 import os
-from typing import Optional
+import json
+from typing import Iterator, Optional
 import base64
 from PIL import Image
 import io
+import asyncio
+from single_flight import single_flight, get_all_metrics
+from market_data_cache import MarketDataCache
+from answer_cache import AnswerCache, answer_key
+import scan_scheduler
 
 app = FastAPI(title="Crypto AI Chat API")
 
@@ -52,9 +58,21 @@ if GEMINI_API_KEY:
 else:
     print("WARNING: GEMINI_API_KEY not found in environment or .env file")
 
+# Upstream market data: one shared keep-alive client; each call has its own deadline
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "5"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+
+# Market data cache TTLs (seconds): ticker / order book move fast, funding / OI slowly
+MARKET_DATA_TTL_FAST = float(os.getenv("MARKET_DATA_TTL_FAST", "3"))
+MARKET_DATA_TTL_SLOW = float(os.getenv("MARKET_DATA_TTL_SLOW", "30"))
+# How long past its TTL a value may still be served while it refreshes (a few TTLs for prices)
+MARKET_DATA_MAX_STALE_FAST = float(os.getenv("MARKET_DATA_MAX_STALE_FAST", "12"))
+MARKET_DATA_MAX_STALE_SLOW = float(os.getenv("MARKET_DATA_MAX_STALE_SLOW", "300"))
+
 class AnalysisRequest(BaseModel):
     text: str
     image_base64: Optional[str] = None
+    no_cache: bool = False
 
 class BinanceDataFetcher:
     """Fetch real-time data from Binance"""
@@ -62,6 +80,31 @@ class BinanceDataFetcher:
     BASE_URL = "https://api.binance.com/api/v3"
     FUTURES_URL = "https://fapi.binance.com/fapi/v1"
     
+    _client: Optional[httpx.AsyncClient] = None
+    cache = MarketDataCache()
+    
+    @classmethod
+    def get_client(cls) -> httpx.AsyncClient:
+        """Shared async HTTP client (connection pool reused across requests)"""
+        if cls._client is None or cls._client.is_closed:
+            cls._client = httpx.AsyncClient(
+                timeout=UPSTREAM_TIMEOUT,
+                limits=httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS // 5)
+            )
+        return cls._client
+    
+    @classmethod
+    async def close(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+    
+    @classmethod
+    async def _get(cls, url: str, params: dict) -> httpx.Response:
+        # Hard deadline for the whole call (httpx timeouts apply per connect / read step)
+        return await asyncio.wait_for(cls.get_client().get(url, params=params), UPSTREAM_TIMEOUT)
+    
     @staticmethod
     def extract_symbol(text: str) -> Optional[str]:
         """Extract coin symbol from user text"""
@@ -75,11 +118,11 @@ class BinanceDataFetcher:
         return None
     
     @classmethod
-    def get_ticker_data(cls, symbol: str) -> dict:
+    async def get_ticker_data(cls, symbol: str) -> dict:
         """Get 24h ticker data"""
         try:
             url = f"{cls.BASE_URL}/ticker/24hr"
-            response = requests.get(url, params={"symbol": symbol}, timeout=5)
+            response = await cls._get(url, {"symbol": symbol})
             if response.status_code == 200:
                 data = response.json()
                 return {
@@ -91,15 +134,15 @@ class BinanceDataFetcher:
                     "low_24h": float(data["lowPrice"])
                 }
         except Exception as e:
-            print(f"Error fetching ticker: {e}")
+            print(f"Error fetching ticker: {e!r}")
         return {}
     
     @classmethod
-    def get_orderbook(cls, symbol: str, limit: int = 20) -> dict:
+    async def get_orderbook(cls, symbol: str, limit: int = 20) -> dict:
         """Get order book data"""
         try:
             url = f"{cls.BASE_URL}/depth"
-            response = requests.get(url, params={"symbol": symbol, "limit": limit}, timeout=5)
+            response = await cls._get(url, {"symbol": symbol, "limit": limit})
             if response.status_code == 200:
                 data = response.json()
                 
@@ -117,15 +160,15 @@ class BinanceDataFetcher:
                     "ask_depth": sum([qty for _, qty in asks])
                 }
         except Exception as e:
-            print(f"Error fetching orderbook: {e}")
+            print(f"Error fetching orderbook: {e!r}")
         return {}
     
     @classmethod
-    def get_funding_rate(cls, symbol: str) -> dict:
+    async def get_funding_rate(cls, symbol: str) -> dict:
         """Get funding rate from futures"""
         try:
             url = f"{cls.FUTURES_URL}/premiumIndex"
-            response = requests.get(url, params={"symbol": symbol}, timeout=5)
+            response = await cls._get(url, {"symbol": symbol})
             if response.status_code == 200:
                 data = response.json()
                 return {
@@ -133,31 +176,42 @@ class BinanceDataFetcher:
                     "mark_price": float(data["markPrice"])
                 }
         except Exception as e:
-            print(f"Error fetching funding rate: {e}")
+            print(f"Error fetching funding rate: {e!r}")
         return {}
     
     @classmethod
-    def get_open_interest(cls, symbol: str) -> dict:
+    async def get_open_interest(cls, symbol: str) -> dict:
         """Get open interest from futures"""
         try:
             url = f"{cls.FUTURES_URL}/openInterest"
-            response = requests.get(url, params={"symbol": symbol}, timeout=5)
+            response = await cls._get(url, {"symbol": symbol})
             if response.status_code == 200:
                 data = response.json()
                 return {
                     "open_interest": float(data["openInterest"])
                 }
         except Exception as e:
-            print(f"Error fetching OI: {e}")
+            print(f"Error fetching OI: {e!r}")
         return {}
     
     @classmethod
-    def get_all_data(cls, symbol: str) -> dict:
-        """Fetch all market data"""
-        ticker = cls.get_ticker_data(symbol)
-        orderbook = cls.get_orderbook(symbol)
-        funding = cls.get_funding_rate(symbol)
-        oi = cls.get_open_interest(symbol)
+    @single_flight("get_all_data", key=lambda cls, symbol: symbol)
+    async def get_all_data(cls, symbol: str) -> dict:
+        """
+        Fetch all market data: the four calls run concurrently, a failed or slow one only
+        leaves its fields out (concurrent requests for the same symbol share one fetch)
+        Served from the TTL cache; expired parts are refreshed in the background
+        """
+        ticker, orderbook, funding, oi = await asyncio.gather(
+            cls.cache.get(("ticker", symbol), MARKET_DATA_TTL_FAST, cls.get_ticker_data, symbol,
+                          max_stale=MARKET_DATA_MAX_STALE_FAST),
+            cls.cache.get(("orderbook", symbol), MARKET_DATA_TTL_FAST, cls.get_orderbook, symbol,
+                          max_stale=MARKET_DATA_MAX_STALE_FAST),
+            cls.cache.get(("funding", symbol), MARKET_DATA_TTL_SLOW, cls.get_funding_rate, symbol,
+                          max_stale=MARKET_DATA_MAX_STALE_SLOW),
+            cls.cache.get(("open_interest", symbol), MARKET_DATA_TTL_SLOW, cls.get_open_interest, symbol,
+                          max_stale=MARKET_DATA_MAX_STALE_SLOW)
+        )
         
         return {
             "symbol": symbol,
@@ -173,6 +227,7 @@ class AIAnalyzer:
     def __init__(self):
         # Use gemini-flash-latest - always points to latest stable flash model
         self.model = genai.GenerativeModel('gemini-flash-latest')
+        self.answer_cache = AnswerCache()
     
     def build_prompt(self, user_query: str, market_data: dict) -> str:
         """Build analysis prompt"""
@@ -253,23 +308,65 @@ Hãy trả lời bằng tiếng Việt, phong cách như đang chat với bạn
 """
         return prompt
     
-    def analyze(self, user_query: str, market_data: dict = None, image_bytes: bytes = None) -> str:
-        """Perform AI analysis"""
+    def build_contents(self, user_query: str, market_data: dict = None, image_bytes: bytes = None):
+        """Gemini request contents: prompt, plus the chart image if provided"""
+        prompt = self.build_prompt(user_query, market_data or {})
+        if image_bytes:
+            # Analyze with image
+            return [prompt, Image.open(io.BytesIO(image_bytes))]
+        # Text only
+        return prompt
+    
+    def cache_key(self, user_query: str, market_data: dict, image_bytes: bytes, use_cache: bool) -> Optional[tuple]:
+        """Answer cache key, or None when the call must go to the model (chart images are never cached)"""
+        if not self.answer_cache.enabled:
+            return None
+        if not use_cache or image_bytes:
+            self.answer_cache.record_bypass()
+            return None
+        return answer_key(user_query, market_data)
+    
+    def analyze(self, user_query: str, market_data: dict = None, image_bytes: bytes = None,
+                use_cache: bool = True) -> str:
+        """Perform AI analysis (a fresh cached answer for the same question and market state skips Gemini)"""
+        key = self.cache_key(user_query, market_data, image_bytes, use_cache)
+        if key is not None:
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                return cached
+        
         try:
-            prompt = self.build_prompt(user_query, market_data or {})
-            
-            if image_bytes:
-                # Analyze with image
-                image = Image.open(io.BytesIO(image_bytes))
-                response = self.model.generate_content([prompt, image])
-            else:
-                # Text only
-                response = self.model.generate_content(prompt)
-            
+            response = self.model.generate_content(self.build_contents(user_query, market_data, image_bytes))
+            if key is not None:
+                self.answer_cache.put(key, response.text)
             return response.text
         
         except Exception as e:
             return f"❌ Lỗi khi phân tích: {str(e)}\n\nVui lòng thử lại hoặc liên hệ support."
+    
+    def analyze_stream(self, user_query: str, market_data: dict = None, image_bytes: bytes = None,
+                       use_cache: bool = True) -> Iterator[str]:
+        """
+        Perform AI analysis, yielding text chunks as Gemini generates them (cached answers in one chunk)
+        Model errors are raised to the caller, which may already have sent part of the answer
+        """
+        key = self.cache_key(user_query, market_data, image_bytes, use_cache)
+        if key is not None:
+            cached = self.answer_cache.get(key)
+            if cached is not None:
+                yield cached
+                return
+        
+        response = self.model.generate_content(
+            self.build_contents(user_query, market_data, image_bytes), stream=True
+        )
+        parts = []
+        for chunk in response:
+            if chunk.text:
+                parts.append(chunk.text)
+                yield chunk.text
+        if key is not None and parts:
+            self.answer_cache.put(key, "".join(parts))
 
 # Initialize analyzer
 analyzer = AIAnalyzer()
@@ -279,23 +376,34 @@ async def root():
     return {
         "message": "Crypto AI Chat API",
         "status": "running",
-        "endpoints": ["/analyze", "/health"]
+        "endpoints": ["/analyze", "/analyze-stream", "/health"]
     }
 
+@app.on_event("shutdown")
+async def close_upstream():
+    await BinanceDataFetcher.close()
+
 @app.get("/health")
 async def health():
     return {
         "status": "healthy",
-        "gemini_configured": bool(GEMINI_API_KEY)
+        "gemini_configured": bool(GEMINI_API_KEY),
+        "single_flight": get_all_metrics(),
+        "market_data_cache": BinanceDataFetcher.cache.get_metrics(),
+        "answer_cache": analyzer.answer_cache.get_metrics(),
+        # Scan cycle lag / overrun when the scanner runs in this process (alert_bot --webhook)
+        "scan_scheduler": scan_scheduler.get_all_metrics()
     }
 
 @app.post("/analyze")
 async def analyze_crypto(
     text: str = Form(...),
-    image: Optional[UploadFile] = File(None)
+    image: Optional[UploadFile] = File(None),
+    no_cache: bool = Form(False)
 ):
     """
     Analyze crypto market based on user query and optional chart image
+    (no_cache=true always asks Gemini instead of reusing a cached answer)
     """
     try:
         # Extract symbol from query
@@ -304,7 +412,7 @@ async def analyze_crypto(
         # Fetch market data if symbol found
         market_data = {}
         if symbol:
-            market_data = BinanceDataFetcher.get_all_data(symbol)
+            market_data = await BinanceDataFetcher.get_all_data(symbol)
         
         # Process image if provided
         image_bytes = None
@@ -312,7 +420,8 @@ async def analyze_crypto(
             image_bytes = await image.read()
         
         # Get AI analysis
-        analysis = analyzer.analyze(text, market_data, image_bytes)
+        # Blocking model call: runs in a thread so the shared event loop (bot webhook) keeps serving
+        analysis = await asyncio.to_thread(analyzer.analyze, text, market_data, image_bytes, use_cache=not no_cache)
         
         return {
             "success": True,
@@ -337,7 +446,7 @@ async def analyze_json(request: AnalysisRequest):
         # Fetch market data
         market_data = {}
         if symbol:
-            market_data = BinanceDataFetcher.get_all_data(symbol)
+            market_data = await BinanceDataFetcher.get_all_data(symbol)
         
         # Process image if provided
         image_bytes = None
@@ -345,7 +454,8 @@ async def analyze_json(request: AnalysisRequest):
             image_bytes = base64.b64decode(request.image_base64.split(',')[1])
         
         # Get AI analysis
-        analysis = analyzer.analyze(request.text, market_data, image_bytes)
+        analysis = await asyncio.to_thread(analyzer.analyze, request.text, market_data, image_bytes,
+                                           use_cache=not request.no_cache)
         
         return {
             "success": True,
@@ -358,6 +468,61 @@ async def analyze_json(request: AnalysisRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event: str, data: dict) -> str:
+    """Format one Server-Sent Events message (JSON payload keeps newlines out of the data line)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/analyze-stream")
+async def analyze_stream(
+    text: str = Form(...),
+    image: Optional[UploadFile] = File(None),
+    no_cache: bool = Form(False)
+):
+    """
+    Streaming variant of /analyze (Server-Sent Events):
+    market_data is sent as soon as it is fetched, then the analysis arrives as chunk events
+    while Gemini generates it, and a final done event closes the stream
+    (on failure: an error event, then done with success false)
+    """
+    symbol = BinanceDataFetcher.extract_symbol(text)
+    image_bytes = await image.read() if image else None
+    
+    async def events():
+        chunks = None
+        try:
+            market_data = {}
+            if symbol:
+                market_data = await BinanceDataFetcher.get_all_data(symbol)
+            yield sse_event("market_data", {"query": text, "symbol": symbol, "market_data": market_data})
+            
+            # The Gemini SDK iterator blocks: pull each chunk off the event loop
+            chunks = analyzer.analyze_stream(text, market_data, image_bytes, use_cache=not no_cache)
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                yield sse_event("chunk", {"text": chunk})
+            
+            yield sse_event("done", {"success": True})
+        
+        except Exception as e:
+            yield sse_event("error", {"message": str(e)})
+            yield sse_event("done", {"success": False})
+        
+        finally:
+            # Stream finished or client disconnected: stop pulling from Gemini
+            if chunks is not None:
+                try:
+                    chunks.close()
+                except ValueError:
+                    pass  # next() still running in a worker thread; the generator is dropped after it
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     print("Starting Crypto AI Chat API...")
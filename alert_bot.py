@@ -13,134 +13,204 @@ from datetime import datetime
 from telegram import Bot
 from telegram.ext import Application
 import asyncio
+import argparse
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import user_db
+from async_user_db import user_db_async
 import bot_commands
+import telegram_webhook
 import mm_detector
+import market_snapshot
+from scan_scheduler import ScanScheduler, TIMEFRAME_SECONDS, next_candle_close
+import scan_sharding
+from cooldown_ledger import CooldownLedger
+from subscription_index import SubscriptionIndex
+from delivery_queue import DeliveryQueue, GLOBAL_RATE, DELIVERED, FAILED, REJECTED, UNREACHABLE
+from alert_digest import build_digest_message
 
 # Load environment variables
 load_dotenv()
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
-# Alert tracking to avoid spam
-last_alerts = {}  # {symbol: timestamp}
+# Alert tracking to avoid spam (persistent, shared by all scanner processes)
+cooldown_ledger = None  # CooldownLedger, opened on first scan
 ALERT_COOLDOWN = 3600  # 1 hour between alerts for same coin (can be overridden by orchestrator)
 
-async def send_alert_to_user(bot: Bot, telegram_id: int, message: str):
-    """Send alert message to a specific user"""
-    try:
-        await bot.send_message(
-            chat_id=telegram_id,
-            text=message,
-            parse_mode='Markdown'
-        )
-        print(f"[OK] Alert sent to user {telegram_id}")
-    except Exception as e:
-        print(f"[ERROR] Failed to send alert to {telegram_id}: {e}")
+# In-memory symbol -> subscribers index (built on first use)
+subscription_index = None
 
-async def send_alert_to_users(bot: Bot, symbol: str, message: str):
-    """Send alert to all users tracking this coin"""
-    users = user_db.get_users_tracking_coin(symbol)
-    
-    if not users:
-        print(f"[INFO] No users tracking {symbol}, skipping alert")
-        return
-    
-    print(f"[ALERT] Sending alert for {symbol} to {len(users)} user(s)")
+def get_subscription_index() -> SubscriptionIndex:
+    """Load the subscription index once and keep it in sync with user_db writes"""
+    global subscription_index
+    if subscription_index is None:
+        subscription_index = SubscriptionIndex().attach()
+    return subscription_index
+
+# Scan scheduling: scan right after each candle closes
+SCAN_TIMEFRAME = os.getenv("SCAN_TIMEFRAME", "5m")
+SCAN_CLOSE_DELAY = float(os.getenv("SCAN_CLOSE_DELAY", "3"))  # seconds after candle close
+
+# Digest users receive one merged message per window, covering the alerts of every scanner shard
+DIGEST_WINDOW = float(os.getenv("DIGEST_WINDOW", "60"))  # seconds
+
+# Blocking ccxt analysis runs in a thread pool so Telegram commands never wait on a scan
+SCAN_WORKERS = int(os.getenv("SCAN_WORKERS", "4"))
+scan_executor = None
+_scan_worker_state = threading.local()
+
+# Webhook mode: Telegram pushes updates to WEBHOOK_URL (public https URL ending in the webhook path)
+WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+WEBHOOK_PORT = int(os.getenv("PORT", "8000"))
+
+# Expired paid subscriptions are downgraded in bulk every SUBSCRIPTION_SWEEP_INTERVAL seconds
+SUBSCRIPTION_SWEEP_INTERVAL = int(os.getenv("SUBSCRIPTION_SWEEP_INTERVAL", "60"))
+
+# Delivered/failed outbox rows older than user_db.OUTBOX_RETENTION_DAYS are purged every OUTBOX_PURGE_INTERVAL seconds
+OUTBOX_PURGE_INTERVAL = int(os.getenv("OUTBOX_PURGE_INTERVAL", "3600"))
+
+# Rate-limited outbound queue (Telegram: ~30 msg/s global, 1 msg/s per chat)
+delivery_queue = None
+
+async def get_delivery_queue(bot: Bot) -> DeliveryQueue:
+    """Start the delivery queue workers on first use"""
+    global delivery_queue
+    if delivery_queue is None:
+        delivery_queue = DeliveryQueue(bot)
+        await delivery_queue.start()
+        asyncio.create_task(delivery_queue.report_forever())
+    return delivery_queue
+
+def queue_alert_for_users(symbol: str, users: list, entry: dict, scan_key: str) -> list:
+    """
+    Write the alert to the outbox for every recipient
+    Users in 'digest' mode get a deferred digest entry instead, merged per user by the delivery worker
     
-    # Send to all users concurrently
-    tasks = []
+    Returns:
+        list: Dedupe keys of the outbox rows written for this alert
+    """
+    rows = []
     for user in users:
-        task = send_alert_to_user(bot, user['telegram_id'], message)
-        tasks.append(task)
+        digest = user.get('alert_mode') == 'digest'
+        rows.append({
+            'telegram_id': user['telegram_id'],
+            'symbol': symbol,
+            'message': json.dumps(entry) if digest else entry['message'],
+            # Same scan cycle retried -> same key -> not enqueued twice
+            'dedupe_key': f"{scan_key}:{symbol}:{entry['severity']}:{user['telegram_id']}",
+            'status': 'digest' if digest else 'pending'
+        })
     
-    await asyncio.gather(*tasks)
+    enqueued = user_db.enqueue_alerts(rows)
+    digests = sum(1 for row in rows if row['status'] == 'digest')
+    print(f"[ALERT] {symbol}: {enqueued} alert(s) enqueued, {digests} user(s) in digest")
+    return [row['dedupe_key'] for row in rows]
+
+def get_scan_executor() -> ThreadPoolExecutor:
+    """Worker threads for the blocking ccxt analysis (keeps the bot's event loop free)"""
+    global scan_executor
+    if scan_executor is None:
+        scan_executor = ThreadPoolExecutor(max_workers=SCAN_WORKERS, thread_name_prefix="scan")
+    return scan_executor
+
+def analyze_symbol(symbol: str) -> dict:
+    """Run comprehensive analysis in a scan worker thread (one orchestrator/exchange per thread)"""
+    orchestrator = getattr(_scan_worker_state, 'orchestrator', None)
+    if orchestrator is None:
+        from alert_orchestrator import AlertOrchestrator
+        orchestrator = _scan_worker_state.orchestrator = AlertOrchestrator(cooldown_ledger)
+    return orchestrator.analyze_coin(symbol)
+
+def analyze_before_deadline(symbol: str, deadline: float = None) -> dict:
+    """Scan worker entry point: analyses that only start after the cycle deadline are skipped"""
+    if deadline and time.time() >= deadline:
+        return None
+    return analyze_symbol(symbol)
 
-async def scan_and_alert(bot: Bot):
-    """Main scanning function - Enhanced with comprehensive detection"""
+async def scan_and_alert(deadline: float = None, shard: scan_sharding.ShardCoordinator = None):
+    """
+    Main scanning function - Enhanced with comprehensive detection
+    Coins are analyzed in the scan worker pool; alerts are written to the user_db outbox
+    and sent by the delivery worker
+    
+    Args:
+        deadline: Unix timestamp when the next cycle is due; remaining symbols
+                  are shed once it passes so the scan never runs into the next cycle
+        shard: In sharded mode, only this worker's symbols are scanned
+    """
     print(f"\n{'='*60}")
     print(f"[SCAN] Scanning market at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print(f"{'='*60}")
     
+    global cooldown_ledger
+    
+    # Identifies this scan cycle in outbox dedupe keys
+    scan_key = str(int(deadline if deadline else time.time()))
+    if shard:
+        scan_key += f":{shard.worker_id}"
+    
     try:
         # Import alert orchestrator
         from alert_orchestrator import AlertOrchestrator
-        orchestrator = AlertOrchestrator()
+        if cooldown_ledger is None:
+            cooldown_ledger = await asyncio.to_thread(CooldownLedger)
+        orchestrator = AlertOrchestrator(cooldown_ledger)
         
-        # Get all tracked coins from database
-        # Get unique symbols from all users
-        all_users = user_db.get_all_users()
-        tracked_symbols = set()
-        
-        for user in all_users:
-            coins = user_db.get_tracked_coins(user['telegram_id'])
-            for coin in coins:
-                tracked_symbols.add(coin['symbol'])
+        # Unique symbols tracked by any user (picks up writes from other processes)
+        # SQLite reads and writes run in threads so the bot's event loop never waits on the disk
+        index = await asyncio.to_thread(get_subscription_index)
+        await asyncio.to_thread(index.refresh_if_changed)
+        tracked_symbols = index.symbols()
         
         if not tracked_symbols:
             print("[INFO] No coins being tracked by any user")
             return
         
-        print(f"[INFO] Analyzing {len(tracked_symbols)} tracked coins...")
+        if shard:
+            total = len(tracked_symbols)
+            tracked_symbols = shard.claim_symbols(tracked_symbols)
+            print(f"[SHARD] Worker {shard.worker_id} owns {len(tracked_symbols)}/{total} coins")
+        
+        print(f"[INFO] Analyzing {len(tracked_symbols)} tracked coins with {SCAN_WORKERS} workers...")
         
-        # Analyze each tracked coin
+        executor = get_scan_executor()
+        submitted = {}  # asyncio future -> pool future
+        pending = {}
         for symbol in tracked_symbols:
-            try:
-                print(f"\n[ANALYZING] {symbol}...")
-                
-                # Comprehensive analysis
-                analysis = orchestrator.analyze_coin(symbol)
-                
-                if analysis.get('error'):
-                    print(f"[ERROR] {symbol}: {analysis['error']}")
-                    continue
-                
-                risk_score = analysis['risk_score']
-                severity = analysis['severity']
-                signals = analysis['signals']
-                
-                print(f"[RESULT] {symbol}: Risk Score = {risk_score}/100, Severity = {severity}")
-                print(f"[SIGNALS] Found {len(signals)} signals")
-                
-                # Check if we should send alert
-                last_alert = last_alerts.get(symbol, 0)
-                should_alert = orchestrator.should_send_alert(
-                    risk_score=risk_score,
-                    severity=severity,
-                    last_alert_time=last_alert if last_alert > 0 else None,
-                    cooldown=ALERT_COOLDOWN
-                )
-                
-                if not should_alert:
-                    print(f"[SKIP] {symbol}: Cooldown active")
-                    continue
-                
-                # Only send if there are actual signals
-                if not signals:
-                    print(f"[SKIP] {symbol}: No signals detected")
-                    continue
-                
-                # Send alert to users tracking this coin
-                users = user_db.get_users_tracking_coin(symbol)
-                
-                if not users:
-                    print(f"[SKIP] {symbol}: No users tracking")
-                    continue
-                
-                print(f"[ALERT] Sending alert for {symbol} to {len(users)} user(s)")
-                
-                # Send to all users
-                alert_message = analysis['alert_message']
-                await send_alert_to_users(bot, symbol, alert_message)
-                
-                # Update last alert time
-                last_alerts[symbol] = time.time()
-                
-            except Exception as e:
-                print(f"[ERROR] Failed to analyze {symbol}: {e}")
-                import traceback
-                traceback.print_exc()
-                continue
+            work = executor.submit(analyze_before_deadline, symbol, deadline)
+            future = asyncio.wrap_future(work)
+            submitted[future] = work
+            pending[future] = symbol
+        
+        # Handle results as they complete
+        while pending:
+            timeout = deadline - time.time() if deadline else None
+            if timeout is not None and timeout <= 0:
+                # Queued analyses are cancelled in the pool right away (the ones already
+                # running finish in the background and their results are dropped)
+                dropped = sum(1 for future in pending if submitted[future].cancel())
+                print(f"[SHED] Cycle deadline reached, skipping {len(pending)} remaining coin(s) "
+                      f"({dropped} never started)")
+                for future in pending:
+                    future.cancel()
+                break
+            
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                symbol = pending.pop(future)
+                try:
+                    analysis = future.result()
+                    if analysis is None:
+                        print(f"[SHED] {symbol}: skipped, analysis would start after the cycle deadline")
+                        continue
+                    await asyncio.to_thread(handle_analysis, symbol, analysis, orchestrator, index, scan_key)
+                except Exception as e:
+                    print(f"[ERROR] Failed to analyze {symbol}: {e}")
+                    import traceback
+                    traceback.print_exc()
         
         print(f"\n[OK] Scan completed\n")
         
@@ -149,46 +219,275 @@ async def scan_and_alert(bot: Bot):
         import traceback
         traceback.print_exc()
 
-async def main():
-    """Main bot loop"""
+def handle_analysis(symbol: str, analysis: dict, orchestrator, index: SubscriptionIndex, scan_key: str):
+    """Decide whether an analyzed coin alerts, and enqueue it for its subscribers"""
+    if analysis.get('error'):
+        print(f"[ERROR] {symbol}: {analysis['error']}")
+        return
+    
+    risk_score = analysis['risk_score']
+    severity = analysis['severity']
+    signals = analysis['signals']
+    
+    print(f"[RESULT] {symbol}: Risk Score = {risk_score}/100, Severity = {severity}")
+    print(f"[SIGNALS] Found {len(signals)} signals")
+    
+    # Only send if there are actual signals
+    if not signals:
+        print(f"[SKIP] {symbol}: No signals detected")
+        return
+    
+    # Send alert to users tracking this coin
+    users = index.subscribers(symbol)
+    
+    if not users:
+        print(f"[SKIP] {symbol}: No users tracking")
+        return
+    
+    if orchestrator.cooldown_active(risk_score, severity, cooldown=ALERT_COOLDOWN, symbol=symbol):
+        print(f"[SKIP] {symbol}: Cooldown active")
+        return
+    
+    entry = {
+        'symbol': symbol,
+        'risk_score': risk_score,
+        'severity': severity,
+        'message': analysis['alert_message'],
+        'digest_line': analysis.get('digest_line')
+    }
+    dedupe_keys = queue_alert_for_users(symbol, users, entry, scan_key)
+    
+    # Record the cooldown only once the alert is in the outbox: a crash in between
+    # repeats the alert on the next scan instead of suppressing it
+    should_alert = orchestrator.should_send_alert(
+        risk_score=risk_score,
+        severity=severity,
+        cooldown=ALERT_COOLDOWN,
+        symbol=symbol
+    )
+    
+    if not should_alert:
+        # Another scanner replica recorded this alert meanwhile: withdraw ours if still unsent
+        withdrawn = user_db.cancel_pending_alerts(dedupe_keys)
+        print(f"[SKIP] {symbol}: Cooldown taken by another scanner, {withdrawn} alert(s) withdrawn")
+
+async def drain_outbox(bot: Bot, worker_id: str, batch_size: int = 100, poll_interval: float = 1.0,
+                       lease: int = user_db.OUTBOX_LEASE):
+    """
+    Delivery worker: claim pending outbox alerts in batches, send them through the
+    rate-limited delivery queue and mark the outcome of each one
+    
+    Claims stay valid while their rows wait in the queue: at most what the global rate
+    sends in half a lease is claimed at once, and claims older than half a lease are renewed
+    (per-chat limits can hold a row back longer than the global rate alone)
+    Outbox writes run in a worker thread: a contended write must not stall the bot's handlers
+    """
+    queue = await get_delivery_queue(bot)
+    max_in_flight = max(1, int(lease * GLOBAL_RATE * 0.5))
+    in_flight = {}  # alert_id -> claimed_at, for rows queued but not reported yet
+    results = []  # (alert_id, telegram_id, error, outcome) reported by the queue workers
+    merged_at = 0.0
+    
+    def on_done(alert_id: int, telegram_id: int):
+        def callback(error, outcome):
+            results.append((alert_id, telegram_id, error, outcome))
+        return callback
+    
+    while True:
+        rows = []
+        try:
+            # Digest entries from every scanner shard become one message per user and window
+            if time.time() - merged_at >= poll_interval:
+                merged_at = time.time()
+                merged = await asyncio.to_thread(user_db.merge_digest_alerts, build_digest_message, DIGEST_WINDOW)
+                if merged:
+                    print(f"[DIGEST] {merged} digest(s) enqueued")
+            
+            limit = min(batch_size, queue.free_slots(), max_in_flight - len(in_flight))
+            if limit > 0:
+                rows = await asyncio.to_thread(user_db.claim_pending_alerts, worker_id, limit, lease)
+            claimed_at = time.time()
+            for row in rows:
+                in_flight[row['id']] = claimed_at
+                await queue.put(row['telegram_id'], row['message'], on_done=on_done(row['id'], row['telegram_id']))
+            
+            # Record outcomes reported since the last batch
+            if results:
+                batch = results[:]
+                results.clear()
+                for alert_id, _, _, _ in batch:
+                    in_flight.pop(alert_id, None)
+                await asyncio.to_thread(record_outcomes, batch)
+            
+            # Renew claims on rows still waiting in the queue before their lease runs out
+            now = time.time()
+            expiring = [alert_id for alert_id, claimed_at in in_flight.items() if now - claimed_at > lease / 2]
+            if expiring:
+                await asyncio.to_thread(user_db.renew_alert_claims, worker_id, expiring, now)
+                for alert_id in expiring:
+                    in_flight[alert_id] = now
+        except Exception as e:
+            print(f"[ERROR] Outbox delivery failed: {e}")
+        
+        await asyncio.sleep(0 if rows else poll_interval)
+
+def record_outcomes(batch: list):
+    """Close outbox rows and record per-user delivery results (unreachable chats are deactivated)"""
+    user_db.mark_alerts_delivered([alert_id for alert_id, _, _, outcome in batch if outcome == DELIVERED])
+    user_db.mark_alerts_failed([(alert_id, error) for alert_id, _, error, outcome in batch if outcome == FAILED])
+    user_db.mark_alerts_failed(
+        [(alert_id, error) for alert_id, _, error, outcome in batch if outcome in (REJECTED, UNREACHABLE)],
+        permanent=True
+    )
+    deactivated = user_db.record_delivery_outcomes(
+        delivered=[telegram_id for _, telegram_id, _, outcome in batch if outcome == DELIVERED],
+        failures=[(telegram_id, error, outcome == UNREACHABLE)
+                  for _, telegram_id, error, outcome in batch if outcome != DELIVERED]
+    )
+    if deactivated:
+        print(f"[DELIVERY] Deactivated {len(deactivated)} unreachable user(s): {deactivated}")
+
+def expiry_notice(user: dict) -> str:
+    """Message telling a user their paid subscription expired"""
+    return (
+        f"⏰ Gói {user['subscription_tier'].upper()} của bạn đã hết hạn.\n"
+        f"Tài khoản đã chuyển về gói FREE (theo dõi {user_db.TIER_LIMITS['free']} coin). "
+        f"Xem /status để gia hạn."
+    )
+
+async def sweep_expired_subscriptions() -> int:
+    """
+    Downgrade expired subscriptions, then queue a notice for each downgraded user
+    Users stay marked until their notice is in the outbox, so notices lost to a crash
+    between the two steps are queued by the next sweep
+    """
+    expired = await user_db_async.expire_subscriptions()
+    if expired:
+        print(f"[SUBSCRIPTION] Downgraded {len(expired)} expired subscription(s)")
+    notified = await user_db_async.queue_expiry_notices(expiry_notice)
+    if notified:
+        print(f"[SUBSCRIPTION] Queued {notified} expiry notice(s)")
+    return len(expired)
+
+async def run_expiry_sweeper(interval: int = SUBSCRIPTION_SWEEP_INTERVAL):
+    """Periodic subscription expiry sweep (read paths never downgrade)"""
+    while True:
+        try:
+            await sweep_expired_subscriptions()
+        except Exception as e:
+            print(f"[ERROR] Subscription sweep failed: {e}")
+        await asyncio.sleep(interval)
+
+async def run_outbox_purge(interval: int = OUTBOX_PURGE_INTERVAL):
+    """Periodic retention purge of closed outbox rows (keeps alert_outbox bounded)"""
+    while True:
+        try:
+            purged = await user_db_async.purge_delivered_alerts()
+            if purged:
+                print(f"[OUTBOX] Purged {purged} closed alert(s) older than {user_db.OUTBOX_RETENTION_DAYS} days")
+        except Exception as e:
+            print(f"[ERROR] Outbox purge failed: {e}")
+        await asyncio.sleep(interval)
+
+async def run_scanner(shard: scan_sharding.ShardCoordinator = None):
+    """Run the candle-aligned scan loop"""
+    print("[SCANNER] Starting enhanced market scanner...")
+    print(f"[CONFIG] Scan interval: every {SCAN_TIMEFRAME} candle close (+{SCAN_CLOSE_DELAY:.0f}s)")
+    print(f"[CONFIG] Smart cooldown: Critical=0min, Warning=30min, Info=60min")
+    print(f"[CONFIG] Scan workers: {SCAN_WORKERS} threads")
+    
+    interval = TIMEFRAME_SECONDS[SCAN_TIMEFRAME]
+    
+    # Candle-aligned scheduler (no drift, never overlaps itself)
+    scheduler = ScanScheduler(
+        lambda deadline: scan_and_alert(deadline=deadline, shard=shard),
+        interval=interval,
+        close_delay=SCAN_CLOSE_DELAY,
+        name=f"scanner-{shard.worker_id}" if shard else "scanner"
+    )
+    
+    # Initial scan on startup, then align to candle closes
+    await scan_and_alert(deadline=next_candle_close(time.time(), interval, SCAN_CLOSE_DELAY), shard=shard)
+    await scheduler.run_forever()
+
+async def main(role: str = 'all', worker_id: str = None, webhook: bool = False):
+    """
+    Main bot loop
+    Commands arrive by long polling, or through the webhook route on the API app when `webhook` is set
+    
+    Roles:
+        all       - Telegram commands + scanner (worker threads) + outbox delivery in one process (default)
+        scanner   - Sharded scanner worker, writes alerts to the outbox (no Telegram connection)
+        delivery  - Telegram commands + outbox delivery for alerts written by scanner workers
+    """
+    if role == 'scanner':
+        shard = scan_sharding.ShardCoordinator(worker_id)
+        shard.start_heartbeat()
+        print(f"[BOT] Starting scanner worker {shard.worker_id}...")
+        try:
+            await run_scanner(shard=shard)
+        finally:
+            shard.leave()
+        return
+    
     if not BOT_TOKEN or "your_" in BOT_TOKEN:
         print("[ERROR] TELEGRAM_BOT_TOKEN not set in .env file")
         print("Please set your bot token in .env file:")
         print("TELEGRAM_BOT_TOKEN=your_actual_bot_token_here")
         return
     
+    if webhook and not (WEBHOOK_URL and WEBHOOK_SECRET):
+        # Without the secret anyone could post fake updates to the public route
+        print("[ERROR] Webhook mode needs TELEGRAM_WEBHOOK_URL and TELEGRAM_WEBHOOK_SECRET in .env file")
+        return
+    
     print("[BOT] Starting Crypto Radar Alert Bot (Enhanced Version)...")
     print(f"[TIME] Started at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("[FEATURES] MM Exit Detection, Price Movement Analysis, Volume Surge Detection")
     
-    # Create bot application
-    application = Application.builder().token(BOT_TOKEN).build()
-    
-    # Setup command handlers
-    bot_commands.setup_bot_commands(application)
+    if webhook:
+        # Updates pushed by Telegram to the shared FastAPI app, handled concurrently
+        from ai_chat_api import app as api_app
+        import uvicorn
+        application = telegram_webhook.build_application(BOT_TOKEN)
+        telegram_webhook.attach_webhook(api_app, application, secret_token=WEBHOOK_SECRET)
+        await telegram_webhook.start_webhook(application, WEBHOOK_URL, WEBHOOK_SECRET)
+        server = uvicorn.Server(uvicorn.Config(api_app, host="0.0.0.0", port=WEBHOOK_PORT, log_level="warning"))
+        print(f"[OK] Bot is serving webhook updates on port {WEBHOOK_PORT}{telegram_webhook.WEBHOOK_PATH}")
+    else:
+        # Create bot application
+        application = Application.builder().token(BOT_TOKEN).build()
+        
+        # Setup command handlers
+        bot_commands.setup_bot_commands(application)
+        
+        # Start bot (non-blocking)
+        await application.initialize()
+        await application.start()
+        await application.updater.start_polling()
+        print("[OK] Bot is running and listening for commands")
     
-    # Start bot (non-blocking)
-    await application.initialize()
-    await application.start()
-    await application.updater.start_polling()
+    # Market leaderboards for the scan button, refreshed in the background
+    market_snapshot.snapshot_service.ensure_started()
     
-    print("[OK] Bot is running and listening for commands")
-    print("[SCANNER] Starting enhanced market scanner...")
-    print(f"[CONFIG] Scan interval: 5 minutes (for tracked coins)")
-    print(f"[CONFIG] Smart cooldown: Critical=0min, Warning=30min, Info=60min")
     print("\nPress Ctrl+C to stop\n")
     
     # Get bot instance for sending alerts
     bot = application.bot
     
+    # Outbox delivery worker (alerts survive crashes between scan and send)
+    delivery_worker_id = worker_id or f"delivery-{os.getpid()}"
+    print(f"[DELIVERY] Draining alert outbox as {delivery_worker_id}...")
+    
+    services = [drain_outbox(bot, delivery_worker_id), run_expiry_sweeper(), run_outbox_purge()]
+    if role != 'delivery':
+        services.append(run_scanner())
+    if webhook:
+        services.append(server.serve())
+    
     try:
-        while True:
-            await scan_and_alert(bot)
-            
-            # Wait 5 minutes before next scan (more frequent for better detection)
-            print(f"[WAIT] Next scan in 5 minutes...")
-            await asyncio.sleep(300)  # 5 minutes
-            
+        await asyncio.gather(*services)
+        
     except KeyboardInterrupt:
         print("\n\n[STOP] Stopping bot...")
         await application.stop()
@@ -196,4 +495,12 @@ async def main():
         print("[OK] Bot stopped successfully")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Crypto Radar Alert Bot")
+    parser.add_argument("--role", choices=["all", "scanner", "delivery"], default="all",
+                        help="Run everything in one process, or a sharded scanner worker / outbox delivery process")
+    parser.add_argument("--worker-id", default=None, help="Stable scanner worker id (default: host-pid)")
+    parser.add_argument("--webhook", action="store_true",
+                        help="Receive updates via webhook (TELEGRAM_WEBHOOK_URL) instead of long polling")
+    args = parser.parse_args()
+    
+    asyncio.run(main(args.role, args.worker_id, args.webhook))
@@ -0,0 +1,39 @@
+"""
+Alert Digest - Gộp nhiều cảnh báo thành một tin nhắn cho mỗi user
+Users in 'digest' mode get one message per scan (or delivery window) listing every coin
+that alerted, ranked by risk score, instead of one Telegram message per coin
+(entries are collected in the outbox and merged per user by user_db.merge_digest_alerts)
+"""
+
+from datetime import datetime
+from typing import Dict, List
+
+# Telegram hard limit is 4096 characters per message
+MAX_MESSAGE_LENGTH = 4000
+
+def build_digest_message(entries: List[Dict]) -> str:
+    """
+    Build one digest message from alert entries
+
+    Args:
+        entries: [{'symbol', 'risk_score', 'severity', 'message', 'digest_line'}]
+
+    Returns:
+        str: The full alert when there is a single entry, otherwise a ranked digest
+    """
+    if len(entries) == 1:
+        return entries[0]['message']
+
+    ranked = sorted(entries, key=lambda e: e['risk_score'], reverse=True)
+    message = f"📬 **TỔNG HỢP CẢNH BÁO - {len(ranked)} coin**\n\n"
+    footer = f"\n⏰ {datetime.now().strftime('%H:%M:%S %d/%m/%Y')}"
+    reserved = len(footer) + 40  # room for the "... và N coin khác" line
+
+    for i, entry in enumerate(ranked):
+        line = (entry.get('digest_line') or f"**{entry['symbol']}** - Risk {entry['risk_score']}/100") + "\n\n"
+        if len(message) + len(line) + reserved > MAX_MESSAGE_LENGTH:
+            message += f"... và {len(ranked) - i} coin khác\n"
+            break
+        message += line
+
+    return message + footer
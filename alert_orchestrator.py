@@ -9,14 +9,19 @@ from typing import Dict, List
 import mm_detector
 import mm_exit_detector
 import volume_analyzer
+from cooldown_ledger import CooldownLedger
+
+# Cooldown per alert severity (seconds)
+WARNING_COOLDOWN = 1800  # 30 minutes
 
 class AlertOrchestrator:
-    def __init__(self):
+    def __init__(self, cooldown_ledger: CooldownLedger = None):
         self.exchange = ccxt.binance({
             'options': {'defaultType': 'future'},
             'enableRateLimit': True
         })
         self.mm_exit_detector = mm_exit_detector.MMExitDetector(self.exchange)
+        self.cooldown_ledger = cooldown_ledger
     
     def calculate_risk_score(self, signals: List[Dict]) -> int:
         """
@@ -190,6 +195,7 @@ class AlertOrchestrator:
             
             # Generate alert message
             alert_message = self.format_alert_message(symbol, risk_score, severity, signals, recommendation)
+            digest_line = self.format_digest_line(symbol, risk_score, severity, signals)
             
             return {
                 'symbol': symbol,
@@ -198,6 +204,7 @@ class AlertOrchestrator:
                 'signals': signals,
                 'recommendation': recommendation,
                 'alert_message': alert_message,
+                'digest_line': digest_line,
                 'timestamp': datetime.now().isoformat()
             }
             
@@ -246,34 +253,68 @@ class AlertOrchestrator:
         
         return message
     
-    def should_send_alert(self, risk_score: int, severity: str, last_alert_time: float = None, cooldown: int = 3600) -> bool:
+    def format_digest_line(self, symbol: str, risk_score: int, severity: str, signals: List[Dict], max_signals: int = 2) -> str:
+        """
+        Format một dòng tóm tắt cho digest (nhiều coin trong một tin nhắn)
+        """
+        emoji = {'critical': '🚨', 'warning': '⚠️'}.get(severity, '📊')
+        line = f"{emoji} **{symbol}** - Risk {risk_score}/100"
+        
+        for signal in signals[:max_signals]:
+            line += f"\n   • {signal['message']}"
+        if len(signals) > max_signals:
+            line += f"\n   • +{len(signals) - max_signals} tín hiệu khác"
+        
+        return line
+    
+    def _cooldown_level(self, risk_score: int, severity: str, cooldown: int) -> tuple:
+        """(ledger severity key, required cooldown in seconds) for an alert"""
+        # Critical alerts: Always send (no cooldown)
+        if severity == 'critical' or risk_score >= 80:
+            return 'critical', 0
+        # Warning alerts: 30 minute cooldown
+        if severity == 'warning' or risk_score >= 50:
+            return 'warning', WARNING_COOLDOWN
+        # Info alerts: 1 hour cooldown
+        return 'info', cooldown
+    
+    def cooldown_active(self, risk_score: int, severity: str, cooldown: int = 3600, symbol: str = None) -> bool:
+        """
+        Read-only cooldown check in the ledger (records nothing)
+        Lets the caller write the alert first and record it with should_send_alert() afterwards
+        """
+        import time
+        
+        if not (symbol and self.cooldown_ledger):
+            return False
+        level, required = self._cooldown_level(risk_score, severity, cooldown)
+        last_sent = self.cooldown_ledger.last_sent(symbol, level)
+        return last_sent is not None and time.time() - last_sent < required
+    
+    def should_send_alert(self, risk_score: int, severity: str, last_alert_time: float = None, cooldown: int = 3600,
+                          symbol: str = None) -> bool:
         """
         Quyết định có nên gửi alert không dựa trên risk score và cooldown
         
         Args:
             risk_score: Risk score 0-100
             severity: 'critical' | 'warning' | 'info'
-            last_alert_time: Timestamp of last alert
+            last_alert_time: Timestamp of last alert (ignored when the cooldown ledger is used)
             cooldown: Cooldown in seconds
+            symbol: When given and a cooldown ledger is attached, the check is an atomic
+                    check-and-set on (symbol, severity) in the persistent ledger
         
         Returns:
             bool: True if should send alert
         """
         import time
         
-        # Critical alerts: Always send (no cooldown)
-        if severity == 'critical' or risk_score >= 80:
-            return True
+        level, required = self._cooldown_level(risk_score, severity, cooldown)
         
-        # Warning alerts: 30 minute cooldown
-        if severity == 'warning' or risk_score >= 50:
-            if last_alert_time is None:
-                return True
-            time_since_last = time.time() - last_alert_time
-            return time_since_last >= 1800  # 30 minutes
+        if symbol and self.cooldown_ledger:
+            return self.cooldown_ledger.try_acquire(symbol, level, required)
         
-        # Info alerts: 1 hour cooldown
-        if last_alert_time is None:
+        if required == 0 or last_alert_time is None:
             return True
         time_since_last = time.time() - last_alert_time
-        return time_since_last >= cooldown
+        return time_since_last >= required
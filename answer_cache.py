@@ -0,0 +1,102 @@
+"""
+Answer Cache - Cache câu trả lời AI
+LRU + TTL cache for LLM answers: near-identical questions about the same symbol in the same
+market state ("phân tích BTC", "Phân tích BTC!") reuse one answer instead of a new model call
+"""
+
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "300"))    # seconds, 0 disables the cache
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1000"))   # answers kept (least recently used evicted)
+PRICE_SIGNIFICANT_DIGITS = 3  # 65,432 -> 65,400: answers are reused while price stays in that band
+FUNDING_DECIMALS = 2          # funding rate in percent: 0.0100% and 0.0123% share a bucket
+
+def normalize_query(text: str) -> str:
+    """Case, punctuation and whitespace-insensitive form of a question (diacritics are kept)"""
+    text = unicodedata.normalize('NFC', text).casefold()
+    text = re.sub(r'[^\w\s]', ' ', text)
+    return ' '.join(text.split())
+
+def round_significant(value: float, digits: int = PRICE_SIGNIFICANT_DIGITS) -> float:
+    if not value:
+        return 0.0
+    return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+
+def market_bucket(market_data: Optional[dict]) -> tuple:
+    """Coarse market state: price and funding rounded, so small ticks don't change the key"""
+    if not market_data:
+        return ()
+    return (
+        market_data.get('symbol'),
+        round_significant(market_data.get('price', 0.0)),
+        round(market_data['funding_rate'], FUNDING_DECIMALS) if 'funding_rate' in market_data else None
+    )
+
+def answer_key(user_query: str, market_data: Optional[dict]) -> tuple:
+    return (normalize_query(user_query), market_bucket(market_data))
+
+class AnswerCache:
+    """
+    Usage:
+        cache = AnswerCache()
+        key = answer_key(query, market_data)
+        answer = cache.get(key)           # None on miss / expired
+        cache.put(key, answer)
+    """
+
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()  # key -> (answer, stored_at)
+        self._lock = threading.Lock()
+        self.metrics = {'hits': 0, 'misses': 0, 'bypassed': 0, 'evictions': 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.maxsize > 0
+
+    def get(self, key: Hashable) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[1] < self.ttl:
+                self._entries.move_to_end(key)
+                self.metrics['hits'] += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.metrics['misses'] += 1
+            return None
+
+    def put(self, key: Hashable, answer: str):
+        with self._lock:
+            self._entries[key] = (answer, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.metrics['evictions'] += 1
+
+    def record_bypass(self):
+        with self._lock:
+            self.metrics['bypassed'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_metrics(self) -> Dict:
+        with self._lock:
+            lookups = self.metrics['hits'] + self.metrics['misses']
+            return {
+                **self.metrics,
+                'hit_ratio': round(self.metrics['hits'] / lookups, 3) if lookups else 0.0,
+                'entries': len(self._entries),
+                'ttl': self.ttl,
+                'maxsize': self.maxsize
+            }
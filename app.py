@@ -4,6 +4,7 @@ import pandas as pd
 from datetime import datetime
 import user_db
 import mm_detector
+from single_flight import single_flight
 
 # Streamlit Page Config
 st.set_page_config(
@@ -63,6 +64,7 @@ def fetch_data():
     return mm_detector.fetch_binance_data()
 
 @st.cache_data(ttl=300)
+@single_flight("fetch_oi_and_ratio")  # cache misses for the same coin share one fetch
 def fetch_oi_and_ratio(symbol):
     """Fetch Open Interest and Long/Short ratio for a symbol"""
     exchange = ccxt.binance({
@@ -275,7 +277,7 @@ if submitted and search_term:
     
     with st.spinner('Đang quét dữ liệu từ Binance & Coinglass...'):
         # Fetch Data
-        df = fetch_data()
+        df, _ = fetch_data()
         coin_data = df[df['Symbol'] == symbol]
         
         if not coin_data.empty:
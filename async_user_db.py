@@ -0,0 +1,136 @@
+"""
+Async User DB - Facade bất đồng bộ cho user_db
+Lets async code (Telegram handlers) call user_db without blocking the event loop:
+writes go through one dedicated DB thread that batches queued writes into a single
+transaction, reads run on a small thread pool (WAL readers don't block the writer)
+"""
+
+import asyncio
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+import user_db
+
+# user_db functions that write (or may write) and therefore go to the writer thread
+WRITE_FUNCTIONS = {
+    'create_user', 'create_login_code', 'verify_login_code', 'update_subscription', 'set_alert_mode',
+    'check_subscription_expired', 'expire_subscriptions', 'queue_expiry_notices',
+    'add_tracked_coin', 'track_coin', 'remove_tracked_coin',
+    'create_users_bulk', 'update_subscriptions_bulk', 'add_tracked_coins_bulk', 'import_users',
+    'enqueue_alerts', 'claim_pending_alerts', 'renew_alert_claims', 'cancel_pending_alerts', 'merge_digest_alerts',
+    'mark_alerts_delivered', 'mark_alerts_failed',
+    'purge_delivered_alerts', 'record_delivery_outcomes', 'reactivate_user'
+}
+
+# Writers that open their own batch() (can't be nested): run alone on the writer thread
+STANDALONE_WRITE_FUNCTIONS = {'import_users'}
+
+MAX_WRITE_BATCH = 64
+READ_THREADS = 4
+
+class AsyncUserDB:
+    """
+    Usage:
+        user_db_async = AsyncUserDB()
+        coins = await user_db_async.get_tracked_coins(telegram_id)
+    """
+
+    def __init__(self, max_batch: int = MAX_WRITE_BATCH, read_threads: int = READ_THREADS):
+        self.max_batch = max_batch
+        self.read_threads = read_threads
+        self._writes: queue.Queue = queue.Queue()
+        self._writer = None
+        self._readers = None
+        self._start_lock = threading.Lock()
+        self.stats = {'reads': 0, 'writes': 0, 'write_batches': 0}
+
+    def _ensure_started(self):
+        if self._writer is None:
+            with self._start_lock:
+                if self._writer is None:
+                    self._readers = ThreadPoolExecutor(max_workers=self.read_threads, thread_name_prefix="user-db-read")
+                    self._writer = threading.Thread(target=self._write_loop, name="user-db-write", daemon=True)
+                    self._writer.start()
+
+    # ==================== CALLS ====================
+
+    async def read(self, fn: Callable, *args, **kwargs):
+        self._ensure_started()
+        self.stats['reads'] += 1
+        return await asyncio.get_running_loop().run_in_executor(self._readers, lambda: fn(*args, **kwargs))
+
+    async def write(self, fn: Callable, *args, **kwargs):
+        self._ensure_started()
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._writes.put((fn, args, kwargs, loop, future))
+        return await future
+
+    def __getattr__(self, name: str):
+        fn = getattr(user_db, name)
+        if not callable(fn):
+            return fn
+        method = self.write if name in WRITE_FUNCTIONS else self.read
+
+        async def call(*args, **kwargs):
+            return await method(fn, *args, **kwargs)
+        call.__name__ = name
+        return call
+
+    # ==================== WRITER THREAD ====================
+
+    def _write_loop(self):
+        held = None  # standalone write taken off the queue while filling a batch
+        while True:
+            items = [held or self._writes.get()]
+            held = None
+            # Everything already queued shares the transaction (one commit for the batch)
+            while len(items) < self.max_batch and not _standalone(items[0]):
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if _standalone(item):
+                    held = item
+                    break
+                items.append(item)
+
+            if _standalone(items[0]):
+                fn, args, kwargs, _, _ = items[0]
+                try:
+                    results = [(fn(*args, **kwargs), None)]
+                except Exception as e:
+                    results = [(None, e)]
+            else:
+                try:
+                    with user_db.batch() as run:
+                        results = [run(fn, *args, **kwargs) for fn, args, kwargs, _, _ in items]
+                except Exception as e:
+                    # Commit itself failed: every call in the batch failed
+                    results = [(None, e)] * len(items)
+
+            self.stats['writes'] += len(items)
+            self.stats['write_batches'] += 1
+            for (_, _, _, loop, future), (result, error) in zip(items, results):
+                try:
+                    loop.call_soon_threadsafe(_resolve, future, result, error)
+                except RuntimeError:
+                    pass  # caller's event loop already closed
+
+    def get_stats(self) -> Dict:
+        return {**self.stats, 'write_queue': self._writes.qsize()}
+
+def _standalone(item: tuple) -> bool:
+    return item[0].__name__ in STANDALONE_WRITE_FUNCTIONS
+
+def _resolve(future: asyncio.Future, result, error):
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+# Shared instance for the bot
+user_db_async = AsyncUserDB()
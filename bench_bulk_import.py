@@ -0,0 +1,98 @@
+"""
+Benchmark - bulk import vs one call per row
+Generates an export file of N users (each tracking one coin) and loads it into a temporary
+database with import_users(), then times the per-row API (create_user + add_tracked_coin)
+on a sample of the same records
+
+Run:
+    python bench_bulk_import.py --rows 1000000 --sample 20000 --format jsonl
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import user_db
+from bench_user_db_scale import db_size
+
+SYMBOLS = ["BTC/USDT", "ETH/USDT", "SOL/USDT", "XRP/USDT", "BNB/USDT", "DOGE/USDT", "ADA/USDT", "AVAX/USDT"]
+
+def write_records(path: str, rows: int, fmt: str):
+    """Write `rows` user records in export_users() format"""
+    with open(path, 'w', encoding='utf-8') as f:
+        if fmt == 'csv':
+            f.write(','.join(user_db.EXPORT_FIELDS) + '\n')
+        for telegram_id in range(1, rows + 1):
+            symbol = SYMBOLS[telegram_id % len(SYMBOLS)]
+            if fmt == 'csv':
+                f.write(f"{telegram_id},user{telegram_id},free,,immediate,{symbol}\n")
+            else:
+                f.write(json.dumps({
+                    'telegram_id': telegram_id, 'username': f"user{telegram_id}", 'subscription_tier': 'free',
+                    'subscription_expires': None, 'alert_mode': 'immediate', 'symbols': [symbol]
+                }) + '\n')
+
+def run_bulk(tmp: str, path: str, fmt: str, rows: int) -> dict:
+    user_db.DB_PATH = os.path.join(tmp, "bulk.db")
+    user_db.init_db()
+
+    started = time.perf_counter()
+    summary = user_db.import_users(path, fmt)
+    elapsed = time.perf_counter() - started
+
+    size = db_size(user_db.shard_paths())
+    user_db.close_connections()
+    return {
+        'mode': 'import_users',
+        'rows': rows,
+        'elapsed_sec': round(elapsed, 2),
+        'rows_per_sec': round(rows / elapsed, 1),
+        'db_size_mb': round(size / 1e6, 1),
+        'summary': summary
+    }
+
+def run_per_row(tmp: str, sample: int) -> dict:
+    user_db.DB_PATH = os.path.join(tmp, "per_row.db")
+    user_db.init_db()
+
+    started = time.perf_counter()
+    for telegram_id in range(1, sample + 1):
+        user_db.create_user(telegram_id, f"user{telegram_id}")
+        user_db.add_tracked_coin(telegram_id, SYMBOLS[telegram_id % len(SYMBOLS)])
+    elapsed = time.perf_counter() - started
+
+    user_db.close_connections()
+    return {
+        'mode': 'create_user + add_tracked_coin',
+        'rows': sample,
+        'elapsed_sec': round(elapsed, 2),
+        'rows_per_sec': round(sample / elapsed, 1)
+    }
+
+def main(rows: int, sample: int, fmt: str):
+    original_path = user_db.DB_PATH
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"users.{fmt}")
+            write_records(path, rows, fmt)
+            bulk = run_bulk(tmp, path, fmt, rows)
+            per_row = run_per_row(tmp, min(sample, rows))
+    finally:
+        user_db.DB_PATH = original_path
+
+    print(json.dumps({
+        'format': fmt,
+        'bulk': bulk,
+        'per_row': per_row,
+        'speedup': round(bulk['rows_per_sec'] / per_row['rows_per_sec'], 1),
+        'per_row_estimate_sec': round(rows / per_row['rows_per_sec'], 1)
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="user_db bulk import benchmark")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--sample", type=int, default=20000, help="rows timed through the per-row API")
+    parser.add_argument("--format", choices=user_db.EXPORT_FORMATS, default="jsonl")
+    args = parser.parse_args()
+    main(args.rows, args.sample, args.format)
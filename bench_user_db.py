@@ -0,0 +1,137 @@
+"""
+Benchmark - user_db throughput with and without the connection pool
+Simulates concurrent bot users running a typical command mix against a temporary database,
+then a write-only workload per shard count (speedup relative to the first count)
+
+Single-CPU results so far show no gain from sharding: 1, 2 and 4 shards ran 12.5k, 14.6k and
+12.1k write ops/s (16 threads); another run gave 15.5k for 1 shard and 14.2k for 4. Writes from
+one process are GIL-bound there, so check the sharded numbers on the target host before
+setting USER_DB_SHARDS
+
+Run:
+    python bench_user_db.py --users 1000 --threads 32 --ops 20000 --shards 1 2 4 8
+"""
+
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import user_db
+
+SYMBOLS = ["BTC/USDT", "ETH/USDT", "SOL/USDT", "XRP/USDT", "BNB/USDT", "DOGE/USDT", "ADA/USDT", "AVAX/USDT"]
+
+class LegacyConnection(sqlite3.Connection):
+    """Plain connection with the helpers user_db functions expect from pooled ones"""
+
+    batching = False
+
+    def begin_immediate(self):
+        self.execute('BEGIN IMMEDIATE')
+
+def legacy_connection(db_path: str):
+    """Pre-pool behaviour: a fresh connection for every call (replaces user_db._pooled_connection,
+    which get_connection, shard connections and fan-out queries all go through)"""
+    conn = sqlite3.connect(db_path, factory=LegacyConnection)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def setup_users(users: int):
+    for telegram_id in range(1, users + 1):
+        user_db.create_user(telegram_id, f"user{telegram_id}")
+        user_db.add_tracked_coin(telegram_id, SYMBOLS[telegram_id % len(SYMBOLS)])
+
+def run_op(users: int, rng: random.Random):
+    """One bot interaction from a random user"""
+    telegram_id = rng.randint(1, users)
+    roll = rng.random()
+    if roll < 0.35:
+        user_db.get_user_status(telegram_id)             # /status
+    elif roll < 0.65:
+        user_db.get_tracked_coins(telegram_id)           # /list
+    elif roll < 0.80:
+        user_db.get_users_tracking_coin(rng.choice(SYMBOLS))  # alert fan-out
+    elif roll < 0.95:
+        symbol = rng.choice(SYMBOLS)                      # /track + /untrack
+        user_db.add_tracked_coin(telegram_id, symbol)
+        user_db.remove_tracked_coin(telegram_id, symbol)
+    else:
+        user_db.create_login_code(telegram_id)           # /login
+
+def run_write(users: int, rng: random.Random):
+    """Write-only interaction: /track + /untrack or /login"""
+    telegram_id = rng.randint(1, users)
+    if rng.random() < 0.75:
+        symbol = rng.choice(SYMBOLS)
+        user_db.add_tracked_coin(telegram_id, symbol)
+        user_db.remove_tracked_coin(telegram_id, symbol)
+    else:
+        user_db.create_login_code(telegram_id)
+
+def run_workload(label: str, users: int, threads: int, ops: int, op=run_op) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, f"{label}.db")
+        user_db.init_db()
+        setup_users(users)
+
+        def worker(seed: int):
+            rng = random.Random(seed)
+            for _ in range(ops // threads):
+                op(users, rng)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(worker, range(threads)))
+        elapsed = time.perf_counter() - started
+
+        user_db.close_connections()
+
+    done = (ops // threads) * threads
+    return {'mode': label, 'ops': done, 'elapsed_sec': round(elapsed, 2), 'ops_per_sec': round(done / elapsed, 1)}
+
+def run_sharded(users: int, threads: int, ops: int, shards: list) -> list:
+    """Write-only workload for each shard count"""
+    original_shards = user_db.USER_DB_SHARDS
+    results = []
+    try:
+        for count in shards:
+            user_db.USER_DB_SHARDS = count
+            result = run_workload(f"writes_{count}_shards", users, threads, ops, run_write)
+            result['speedup'] = round(result['ops_per_sec'] / (results[0] if results else result)['ops_per_sec'], 2)
+            results.append({'shards': count, **result})
+    finally:
+        user_db.USER_DB_SHARDS = original_shards
+    return results
+
+def main(users: int, threads: int, ops: int, shards: list):
+    original_path, pooled_connection = user_db.DB_PATH, user_db._pooled_connection
+    try:
+        user_db._pooled_connection = legacy_connection
+        before = run_workload("connect_per_call", users, threads, ops)
+        user_db._pooled_connection = pooled_connection
+        after = run_workload("pooled_wal", users, threads, ops)
+        sharded = run_sharded(users, threads, ops, shards) if shards else []
+    finally:
+        user_db.DB_PATH, user_db._pooled_connection = original_path, pooled_connection
+
+    print(json.dumps({
+        'users': users,
+        'threads': threads,
+        'before': before,
+        'after': after,
+        'speedup': round(after['ops_per_sec'] / before['ops_per_sec'], 2),
+        'sharded_writes': sharded
+    }, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="user_db connection pool benchmark")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--shards", type=int, nargs="*", default=[1, 4],
+                        help="shard counts for the write-only workload (none to skip)")
+    args = parser.parse_args()
+    main(args.users, args.threads, args.ops, args.shards)
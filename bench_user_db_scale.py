@@ -0,0 +1,216 @@
+"""
+Benchmark - user_db at production scale
+Generates a synthetic population (tier mix, watchlist sizes, Zipf-distributed symbol
+popularity) in a temporary database, replays a mixed bot workload against it from several
+threads and reports ops/sec and p50/p99 latency per operation
+
+Run:
+    python bench_user_db_scale.py --users 100000 --coins 1000000 --ops 20000 --threads 8
+    python bench_user_db_scale.py --shards 4 --output after.json   # compare storage changes
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import user_db
+
+# Population shape
+TIER_MIX = {'free': 0.60, 'basic': 0.30, 'pro': 0.10}
+SYMBOL_COUNT = 500
+ZIPF_EXPONENT = 1.1
+LOAD_CHUNK = 50000
+
+# Workload mix: operation -> share of requests
+WORKLOAD_MIX = {
+    'login': 0.05,       # /login: create_login_code + verify_login_code
+    'track': 0.10,       # /track
+    'untrack': 0.05,     # /untrack
+    'status': 0.35,      # /status
+    'list': 0.25,        # /list
+    'fan_out': 0.1995,   # alert recipients for one symbol
+    'scan_set': 0.0005   # full subscription load (scan set / index rebuild, about once per scan)
+}
+
+# ==================== POPULATION ====================
+
+class Population:
+    """Synthetic users and Zipf-weighted symbols, reproducible from a seed"""
+
+    def __init__(self, users: int, coins: int, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.symbols = [f"COIN{rank}/USDT" for rank in range(1, SYMBOL_COUNT + 1)]
+        # Rank r is picked with probability ~ 1 / r^s: a few coins are tracked by almost everyone
+        self.weights = [1 / rank ** ZIPF_EXPONENT for rank in range(1, SYMBOL_COUNT + 1)]
+        self.cum_weights = []
+        total = 0
+        for weight in self.weights:
+            total += weight
+            self.cum_weights.append(total)
+
+        tiers = list(TIER_MIX)
+        self.tiers = self.rng.choices(tiers, weights=[TIER_MIX[t] for t in tiers], k=users)
+
+        # Free users track 1 coin, basic 1-5; pro watchlists absorb the rest of the coin budget
+        self.sizes = [1 if tier == 'free' else self.rng.randint(1, 5) if tier == 'basic' else 0
+                      for tier in self.tiers]
+        pro = [i for i, tier in enumerate(self.tiers) if tier == 'pro']
+        remaining = max(coins - sum(self.sizes), len(pro))
+        # Heavy-tailed sizes, scaled so they add up to the budget (lognormal mean is e^(s^2/2), not 1)
+        draws = [self.rng.lognormvariate(0, 0.75) for _ in pro]
+        scale = remaining / sum(draws) if draws else 0
+        for i, draw in zip(pro, draws):
+            self.sizes[i] = max(1, min(SYMBOL_COUNT, int(draw * scale)))
+        # Rounding and the symbol-universe cap leave a small gap: settle it one coin at a time
+        gap = remaining - sum(self.sizes[i] for i in pro)
+        while gap and pro:
+            step = 1 if gap > 0 else -1
+            changed = False
+            for i in pro:
+                if gap and 1 <= self.sizes[i] + step <= SYMBOL_COUNT:
+                    self.sizes[i] += step
+                    gap -= step
+                    changed = True
+            if not changed:
+                break
+
+    def symbol(self, rng: random.Random) -> str:
+        return rng.choices(self.symbols, cum_weights=self.cum_weights)[0]
+
+    def watchlist(self, size: int) -> list:
+        picked = set()
+        while len(picked) < size:
+            picked.update(self.rng.choices(self.symbols, cum_weights=self.cum_weights, k=size - len(picked)))
+        return list(picked)
+
+    def load(self) -> dict:
+        """Write the population with the bulk API (chunked transactions)"""
+        started = time.perf_counter()
+        expires = datetime.now() + timedelta(days=30)
+        coins = 0
+        for start in range(0, self.users, LOAD_CHUNK):
+            ids = range(start + 1, min(start + LOAD_CHUNK, self.users) + 1)
+            user_db.create_users_bulk([{'telegram_id': tid, 'username': f"user{tid}"} for tid in ids])
+            user_db.update_subscriptions_bulk([
+                (tid, self.tiers[tid - 1], expires) for tid in ids if self.tiers[tid - 1] != 'free'
+            ])
+            pairs = [(tid, symbol) for tid in ids for symbol in self.watchlist(self.sizes[tid - 1])]
+            user_db.add_tracked_coins_bulk(pairs, enforce_limits=False)
+            coins += len(pairs)
+        return {
+            'users': self.users,
+            'tracked_coins': coins,
+            'tiers': {tier: self.tiers.count(tier) for tier in TIER_MIX},
+            'load_sec': round(time.perf_counter() - started, 1)
+        }
+
+def db_size(paths: list) -> int:
+    """Bytes on disk, WAL files included (recent writes may not be checkpointed yet)"""
+    return sum(os.path.getsize(path + suffix) for path in paths for suffix in ('', '-wal')
+               if os.path.exists(path + suffix))
+
+# ==================== WORKLOAD ====================
+
+def run_request(operation: str, population: Population, rng: random.Random):
+    telegram_id = rng.randint(1, population.users)
+    if operation == 'login':
+        user_db.verify_login_code(user_db.create_login_code(telegram_id))
+    elif operation == 'track':
+        user_db.track_coin(telegram_id, population.symbol(rng))
+    elif operation == 'untrack':
+        user_db.remove_tracked_coin(telegram_id, population.symbol(rng))
+    elif operation == 'status':
+        user_db.get_user_status(telegram_id)
+    elif operation == 'list':
+        user_db.get_tracked_coins(telegram_id)
+    elif operation == 'fan_out':
+        user_db.get_users_tracking_coin(population.symbol(rng))
+    elif operation == 'scan_set':
+        {row['symbol'] for row in user_db.get_all_subscriptions()}
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+def replay(population: Population, ops: int, threads: int, seed: int) -> dict:
+    """Run `ops` requests drawn from WORKLOAD_MIX and collect latencies per operation"""
+    operations = list(WORKLOAD_MIX)
+    shares = [WORKLOAD_MIX[op] for op in operations]
+
+    def worker(worker_seed: int) -> dict:
+        rng = random.Random(worker_seed)
+        latencies = {op: [] for op in operations}
+        for operation in rng.choices(operations, weights=shares, k=ops // threads):
+            started = time.perf_counter()
+            run_request(operation, population, rng)
+            latencies[operation].append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(worker, [seed + i for i in range(threads)]))
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for operation in operations:
+        values = sorted(v for result in results for v in result[operation])
+        report[operation] = {
+            'count': len(values),
+            'ops_per_sec': round(len(values) / elapsed, 2),
+            'p50_ms': round(percentile(values, 0.50) * 1000, 3),
+            'p99_ms': round(percentile(values, 0.99) * 1000, 3),
+            'max_ms': round(values[-1] * 1000, 3) if values else 0.0
+        }
+    total = sum(r['count'] for r in report.values())
+    return {'elapsed_sec': round(elapsed, 2), 'ops': total, 'ops_per_sec': round(total / elapsed, 1),
+            'operations': report}
+
+def main(users: int, coins: int, ops: int, threads: int, shards: int, seed: int, output: str = None):
+    original_path, original_shards = user_db.DB_PATH, user_db.USER_DB_SHARDS
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            user_db.DB_PATH = os.path.join(tmp, "users.db")
+            user_db.USER_DB_SHARDS = shards
+            user_db.init_db()
+
+            population = Population(users, coins, seed)
+            print(f"[BENCH] Loading {users} users...")
+            loaded = population.load()
+            print(f"[BENCH] Loaded {loaded['tracked_coins']} tracked coins in {loaded['load_sec']}s")
+            user_db.clear_caches()
+
+            print(f"[BENCH] Replaying {ops} requests on {threads} threads...")
+            result = {
+                'config': {'users': users, 'coins': coins, 'ops': ops, 'threads': threads,
+                           'shards': shards, 'seed': seed},
+                'population': loaded,
+                'workload': replay(population, ops, threads, seed),
+                'db_size_mb': round(db_size(user_db.shard_paths()) / 1e6, 1),
+                'user_cache': user_db.get_cache_stats()['users']
+            }
+            user_db.close_connections()
+    finally:
+        user_db.DB_PATH, user_db.USER_DB_SHARDS = original_path, original_shards
+
+    print(json.dumps(result, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="user_db scale benchmark")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--coins", type=int, default=1000000, help="approximate total tracked coins")
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    args = parser.parse_args()
+    main(args.users, args.coins, args.ops, args.threads, args.shards, args.seed, args.output)
@@ -4,13 +4,22 @@ Handles user interactions: /start, /track, /untrack, /list, /status, /help, /men
 """
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler
+from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler, TypeHandler
 import user_db
-import mm_detector
+from async_user_db import user_db_async
+import market_snapshot
 from datetime import datetime
 
 # ==================== COMMAND HANDLERS ====================
 
+def track_error_message(result: str, symbol: str) -> str:
+    """User-facing text for a failed user_db.track_coin()"""
+    if result == user_db.ADD_ALREADY_TRACKING:
+        return f"ℹ️ Bạn đã theo dõi {symbol} rồi."
+    if result == user_db.ADD_USER_NOT_FOUND:
+        return "❌ Bạn chưa đăng ký. Gửi /start để bắt đầu."
+    return f"❌ Không thể thêm {symbol}: đã đạt giới hạn coin của gói hiện tại. Xem /status để nâng cấp."
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command - Register user and show welcome message"""
     user = update.effective_user
@@ -18,13 +27,13 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = user.username
     
     # Register user if not exists
-    db_user = user_db.create_user(telegram_id, username)
+    db_user = await user_db_async.create_user(telegram_id, username)
     
     # Check for deep linking arguments
     args = context.args
     if args and args[0] == 'login':
         # Generate login code immediately
-        code = user_db.create_login_code(telegram_id)
+        code = await user_db_async.create_login_code(telegram_id)
         await update.message.reply_text(
             f"🔐 **Mã đăng nhập Web App:**\n\n`{code}`\n\n"
             f"Mã có hiệu lực trong 5 phút. Vui lòng nhập mã này vào trang web Crypto Radar.",
@@ -85,41 +94,48 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = query.from_user.id
     
     if data == 'scan_market':
-        await query.edit_message_text("🔍 Đang quét thị trường... Vui lòng đợi giây lát.")
+        # Precomputed by the background snapshot service: no network call here
+        market_snapshot.snapshot_service.ensure_started()
+        snapshot = market_snapshot.snapshot_service.get()
         
-        # Fetch data
-        try:
-            df = mm_detector.fetch_binance_data()
-            ghost_towns = mm_detector.detect_ghost_towns(df)
-            
-            if ghost_towns.empty:
-                await query.edit_message_text("✅ Thị trường bình yên. Không phát hiện Ghost Town nào.")
-                return
+        if snapshot is None:
+            keyboard = [[InlineKeyboardButton("🔄 Quét Lại", callback_data='scan_market')]]
+            await query.edit_message_text(
+                "⏳ Dữ liệu thị trường đang được cập nhật, vui lòng thử lại sau vài giây.",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return
+        
+        ghost_towns = snapshot['ghost_towns']
+        updated = datetime.fromtimestamp(snapshot['updated_at']).strftime('%H:%M:%S')
+        
+        if not ghost_towns:
+            await query.edit_message_text("✅ Thị trường bình yên. Không phát hiện Ghost Town nào.")
+            return
 
-            # Format message
-            message = "👻 **Top 5 Ghost Towns (Giá cao - Vol thấp):**\n\n"
-            keyboard = []
-            
-            for _, row in ghost_towns.head(5).iterrows():
-                symbol = row['Symbol']
-                price = row['Price']
-                vol = row['Volume'] / 1_000_000
-                
-                message += f"• {symbol}: ${price:.4f} (Vol: ${vol:.2f}M)\n"
-                
-                keyboard.append([InlineKeyboardButton(f"Theo dõi {symbol}", callback_data=f"track_{symbol}")])
-            
-            keyboard.append([InlineKeyboardButton("🔄 Quét Lại", callback_data='scan_market')])
-            keyboard.append([InlineKeyboardButton("🔙 Quay lại Menu", callback_data='main_menu')])
+        # Format message
+        message = "👻 **Top 5 Ghost Towns (Giá cao - Vol thấp):**\n\n"
+        keyboard = []
+        
+        for row in ghost_towns[:5]:
+            symbol = row['Symbol']
+            price = row['Price']
+            vol = row['Volume'] / 1_000_000
             
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
+            message += f"• {symbol}: ${price:.4f} (Vol: ${vol:.2f}M)\n"
             
-        except Exception as e:
-            await query.edit_message_text(f"❌ Lỗi khi quét: {str(e)}")
+            keyboard.append([InlineKeyboardButton(f"Theo dõi {symbol}", callback_data=f"track_{symbol}")])
+        
+        message += f"\n_Cập nhật lúc {updated} ({snapshot['source']})_"
+        
+        keyboard.append([InlineKeyboardButton("🔄 Quét Lại", callback_data='scan_market')])
+        keyboard.append([InlineKeyboardButton("🔙 Quay lại Menu", callback_data='main_menu')])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
 
     elif data == 'my_watchlist':
-        coins = user_db.get_tracked_coins(telegram_id)
+        coins = await user_db_async.get_tracked_coins(telegram_id)
         
         if not coins:
             keyboard = [[InlineKeyboardButton("🔙 Quay lại Menu", callback_data='main_menu')]]
@@ -140,7 +156,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(message, reply_markup=reply_markup, parse_mode='Markdown')
 
     elif data == 'get_login_code':
-        code = user_db.create_login_code(telegram_id)
+        code = await user_db_async.create_login_code(telegram_id)
         await context.bot.send_message(
             chat_id=telegram_id,
             text=f"🔐 **Mã đăng nhập Web App:**\n\n`{code}`\n\n"
@@ -180,15 +196,16 @@ Liên hệ: @YourAdminUsername
 
     elif data.startswith('track_'):
         symbol = data.split('_')[1]
-        if user_db.add_tracked_coin(telegram_id, symbol):
+        result = await user_db_async.track_coin(telegram_id, symbol)
+        if result == user_db.ADD_OK:
             await query.answer(f"✅ Đã thêm {symbol} vào danh sách theo dõi!")
         else:
-            await query.answer(f"❌ Không thể thêm {symbol}. Kiểm tra giới hạn gói hoặc đã tồn tại.", show_alert=True)
+            await query.answer(track_error_message(result, symbol), show_alert=True)
 
     elif data.startswith('untrack_'):
         symbol = data.split('_')[1]
-        if user_db.remove_tracked_coin(telegram_id, symbol):
-            coins = user_db.get_tracked_coins(telegram_id)
+        if await user_db_async.remove_tracked_coin(telegram_id, symbol):
+            coins = await user_db_async.get_tracked_coins(telegram_id)
             if not coins:
                 keyboard = [[InlineKeyboardButton("🔙 Quay lại Menu", callback_data='main_menu')]]
                 reply_markup = InlineKeyboardMarkup(keyboard)
@@ -220,15 +237,16 @@ async def track_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if '/USDT' not in symbol:
         symbol = f"{symbol}/USDT"
     
-    if user_db.add_tracked_coin(telegram_id, symbol):
-        status = user_db.get_user_status(telegram_id)
+    result = await user_db_async.track_coin(telegram_id, symbol)
+    if result == user_db.ADD_OK:
+        status = await user_db_async.get_user_status(telegram_id)
         await update.message.reply_text(
             f"✅ **Đã thêm {symbol} vào danh sách theo dõi!**\n\n"
             f"Bạn đang theo dõi: {status['tracked_count']}/{status['limit']} coins",
             parse_mode='Markdown'
         )
     else:
-        await update.message.reply_text(f"❌ Không thể thêm {symbol}. Kiểm tra giới hạn gói.", parse_mode='Markdown')
+        await update.message.reply_text(track_error_message(result, symbol), parse_mode='Markdown')
 
 async def untrack_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /untrack <SYMBOL> command"""
@@ -242,7 +260,7 @@ async def untrack_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if '/USDT' not in symbol:
         symbol = f"{symbol}/USDT"
     
-    if user_db.remove_tracked_coin(telegram_id, symbol):
+    if await user_db_async.remove_tracked_coin(telegram_id, symbol):
         await update.message.reply_text(f"✅ Đã xóa {symbol} khỏi danh sách!", parse_mode='Markdown')
     else:
         await update.message.reply_text(f"❌ Bạn không theo dõi {symbol}!", parse_mode='Markdown')
@@ -250,7 +268,7 @@ async def untrack_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /list command"""
     telegram_id = update.effective_user.id
-    coins = user_db.get_tracked_coins(telegram_id)
+    coins = await user_db_async.get_tracked_coins(telegram_id)
     
     if not coins:
         await update.message.reply_text("📋 Bạn chưa theo dõi coin nào.", parse_mode='Markdown')
@@ -265,7 +283,7 @@ async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /status command"""
     telegram_id = update.effective_user.id
-    status = user_db.get_user_status(telegram_id)
+    status = await user_db_async.get_user_status(telegram_id)
     
     if not status:
         await update.message.reply_text("❌ Bạn chưa đăng ký. Gửi `/start` để bắt đầu!", parse_mode='Markdown')
@@ -281,15 +299,43 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(message, parse_mode='Markdown')
 
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /digest [on|off] command - Toggle merged alert digests"""
+    telegram_id = update.effective_user.id
+    status = await user_db_async.get_user_status(telegram_id)
+    
+    if not status:
+        await update.message.reply_text("❌ Bạn chưa đăng ký. Gửi `/start` để bắt đầu!", parse_mode='Markdown')
+        return
+    
+    if not context.args:
+        mode = 'digest' if status['alert_mode'] != 'digest' else 'immediate'
+    elif context.args[0].lower() in ('on', 'digest'):
+        mode = 'digest'
+    elif context.args[0].lower() in ('off', 'immediate'):
+        mode = 'immediate'
+    else:
+        await update.message.reply_text("❌ Cú pháp: `/digest on` hoặc `/digest off`", parse_mode='Markdown')
+        return
+    
+    await user_db_async.set_alert_mode(telegram_id, mode)
+    
+    if mode == 'digest':
+        message = "📬 **Đã bật chế độ Tổng Hợp!**\n\nCác cảnh báo trong cùng một lần quét sẽ được gộp thành một tin nhắn, xếp theo Risk Score."
+    else:
+        message = "🔔 **Đã tắt chế độ Tổng Hợp.**\n\nBạn sẽ nhận từng cảnh báo ngay khi phát hiện."
+    
+    await update.message.reply_text(message, parse_mode='Markdown')
+
 async def login_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /login command - Generate login code for Web App"""
     telegram_id = update.effective_user.id
     
-    user = user_db.get_user(telegram_id)
+    user = await user_db_async.get_user(telegram_id)
     if not user:
-        user_db.create_user(telegram_id, update.effective_user.username)
+        await user_db_async.create_user(telegram_id, update.effective_user.username)
     
-    code = user_db.create_login_code(telegram_id)
+    code = await user_db_async.create_login_code(telegram_id)
     
     await update.message.reply_text(
         f"🔐 **Mã đăng nhập Web App:**\n\n`{code}`\n\n"
@@ -310,6 +356,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 • `/untrack <SYMBOL>` - Bỏ theo dõi coin
 • `/list` - Xem danh sách coin đang theo dõi
 • `/status` - Xem gói dịch vụ hiện tại
+• `/digest on|off` - Gộp cảnh báo thành một tin nhắn mỗi lần quét
 • `/help` - Hiển thị hướng dẫn này
 
 **Gói dịch vụ:**
@@ -323,10 +370,18 @@ Bot sẽ tự động gửi cảnh báo khi coin bạn theo dõi có dấu hiệ
     
     await update.message.reply_text(message, parse_mode='Markdown')
 
+async def reactivate_on_interaction(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Any message or button press from a user we stopped alerting (unreachable chat) turns alerts back on"""
+    if update.effective_user:
+        await user_db_async.reactivate_user(update.effective_user.id)
+
 # ==================== BOT SETUP ====================
 
 def setup_bot_commands(application: Application):
     """Register all command handlers"""
+    # Runs before the command handlers (group -1) for every update
+    application.add_handler(TypeHandler(Update, reactivate_on_interaction), group=-1)
+    
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("menu", menu_command))
     application.add_handler(CommandHandler("login", login_command))
@@ -334,6 +389,7 @@ def setup_bot_commands(application: Application):
     application.add_handler(CommandHandler("untrack", untrack_command))
     application.add_handler(CommandHandler("list", list_command))
     application.add_handler(CommandHandler("status", status_command))
+    application.add_handler(CommandHandler("digest", digest_command))
     application.add_handler(CommandHandler("help", help_command))
     
     application.add_handler(CallbackQueryHandler(button_handler))
@@ -0,0 +1,67 @@
+"""
+Cooldown Ledger - Sổ ghi cooldown alert bền vững
+Persists the last alert time per (symbol, severity) in the shared scanner store, so duplicate
+suppression survives restarts and is coordinated across scanner replicas
+"""
+
+import sqlite3
+import threading
+import time
+import os
+from typing import Optional
+from scan_sharding import SCANNER_DB_PATH
+
+class CooldownLedger:
+    """
+    Atomic check-and-set cooldowns
+
+    try_acquire() is a single UPSERT: it records the alert only if the previous one for the same
+    (symbol, severity) is older than the cooldown, so two replicas can never both win the same slot.
+    """
+
+    def __init__(self, db_path: str = SCANNER_DB_PATH):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS alert_cooldowns (
+                symbol TEXT NOT NULL,
+                severity TEXT NOT NULL,
+                last_sent_at REAL NOT NULL,
+                PRIMARY KEY (symbol, severity)
+            ) WITHOUT ROWID
+        ''')
+        self._conn.commit()
+
+    def try_acquire(self, symbol: str, severity: str, cooldown: float, now: float = None) -> bool:
+        """
+        Claim the right to send an alert for (symbol, severity)
+
+        Returns:
+            bool: True if the cooldown had elapsed (and the send is now recorded), False otherwise
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            cursor = self._conn.execute('''
+                INSERT INTO alert_cooldowns (symbol, severity, last_sent_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT(symbol, severity) DO UPDATE SET last_sent_at = excluded.last_sent_at
+                WHERE alert_cooldowns.last_sent_at <= ?
+            ''', (symbol, severity, now, now - cooldown))
+            self._conn.commit()
+            return cursor.rowcount > 0
+
+    def last_sent(self, symbol: str, severity: str) -> Optional[float]:
+        """Timestamp of the last recorded alert for (symbol, severity)"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT last_sent_at FROM alert_cooldowns WHERE symbol = ? AND severity = ?',
+                (symbol, severity)
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,253 @@
+"""
+Delivery Queue - Hàng đợi gửi tin Telegram có giới hạn tốc độ
+Global + per-chat token buckets, retry_after on 429, exponential backoff on network errors,
+bounded queue (backpressure) and delivered/sec + queue depth reporting
+"""
+
+import asyncio
+import random
+import time
+from collections import deque
+from datetime import timedelta
+from typing import Callable, Dict, Optional, Tuple
+from telegram import Bot
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError, TelegramError
+
+# Telegram Bot API limits
+GLOBAL_RATE = 30       # messages / second for the whole bot
+PER_CHAT_RATE = 1      # messages / second per chat
+MAX_QUEUE_SIZE = 10000
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0     # seconds, doubled per attempt
+MAX_CHAT_BUCKETS = 50000
+
+# Delivery outcomes reported to on_done(error, outcome)
+DELIVERED = 'delivered'
+FAILED = 'failed'            # transient errors, gave up after retries
+REJECTED = 'rejected'        # this message can't be sent (bad markup, too long...)
+UNREACHABLE = 'unreachable'  # the chat will not accept any message (blocked bot, deleted account...)
+
+# BadRequest descriptions that mean the chat itself is gone
+UNREACHABLE_ERRORS = ('chat not found', 'user is deactivated', 'bot was kicked', "bot can't initiate conversation")
+
+class TokenBucket:
+    """Token bucket that hands out reservations (tokens may go negative = queued callers)"""
+
+    def __init__(self, rate: float, capacity: float = None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Take one token, returns how long the caller must wait before using it"""
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def is_idle(self) -> bool:
+        """Full bucket: safe to forget"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+def classify_error(error: Exception) -> str:
+    """Permanent errors: is the chat unreachable, or only this message rejected?"""
+    if isinstance(error, Forbidden):
+        return UNREACHABLE
+    description = str(error).lower()
+    if any(text in description for text in UNREACHABLE_ERRORS):
+        return UNREACHABLE
+    return REJECTED
+
+def _seconds(value) -> float:
+    # RetryAfter.retry_after is int or timedelta depending on python-telegram-bot version
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+class DeliveryQueue:
+    """
+    Bounded async queue of outbound Telegram messages
+
+    Usage:
+        queue = DeliveryQueue(bot)
+        await queue.start()
+        await queue.put(telegram_id, text)   # waits when the queue is full (backpressure)
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = GLOBAL_RATE, per_chat_rate: float = PER_CHAT_RATE,
+                 max_queue_size: int = MAX_QUEUE_SIZE, max_retries: int = MAX_RETRIES, workers: int = 8):
+        self.bot = bot
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self.global_bucket = TokenBucket(global_rate)
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+        self._tasks = []
+        self._delivered_times = deque(maxlen=int(global_rate * 60) + 1)
+        self.stats = {
+            'enqueued': 0,
+            'delivered': 0,
+            'failed': 0,
+            'retried': 0,
+            'rate_limited': 0,
+            'unreachable': 0,
+            'dropped': 0
+        }
+
+    # ==================== PRODUCER API ====================
+
+    async def put(self, telegram_id: int, text: str, parse_mode: str = 'Markdown',
+                  on_done: Callable[[Optional[str], str], None] = None):
+        """
+        Enqueue a message, waiting for space when the queue is full
+        on_done(error, outcome) is called once the message was delivered (error=None) or given up
+        """
+        await self.queue.put((telegram_id, text, parse_mode, on_done))
+        self.stats['enqueued'] += 1
+
+    def put_nowait(self, telegram_id: int, text: str, parse_mode: str = 'Markdown',
+                   on_done: Callable[[Optional[str], str], None] = None) -> bool:
+        """Enqueue without waiting; returns False (and counts a drop) when full"""
+        try:
+            self.queue.put_nowait((telegram_id, text, parse_mode, on_done))
+        except asyncio.QueueFull:
+            self.stats['dropped'] += 1
+            return False
+        self.stats['enqueued'] += 1
+        return True
+
+    # ==================== LIFECYCLE ====================
+
+    async def start(self):
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"delivery-{i}"))
+
+    async def join(self):
+        """Wait until every queued message was delivered or failed"""
+        await self.queue.join()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # ==================== METRICS ====================
+
+    def free_slots(self) -> int:
+        """How many messages can be queued without waiting"""
+        return self.queue.maxsize - self.queue.qsize() if self.queue.maxsize > 0 else MAX_QUEUE_SIZE
+
+    def get_stats(self, window: float = 10.0) -> Dict:
+        """Counters + delivered/sec over the last `window` seconds + queue depth"""
+        now = time.monotonic()
+        while self._delivered_times and self._delivered_times[0] < now - window:
+            self._delivered_times.popleft()
+        stats = dict(self.stats)
+        stats['queue_depth'] = self.queue.qsize()
+        stats['delivered_per_sec'] = len(self._delivered_times) / window
+        return stats
+
+    async def report_forever(self, interval: float = 30.0):
+        """Print delivery rate and queue depth periodically"""
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.get_stats()
+            if stats['enqueued']:
+                print(f"[DELIVERY] {stats['delivered_per_sec']:.1f} msg/s, queue depth {stats['queue_depth']}, "
+                      f"delivered {stats['delivered']}, failed {stats['failed']}, "
+                      f"retried {stats['retried']}, 429s {stats['rate_limited']}")
+
+    # ==================== WORKERS ====================
+
+    def _chat_bucket(self, telegram_id: int) -> TokenBucket:
+        bucket = self.chat_buckets.get(telegram_id)
+        if bucket is None:
+            if len(self.chat_buckets) >= MAX_CHAT_BUCKETS:
+                # Bound memory: forget chats whose bucket is full again
+                for chat_id in [c for c, b in self.chat_buckets.items() if b.is_idle()]:
+                    del self.chat_buckets[chat_id]
+            bucket = TokenBucket(self.per_chat_rate)
+            self.chat_buckets[telegram_id] = bucket
+        return bucket
+
+    async def _wait_for_slot(self, telegram_id: int):
+        # Global pause after a 429, then per-chat and global buckets
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+        wait = max(self._chat_bucket(telegram_id).reserve(), self.global_bucket.reserve())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _worker(self):
+        while True:
+            telegram_id, text, parse_mode, on_done = await self.queue.get()
+            try:
+                error, outcome = await self._deliver(telegram_id, text, parse_mode)
+                if on_done:
+                    on_done(error, outcome)
+            except Exception as e:
+                # Still report it: an unreported row would stay claimed (and renewed) forever
+                print(f"[ERROR] Delivery worker error for {telegram_id}: {e}")
+                self.stats['failed'] += 1
+                if on_done:
+                    on_done(str(e), FAILED)
+            finally:
+                self.queue.task_done()
+
+    async def _deliver(self, telegram_id: int, text: str, parse_mode: str) -> Tuple[Optional[str], str]:
+        """Send with retries; returns (None, DELIVERED) or (final error, outcome)"""
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_slot(telegram_id)
+            try:
+                await self.bot.send_message(chat_id=telegram_id, text=text, parse_mode=parse_mode)
+                self.stats['delivered'] += 1
+                self._delivered_times.append(time.monotonic())
+                return None, DELIVERED
+
+            except RetryAfter as e:
+                # Flood control: pause every worker for retry_after
+                retry_after = _seconds(e.retry_after)
+                self.stats['rate_limited'] += 1
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                error = e
+
+            except (Forbidden, BadRequest) as e:
+                # Permanent: not retried (blocked bot, chat not found, bad markup...)
+                outcome = classify_error(e)
+                self.stats['failed'] += 1
+                if outcome == UNREACHABLE:
+                    self.stats['unreachable'] += 1
+                print(f"[ERROR] Failed to send alert to {telegram_id}: {e}")
+                return str(e), outcome
+
+            except (TimedOut, NetworkError) as e:
+                # Transient: exponential backoff with jitter
+                delay = BACKOFF_BASE * (2 ** attempt) * (0.5 + random.random())
+                error = e
+                if attempt < self.max_retries:
+                    await asyncio.sleep(delay)
+
+            except TelegramError as e:
+                # Anything else the API raises (ChatMigrated, Conflict, InvalidToken...): not retried here,
+                # the outbox retries it up to its own attempt limit
+                self.stats['failed'] += 1
+                print(f"[ERROR] Failed to send alert to {telegram_id}: {e}")
+                return str(e), FAILED
+
+            if attempt < self.max_retries:
+                self.stats['retried'] += 1
+
+        self.stats['failed'] += 1
+        print(f"[ERROR] Giving up on alert to {telegram_id} after {self.max_retries + 1} attempts: {error}")
+        return str(error), FAILED
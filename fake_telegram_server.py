@@ -0,0 +1,239 @@
+"""
+Fake Telegram Bot API Server - Dùng cho load test
+Implements getMe / sendMessage with Telegram-like flood limits (429 + retry_after)
+and blocked chats (403), so the delivery queue can be load-tested without hitting Telegram.
+Can also play Telegram's side of webhook mode by posting updates to the bot's webhook endpoint
+
+Run:
+    python fake_telegram_server.py --port 8081
+    python fake_telegram_server.py --load-test --messages 3000 --chats 500
+    python fake_telegram_server.py --webhook-load-test --updates 2000 --chats 500 --concurrent-updates 64
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from delivery_queue import TokenBucket
+
+def create_app(global_rate: float = 30, per_chat_rate: float = 1, blocked_chats: set = None,
+               latency: float = 0.02) -> FastAPI:
+    """Build a fake Bot API app with its own rate limits and counters"""
+    app = FastAPI(title="Fake Telegram Bot API")
+    global_bucket = TokenBucket(global_rate)
+    chat_buckets = {}
+    blocked = set(blocked_chats or ())
+    stats = {'sent': 0, 'rate_limited': 0, 'blocked': 0}
+    app.state.stats = stats
+
+    async def read_params(request: Request) -> dict:
+        if request.headers.get('content-type', '').startswith('application/json'):
+            return await request.json()
+        form = await request.form()
+        return dict(form)
+
+    def too_many_requests(retry_after: int):
+        stats['rate_limited'] += 1
+        return JSONResponse(status_code=429, content={
+            'ok': False,
+            'error_code': 429,
+            'description': f'Too Many Requests: retry after {retry_after}',
+            'parameters': {'retry_after': retry_after}
+        })
+
+    @app.post("/bot{token}/getMe")
+    @app.get("/bot{token}/getMe")
+    async def get_me(token: str):
+        return {'ok': True, 'result': {
+            'id': 1, 'is_bot': True, 'first_name': 'Fake Radar', 'username': 'fake_radar_bot',
+            'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False
+        }}
+
+    @app.post("/bot{token}/sendMessage")
+    async def send_message(token: str, request: Request):
+        params = await read_params(request)
+        chat_id = int(params['chat_id'])
+
+        if chat_id in blocked:
+            stats['blocked'] += 1
+            return JSONResponse(status_code=403, content={
+                'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'
+            })
+
+        # Reject (don't queue) when over the limit, like Telegram does
+        chat_bucket = chat_buckets.setdefault(chat_id, TokenBucket(per_chat_rate))
+        for bucket in (global_bucket, chat_bucket):
+            wait = bucket.reserve()
+            if wait > 0:
+                bucket.tokens += 1  # rejected request doesn't consume a token
+                return too_many_requests(max(1, int(wait + 0.999)))
+
+        await asyncio.sleep(latency)
+        stats['sent'] += 1
+        return {'ok': True, 'result': {
+            'message_id': stats['sent'],
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text', '')
+        }}
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+async def run_load_test(port: int, messages: int, chats: int, blocked: int):
+    """Drive DeliveryQueue against the fake server and report delivered/sec and queue depth"""
+    import uvicorn
+    from telegram import Bot
+    from delivery_queue import DeliveryQueue
+
+    blocked_chats = set(range(1, blocked + 1))
+    app = create_app(blocked_chats=blocked_chats)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    bot = Bot("123456:FAKE", base_url=f"http://127.0.0.1:{port}/bot")
+    await bot.initialize()
+    queue = DeliveryQueue(bot, max_queue_size=1000)
+    await queue.start()
+
+    started = time.monotonic()
+
+    async def report():
+        while True:
+            await asyncio.sleep(2)
+            stats = queue.get_stats(window=2)
+            print(f"[LOAD] t={time.monotonic() - started:5.1f}s delivered/sec={stats['delivered_per_sec']:5.1f} "
+                  f"queue_depth={stats['queue_depth']:4d} delivered={stats['delivered']} 429s={stats['rate_limited']}")
+
+    reporter = asyncio.create_task(report())
+
+    # Popular coin alert fanned out to many chats (producer blocks when the queue is full)
+    for i in range(messages):
+        await queue.put(i % chats + 1, f"Load test alert #{i}")
+    await queue.join()
+
+    elapsed = time.monotonic() - started
+    reporter.cancel()
+    await queue.stop()
+    await bot.shutdown()
+
+    stats = queue.get_stats()
+    print(json.dumps({
+        'messages': messages,
+        'elapsed_sec': round(elapsed, 2),
+        'delivered_per_sec': round(stats['delivered'] / elapsed, 2),
+        'delivered': stats['delivered'],
+        'failed': stats['failed'],
+        'retried': stats['retried'],
+        'client_429s': stats['rate_limited'],
+        'server': app.state.stats
+    }, indent=2))
+
+    server.should_exit = True
+    await server_task
+
+def make_command_update(update_id: int, chat_id: int, command: str = "/help") -> dict:
+    """A private-chat command message, as Telegram posts it to a webhook"""
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': f'User{chat_id}'},
+            'text': command,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+        }
+    }
+
+async def run_webhook_load_test(port: int, updates: int, chats: int, concurrent_updates: int,
+                                senders: int = 100):
+    """Post command updates to the bot's webhook route and report updates/sec and reply latency"""
+    import httpx
+    import uvicorn
+    import telegram_webhook
+
+    # Replies go back to the fake Bot API; limits are lifted so we measure the bot, not the API
+    api_app = create_app(global_rate=100000, per_chat_rate=100000, latency=0.05)
+    api_server = uvicorn.Server(uvicorn.Config(api_app, host="127.0.0.1", port=port, log_level="warning"))
+    api_task = asyncio.create_task(api_server.serve())
+    while not api_server.started:
+        await asyncio.sleep(0.05)
+
+    application = telegram_webhook.build_application(
+        "123456:FAKE", concurrent_updates=concurrent_updates, base_url=f"http://127.0.0.1:{port}/bot"
+    )
+    webhook_app = FastAPI(title="Webhook load test")
+    webhook_stats = telegram_webhook.attach_webhook(webhook_app, application, secret_token="load-test")
+    await telegram_webhook.start_webhook(application)
+    bot_server = uvicorn.Server(uvicorn.Config(webhook_app, host="127.0.0.1", port=port + 1, log_level="warning"))
+    bot_task = asyncio.create_task(bot_server.serve())
+    while not bot_server.started:
+        await asyncio.sleep(0.05)
+
+    url = f"http://127.0.0.1:{port + 1}{telegram_webhook.WEBHOOK_PATH}"
+    headers = {telegram_webhook.SECRET_HEADER: "load-test"}
+    semaphore = asyncio.Semaphore(senders)
+    post_latencies = []
+
+    async with httpx.AsyncClient(timeout=30) as client:
+        async def post(update_id: int):
+            async with semaphore:
+                t0 = time.monotonic()
+                await client.post(url, json=make_command_update(update_id, update_id % chats + 1), headers=headers)
+                post_latencies.append(time.monotonic() - t0)
+
+        started = time.monotonic()
+        await asyncio.gather(*(post(i) for i in range(1, updates + 1)))
+        accepted_in = time.monotonic() - started
+
+        # Every accepted update is answered with one sendMessage
+        while api_app.state.stats['sent'] < webhook_stats['received']:
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+
+    post_latencies.sort()
+    print(json.dumps({
+        'updates': updates,
+        'concurrent_updates': concurrent_updates,
+        'accepted_per_sec': round(updates / accepted_in, 2),
+        'handled_per_sec': round(api_app.state.stats['sent'] / elapsed, 2),
+        'elapsed_sec': round(elapsed, 2),
+        'webhook_p50_ms': round(post_latencies[len(post_latencies) // 2] * 1000, 1),
+        'webhook_p99_ms': round(post_latencies[int(len(post_latencies) * 0.99)] * 1000, 1),
+        'webhook': webhook_stats,
+        'replies': api_app.state.stats['sent']
+    }, indent=2))
+
+    await telegram_webhook.stop_webhook(application)
+    bot_server.should_exit = True
+    api_server.should_exit = True
+    await asyncio.gather(bot_task, api_task)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--load-test", action="store_true", help="Run the delivery queue load test")
+    parser.add_argument("--messages", type=int, default=3000)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--blocked", type=int, default=10, help="Number of chats that blocked the bot")
+    parser.add_argument("--webhook-load-test", action="store_true", help="Post updates to the bot's webhook route")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrent-updates", type=int, default=64, help="Bot handlers running at once")
+    args = parser.parse_args()
+
+    if args.webhook_load_test:
+        asyncio.run(run_webhook_load_test(args.port, args.updates, args.chats, args.concurrent_updates))
+    elif args.load_test:
+        asyncio.run(run_load_test(args.port, args.messages, args.chats, args.blocked))
+    else:
+        import uvicorn
+        print(f"Fake Telegram Bot API on http://127.0.0.1:{args.port}/bot<token>/")
+        uvicorn.run(create_app(), host="127.0.0.1", port=args.port)
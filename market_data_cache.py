@@ -0,0 +1,83 @@
+"""
+Market Data Cache - Cache TTL cho dữ liệu thị trường
+Per-key TTL cache for async upstream fetches with stale-while-revalidate: once a key is warm,
+callers get the cached value immediately and an expired entry is refreshed in the background
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+MAX_STALE = 300  # seconds an expired value may still be served while it is being refreshed
+
+class MarketDataCache:
+    """
+    Usage:
+        cache = MarketDataCache()
+        ticker = await cache.get(("ticker", "BTCUSDT"), 3, fetch_ticker, "BTCUSDT", max_stale=12)
+
+    - fresh entry: returned as is
+    - expired entry (less than max_stale past its TTL): returned as is, one background refresh is started
+    - missing or too old: the caller waits for the fetch (concurrent callers share it)
+    Empty results (failed fetch) are not cached, so a failed refresh keeps serving the last value.
+    max_stale can be given per call, so fast-moving data is never served much older than its TTL.
+    """
+
+    def __init__(self, max_stale: float = MAX_STALE):
+        self.max_stale = max_stale
+        self._entries: Dict[Hashable, tuple] = {}  # key -> (value, fetched_at)
+        self._refreshing: Dict[Hashable, asyncio.Task] = {}
+        self.metrics = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_failures': 0}
+
+    async def get(self, key: Hashable, ttl: float, fetch: Callable[..., Awaitable[Any]], *args,
+                  max_stale: Optional[float] = None) -> Any:
+        if max_stale is None:
+            max_stale = self.max_stale
+        entry = self._entries.get(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < ttl:
+                self.metrics['hits'] += 1
+                return value
+            if age < ttl + max_stale:
+                self.metrics['stale_hits'] += 1
+                self._refresh(key, fetch, *args)
+                return value
+
+        self.metrics['misses'] += 1
+        # Shielded: a cancelled caller doesn't cancel the fetch other callers wait on
+        return await asyncio.shield(self._refresh(key, fetch, *args))
+
+    def _refresh(self, key: Hashable, fetch: Callable[..., Awaitable[Any]], *args) -> asyncio.Task:
+        """Start a fetch for key unless one is already running"""
+        task = self._refreshing.get(key)
+        if task is None:
+            self.metrics['refreshes'] += 1
+            task = self._refreshing[key] = asyncio.ensure_future(self._fetch(key, fetch, *args))
+            # Background refreshes have no awaiting caller: retrieve their exception here
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return task
+
+    async def _fetch(self, key: Hashable, fetch: Callable[..., Awaitable[Any]], *args) -> Any:
+        try:
+            value = await fetch(*args)
+            if value:
+                self._entries[key] = (value, time.time())
+            else:
+                self.metrics['refresh_failures'] += 1
+            return value
+        finally:
+            del self._refreshing[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_metrics(self) -> Dict:
+        lookups = self.metrics['hits'] + self.metrics['stale_hits'] + self.metrics['misses']
+        return {
+            **self.metrics,
+            'hit_ratio': round((self.metrics['hits'] + self.metrics['stale_hits']) / lookups, 3) if lookups else 0.0,
+            'entries': len(self._entries),
+            'refreshing': len(self._refreshing)
+        }
@@ -0,0 +1,77 @@
+"""
+Market Snapshot - Ảnh chụp thị trường chạy nền
+Refreshes the futures ticker universe and the ghost-town / fake-pump leaderboards every N seconds
+in a background task, so bot handlers read a precomputed result without any network call
+"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+import mm_detector
+
+SNAPSHOT_INTERVAL = int(os.getenv("MARKET_SNAPSHOT_INTERVAL", "60"))  # seconds between refreshes
+LEADERBOARD_SIZE = 20
+
+class MarketSnapshotService:
+    """
+    Keeps the latest market snapshot in memory
+
+    Usage:
+        service.ensure_started()      # from a running event loop
+        snapshot = service.get()      # None until the first refresh completed
+    """
+
+    def __init__(self, interval: int = SNAPSHOT_INTERVAL, fetch: Callable = mm_detector.fetch_binance_data):
+        self.interval = interval
+        self.fetch = fetch
+        self._snapshot: Optional[Dict] = None
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def refresh(self) -> bool:
+        """Download the ticker universe and rebuild the leaderboards (blocking)"""
+        df, source = self.fetch()
+        if df.empty:
+            # Keep serving the previous snapshot rather than an empty market
+            print(f"[SNAPSHOT] Refresh failed ({source}), keeping previous snapshot")
+            return False
+
+        snapshot = {
+            'tickers': df,
+            'source': source,
+            'ghost_towns': mm_detector.detect_ghost_towns(df).head(LEADERBOARD_SIZE).to_dict('records'),
+            'fake_pumps': mm_detector.detect_fake_pumps(df).head(LEADERBOARD_SIZE).to_dict('records'),
+            'updated_at': time.time()
+        }
+        with self._lock:
+            self._snapshot = snapshot
+        return True
+
+    def get(self) -> Optional[Dict]:
+        """Latest snapshot (never blocks, never touches the network)"""
+        with self._lock:
+            return self._snapshot
+
+    def age(self) -> Optional[float]:
+        snapshot = self.get()
+        return time.time() - snapshot['updated_at'] if snapshot else None
+
+    async def run_forever(self):
+        while True:
+            try:
+                # Download off the event loop
+                await asyncio.to_thread(self.refresh)
+            except Exception as e:
+                print(f"[SNAPSHOT] Refresh error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def ensure_started(self):
+        """Start the refresh task on the running event loop (idempotent)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run_forever(), name="market-snapshot")
+            print(f"[SNAPSHOT] Refreshing market snapshot every {self.interval}s")
+
+# Shared by the bot handlers
+snapshot_service = MarketSnapshotService()
@@ -8,7 +8,10 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
+from single_flight import single_flight
 
+# Concurrent callers (bot, web app, snapshot service) share one download
+@single_flight("fetch_binance_data")
 def fetch_binance_data():
     """Fetches ticker data from Binance Futures (Public API to avoid region blocks)"""
     import requests
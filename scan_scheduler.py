@@ -0,0 +1,137 @@
+"""
+Scan Scheduler - Lên lịch quét thị trường theo nến
+Triggers scans just after candle close boundaries, never overlaps itself, and tracks cycle lag / overrun
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+# Candle timeframes supported by the scanner (seconds)
+TIMEFRAME_SECONDS = {
+    '1m': 60,
+    '5m': 300,
+    '15m': 900,
+    '1h': 3600
+}
+
+# name -> ScanScheduler, for reporting (/health)
+_schedulers: Dict[str, 'ScanScheduler'] = {}
+
+def get_all_metrics() -> Dict[str, Dict]:
+    """Metrics of every scheduler created in this process"""
+    return {name: scheduler.get_metrics() for name, scheduler in list(_schedulers.items())}
+
+def next_candle_close(now: float, interval: int, close_delay: float = 0) -> float:
+    """
+    Tính thời điểm quét tiếp theo: ngay sau khi nến hiện tại đóng
+
+    Args:
+        now: Current unix timestamp
+        interval: Candle length in seconds (300 = 5m)
+        close_delay: Seconds to wait after the close so the exchange finalizes the candle
+
+    Returns:
+        Unix timestamp of the next trigger (always > now)
+    """
+    boundary = (int((now - close_delay) // interval) + 1) * interval
+    return boundary + close_delay
+
+class ScanScheduler:
+    """
+    Drift-free scheduler cho scan_and_alert
+
+    - Mỗi chu kỳ bắt đầu tại mốc đóng nến + close_delay (không cộng dồn thời gian quét)
+    - Nếu chu kỳ trước vẫn đang chạy thì bỏ qua chu kỳ mới (không bao giờ chạy chồng)
+    - scan_func nhận `deadline` để tự cắt bớt symbol khi quét quá lâu (load shedding)
+    """
+
+    def __init__(self, scan_func: Callable[..., Awaitable], interval: int = 300,
+                 close_delay: float = 3.0, clock: Callable[[], float] = time.time, name: str = "scanner"):
+        self.name = name
+        self.scan_func = scan_func
+        self.interval = interval
+        self.close_delay = close_delay
+        self.clock = clock
+        self._current: Optional[asyncio.Task] = None
+        self._last_scheduled: Optional[float] = None
+        self.metrics = {
+            'cycles': 0,           # Chu kỳ đã chạy xong
+            'skipped': 0,          # Chu kỳ bị bỏ qua (đang chạy chồng hoặc lỡ mốc)
+            'overruns': 0,         # Chu kỳ chạy lâu hơn interval
+            'last_lag': 0.0,       # Độ trễ so với mốc đóng nến (giây)
+            'max_lag': 0.0,
+            'last_duration': 0.0,
+            'last_overrun': 0.0,
+            'last_scheduled_at': None
+        }
+        _schedulers[name] = self
+
+    def get_metrics(self) -> Dict:
+        """Snapshot of scheduler metrics (cycle lag, duration, overrun, skipped cycles)"""
+        metrics = dict(self.metrics)
+        metrics['running'] = self.is_running()
+        return metrics
+
+    def is_running(self) -> bool:
+        return self._current is not None and not self._current.done()
+
+    async def run_forever(self):
+        """Main scheduling loop"""
+        while True:
+            # Never before the last boundary: a sleep that wakes a little early must not
+            # reschedule the boundary it was sleeping towards
+            now = self.clock()
+            if self._last_scheduled is not None:
+                now = max(now, self._last_scheduled)
+            scheduled = next_candle_close(now, self.interval, self.close_delay)
+            await asyncio.sleep(max(0.0, scheduled - self.clock()))
+            self.trigger(scheduled)
+
+    def trigger(self, scheduled: float) -> Optional[asyncio.Task]:
+        """
+        Start a scan cycle for the candle boundary `scheduled`
+        Returns the cycle task, or None if the cycle was skipped
+        """
+        # Boundaries we slept through (event loop blocked or clock jump)
+        if self._last_scheduled is not None:
+            missed = int(round((scheduled - self._last_scheduled) / self.interval)) - 1
+            if missed > 0:
+                self.metrics['skipped'] += missed
+                print(f"[SCHEDULER] Missed {missed} candle boundary(ies)")
+        self._last_scheduled = scheduled
+
+        if self.is_running():
+            self.metrics['skipped'] += 1
+            print(f"[SCHEDULER] Previous scan still running, skipping cycle "
+                  f"{datetime.fromtimestamp(scheduled).strftime('%H:%M:%S')}")
+            return None
+
+        self._current = asyncio.create_task(self._run_cycle(scheduled))
+        return self._current
+
+    async def _run_cycle(self, scheduled: float):
+        started = self.clock()
+        lag = started - scheduled
+        self.metrics['last_lag'] = lag
+        self.metrics['max_lag'] = max(self.metrics['max_lag'], lag)
+        self.metrics['last_scheduled_at'] = scheduled
+
+        try:
+            await self.scan_func(deadline=scheduled + self.interval)
+        except Exception as e:
+            print(f"[ERROR] Scheduled scan failed: {e}")
+        finally:
+            duration = self.clock() - started
+            overrun = max(0.0, lag + duration - self.interval)
+            self.metrics['cycles'] += 1
+            self.metrics['last_duration'] = duration
+            self.metrics['last_overrun'] = overrun
+            if overrun > 0:
+                self.metrics['overruns'] += 1
+                print(f"[SCHEDULER] Scan overran the {self.interval}s cycle by {overrun:.1f}s")
+            print(f"[SCHEDULER] Cycle done: lag={lag:.2f}s (max {self.metrics['max_lag']:.2f}s) "
+                  f"duration={duration:.1f}s overrun={overrun:.1f}s "
+                  f"cycles={self.metrics['cycles']} overruns={self.metrics['overruns']} "
+                  f"skipped={self.metrics['skipped']}")
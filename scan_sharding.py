@@ -0,0 +1,156 @@
+"""
+Scan Sharding - Chia symbol cho nhiều scanner worker
+Workers register in a shared SQLite store, split tracked symbols with a consistent hash ring,
+and rebalance automatically when a worker stops heartbeating.
+Alerts reach the single delivery process through the user_db alert outbox
+"""
+
+import sqlite3
+import hashlib
+import bisect
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Iterable, List, Optional, Set
+
+# Shared coordination store (same machine / shared volume)
+SCANNER_DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'scanner.db')
+
+WORKER_TTL = 30  # seconds without heartbeat before a worker is considered dead
+VIRTUAL_NODES = 64  # points per worker on the hash ring
+
+def _hash(key: str) -> int:
+    return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+class HashRing:
+    """Consistent hash ring: adding/removing a worker only moves ~1/N of the symbols"""
+
+    def __init__(self, nodes: Iterable[str], vnodes: int = VIRTUAL_NODES):
+        self.nodes = sorted(set(nodes))
+        self._ring = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self.nodes
+            for i in range(vnodes)
+        )
+        self._keys = [h for h, _ in self._ring]
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the node owning `key`"""
+        if not self._ring:
+            return None
+        idx = bisect.bisect(self._keys, _hash(key)) % len(self._ring)
+        return self._ring[idx][1]
+
+def connect(db_path: str = SCANNER_DB_PATH) -> sqlite3.Connection:
+    """Open the coordination store (creates tables on first use)"""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS scanner_workers (
+            worker_id TEXT PRIMARY KEY,
+            hostname TEXT,
+            pid INTEGER,
+            started_at REAL NOT NULL,
+            heartbeat_at REAL NOT NULL
+        )
+    ''')
+
+    conn.commit()
+    return conn
+
+class ShardCoordinator:
+    """
+    Membership + symbol ownership for one scanner worker
+
+    Usage:
+        shard = ShardCoordinator()
+        shard.start_heartbeat()
+        my_symbols = shard.claim_symbols(all_symbols)
+    """
+
+    def __init__(self, worker_id: str = None, db_path: str = SCANNER_DB_PATH, ttl: int = WORKER_TTL):
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.db_path = db_path
+        self.ttl = ttl
+        self._members: List[str] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ==================== MEMBERSHIP ====================
+
+    def heartbeat(self, conn: sqlite3.Connection = None):
+        """Register / refresh this worker"""
+        own_conn = conn is None
+        conn = conn or connect(self.db_path)
+        now = time.time()
+        try:
+            conn.execute('''
+                INSERT INTO scanner_workers (worker_id, hostname, pid, started_at, heartbeat_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+            ''', (self.worker_id, socket.gethostname(), os.getpid(), now, now))
+            conn.commit()
+        finally:
+            if own_conn:
+                conn.close()
+
+    def start_heartbeat(self):
+        """Heartbeat from a background thread so long (blocking) scans don't look like a dead worker"""
+        self.heartbeat()
+
+        def loop():
+            conn = connect(self.db_path)
+            try:
+                while not self._stop.wait(self.ttl / 3):
+                    try:
+                        self.heartbeat(conn)
+                    except sqlite3.Error as e:
+                        print(f"[ERROR] Shard heartbeat failed: {e}")
+            finally:
+                conn.close()
+
+        self._thread = threading.Thread(target=loop, name="shard-heartbeat", daemon=True)
+        self._thread.start()
+
+    def leave(self):
+        """Deregister so peers take over our symbols immediately"""
+        self._stop.set()
+        conn = connect(self.db_path)
+        try:
+            conn.execute('DELETE FROM scanner_workers WHERE worker_id = ?', (self.worker_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def live_workers(self) -> List[str]:
+        """Workers that heartbeated within the TTL (dead ones are purged)"""
+        cutoff = time.time() - self.ttl
+        conn = connect(self.db_path)
+        try:
+            conn.execute('DELETE FROM scanner_workers WHERE heartbeat_at < ?', (cutoff,))
+            conn.commit()
+            rows = conn.execute('SELECT worker_id FROM scanner_workers ORDER BY worker_id').fetchall()
+            return [row['worker_id'] for row in rows]
+        finally:
+            conn.close()
+
+    # ==================== OWNERSHIP ====================
+
+    def claim_symbols(self, symbols: Iterable[str]) -> Set[str]:
+        """Return the subset of `symbols` this worker should scan this cycle"""
+        self.heartbeat()
+        members = self.live_workers()
+        if self.worker_id not in members:
+            members.append(self.worker_id)
+
+        if members != self._members:
+            print(f"[SHARD] Rebalanced: {len(members)} live worker(s) {members}")
+            self._members = members
+
+        ring = HashRing(members)
+        return {symbol for symbol in symbols if ring.get(symbol) == self.worker_id}
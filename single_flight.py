@@ -0,0 +1,142 @@
+"""
+Single Flight - Gộp các request giống nhau đang chạy đồng thời
+Concurrent calls with the same key share one in-flight execution and its result,
+so a burst of identical requests costs a single upstream fetch
+"""
+
+import asyncio
+import functools
+import inspect
+import threading
+from typing import Any, Callable, Dict, Hashable
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Thread-safe call coalescing
+
+    Usage:
+        flight = SingleFlight("tickers")
+        data = flight.do("BTC/USDT", fetch, "BTC/USDT")
+
+    The result object is shared by every coalesced caller: treat it as read-only.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.metrics = {'calls': 0, 'executions': 0, 'coalesced': 0}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) unless an identical call is already running, then wait for its result"""
+        with self._lock:
+            self.metrics['calls'] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.metrics['executions'] += 1
+            else:
+                self.metrics['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def get_metrics(self) -> Dict:
+        with self._lock:
+            return {**self.metrics, 'in_flight': len(self._calls)}
+
+class AsyncSingleFlight:
+    """
+    Call coalescing for coroutines (one event loop)
+
+    Usage:
+        flight = AsyncSingleFlight("market_data")
+        data = await flight.do("BTCUSDT", fetch, "BTCUSDT")
+
+    The shared task is shielded: a caller that gets cancelled (client disconnected)
+    doesn't cancel the fetch the other callers are waiting on.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.metrics = {'calls': 0, 'executions': 0, 'coalesced': 0}
+
+    async def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """Await fn(*args, **kwargs) unless an identical call is already running, then share its result"""
+        self.metrics['calls'] += 1
+        task = self._tasks.get(key)
+        if task is None:
+            self.metrics['executions'] += 1
+            task = self._tasks[key] = asyncio.ensure_future(fn(*args, **kwargs))
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.metrics['coalesced'] += 1
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()  # retrieved: no "exception never retrieved" warning when every caller left
+
+    def get_metrics(self) -> Dict:
+        return {**self.metrics, 'in_flight': len(self._tasks)}
+
+# name -> SingleFlight / AsyncSingleFlight, for reporting
+_flights: Dict[str, Any] = {}
+
+def single_flight(name: str = None, key: Callable[..., Hashable] = None):
+    """
+    Decorator: coalesce concurrent calls with the same arguments
+    Works on plain functions (threads) and on coroutine functions (one event loop)
+
+    Args:
+        name: Metrics name (default: function qualname)
+        key: Builds the coalescing key from the call arguments (default: all arguments)
+    """
+    def decorator(fn):
+        flight_name = name or fn.__qualname__
+        if inspect.iscoroutinefunction(fn):
+            flight = _flights.setdefault(flight_name, AsyncSingleFlight(flight_name))
+
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                call_key = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+                return await flight.do(call_key, fn, *args, **kwargs)
+        else:
+            flight = _flights.setdefault(flight_name, SingleFlight(flight_name))
+
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                call_key = key(*args, **kwargs) if key else (args, tuple(sorted(kwargs.items())))
+                return flight.do(call_key, fn, *args, **kwargs)
+
+        wrapper.flight = flight
+        return wrapper
+    return decorator
+
+def get_all_metrics() -> Dict[str, Dict]:
+    """Coalescing metrics of every decorated function"""
+    return {name: flight.get_metrics() for name, flight in _flights.items()}
@@ -0,0 +1,125 @@
+"""
+Subscription Index - Bảng tra symbol -> người theo dõi trong bộ nhớ
+Built with one query at startup and kept current through user_db change notifications,
+so building the scan set and resolving alert recipients are O(1) lookups
+"""
+
+import threading
+from typing import Dict, List, Set
+import user_db
+
+class SubscriptionIndex:
+    """
+    In-memory symbol -> subscribers index
+
+    Writes made in this process arrive through user_db.add_change_listener().
+    Writes made by other processes (web app, other bot replicas) are picked up by
+    refresh_if_changed(), which reloads only when their subscription write counters moved
+    (outbox traffic, login codes and this process's own writes never trigger a reload).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._users: Dict[int, Dict] = {}               # telegram_id -> user info
+        self._by_symbol: Dict[str, Set[int]] = {}       # symbol -> telegram_ids
+        self._version = None  # user_db.get_change_version() the index reflects
+
+    # ==================== LOADING ====================
+
+    def load(self):
+        """(Re)build the whole index with a single query"""
+        # Read the version first: a write landing between the two reads causes one extra reload, never a miss
+        version = user_db.get_change_version()
+        rows = user_db.get_all_subscriptions()
+
+        users = {}
+        by_symbol = {}
+        for row in rows:
+            telegram_id = row['telegram_id']
+            users[telegram_id] = {
+                'telegram_id': telegram_id,
+                'username': row['username'],
+                'subscription_tier': row['subscription_tier'],
+                'alert_mode': row['alert_mode']
+            }
+            by_symbol.setdefault(row['symbol'], set()).add(telegram_id)
+
+        with self._lock:
+            self._users = users
+            self._by_symbol = by_symbol
+            self._version = version
+
+        print(f"[INDEX] Loaded {len(rows)} subscriptions for {len(by_symbol)} symbols")
+
+    def refresh_if_changed(self) -> bool:
+        """Reload if another process changed subscriptions since the last load"""
+        with self._lock:
+            changed = self._version is None or user_db.get_change_version() != self._version
+        if changed:
+            self.load()
+        return changed
+
+    def attach(self):
+        """Load the index and follow in-process changes"""
+        self.load()
+        user_db.add_change_listener(self.apply_change)
+        return self
+
+    # ==================== CHANGE NOTIFICATIONS ====================
+
+    def apply_change(self, event: str, telegram_id: int, data: Dict):
+        """user_db change listener"""
+        with self._lock:
+            if event == 'coin_added':
+                if telegram_id not in self._users:
+                    user = user_db.get_user(telegram_id) or {}
+                    self._users[telegram_id] = {
+                        'telegram_id': telegram_id,
+                        'username': user.get('username'),
+                        'subscription_tier': user.get('subscription_tier', 'free'),
+                        'alert_mode': user.get('alert_mode', 'immediate')
+                    }
+                self._by_symbol.setdefault(data['symbol'], set()).add(telegram_id)
+
+            elif event == 'coin_removed':
+                subscribers = self._by_symbol.get(data['symbol'])
+                if subscribers is not None:
+                    subscribers.discard(telegram_id)
+                    if not subscribers:
+                        del self._by_symbol[data['symbol']]
+
+            elif event == 'subscription_updated':
+                if telegram_id in self._users:
+                    self._users[telegram_id]['subscription_tier'] = data['subscription_tier']
+
+            elif event == 'alert_mode_updated':
+                if telegram_id in self._users:
+                    self._users[telegram_id]['alert_mode'] = data['alert_mode']
+
+            elif event == 'user_deactivated':
+                # Unreachable chats leave the fan-out (and the scan set if nobody else tracks the coin)
+                self._users.pop(telegram_id, None)
+                for symbol in [s for s, ids in self._by_symbol.items() if telegram_id in ids]:
+                    self._by_symbol[symbol].discard(telegram_id)
+                    if not self._by_symbol[symbol]:
+                        del self._by_symbol[symbol]
+
+            elif event == 'user_reactivated':
+                for coin in user_db.get_tracked_coins(telegram_id):
+                    self.apply_change('coin_added', telegram_id, {'symbol': coin['symbol']})
+
+    # ==================== LOOKUPS ====================
+
+    def symbols(self) -> Set[str]:
+        """All symbols tracked by at least one user (the scan set)"""
+        with self._lock:
+            return set(self._by_symbol)
+
+    def subscribers(self, symbol: str) -> List[Dict]:
+        """Users tracking `symbol` (same shape as user_db.get_users_tracking_coin)"""
+        with self._lock:
+            return [dict(self._users[telegram_id]) for telegram_id in self._by_symbol.get(symbol, ())]
+
+    def subscriber_count(self, symbol: str) -> int:
+        with self._lock:
+            return len(self._by_symbol.get(symbol, ()))
@@ -0,0 +1,98 @@
+"""
+Telegram Webhook - Nhận update Telegram qua webhook
+Serves Telegram updates from a FastAPI route (can share the ai_chat_api app) and processes them
+concurrently with a bounded number of in-flight handlers, instead of one long-poll connection
+"""
+
+import os
+from typing import Dict
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from telegram import Update
+from telegram.ext import Application
+import bot_commands
+
+WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram/webhook")
+CONCURRENT_UPDATES = int(os.getenv("TELEGRAM_CONCURRENT_UPDATES", "64"))  # handlers running at once
+MAX_PENDING_UPDATES = 1000  # accepted but unfinished updates before we ask Telegram to retry later
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def build_application(token: str, concurrent_updates: int = CONCURRENT_UPDATES, base_url: str = None) -> Application:
+    """Bot application without a poller; updates are pushed in by the webhook route"""
+    builder = Application.builder().token(token).updater(None).concurrent_updates(concurrent_updates)
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
+    bot_commands.setup_bot_commands(application)
+    return application
+
+def attach_webhook(app: FastAPI, application: Application, path: str = WEBHOOK_PATH,
+                   secret_token: str = None, max_pending: int = MAX_PENDING_UPDATES) -> Dict:
+    """
+    Register the webhook route on `app`
+    The route is public, so a secret token is required: only Telegram knows it (set_webhook)
+
+    Updates are handed to the application's update processor (at most concurrent_updates
+    handlers run at once) and counted until their handlers finish: update_queue can't be
+    used for backpressure, the application empties it into tasks as soon as updates arrive
+
+    Returns:
+        dict: Live counters (received / rejected / unauthorized / malformed / pending)
+    """
+    if not secret_token:
+        raise ValueError("A webhook secret token is required")
+
+    stats = {'received': 0, 'rejected': 0, 'unauthorized': 0, 'malformed': 0, 'pending': 0}
+
+    async def process(update: Update):
+        try:
+            await application.update_processor.process_update(update, application.process_update(update))
+        finally:
+            stats['pending'] -= 1
+
+    @app.post(path, include_in_schema=False)
+    async def telegram_webhook(request: Request):
+        if request.headers.get(SECRET_HEADER) != secret_token:
+            stats['unauthorized'] += 1
+            return JSONResponse(status_code=403, content={'ok': False})
+
+        # Backpressure: Telegram redelivers updates answered with a non-2xx status
+        if stats['pending'] >= max_pending:
+            stats['rejected'] += 1
+            return JSONResponse(status_code=503, content={'ok': False})
+
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except Exception as e:
+            # Not retried by Telegram: a body that doesn't parse now never will
+            stats['malformed'] += 1
+            print(f"[ERROR] Malformed webhook update: {e}")
+            return JSONResponse(status_code=400, content={'ok': False})
+        if update is None:
+            stats['malformed'] += 1
+            return JSONResponse(status_code=400, content={'ok': False})
+
+        stats['pending'] += 1
+        stats['received'] += 1
+        # Awaited by application.stop(); handler errors go to the application's error handlers
+        application.create_task(process(update), update=update)
+        return {'ok': True}
+
+    return stats
+
+async def start_webhook(application: Application, webhook_url: str = None, secret_token: str = None):
+    """Start update processing and (optionally) register the public webhook URL with Telegram"""
+    await application.initialize()
+    await application.start()
+    if webhook_url:
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=secret_token,
+            max_connections=100,
+            allowed_updates=Update.ALL_TYPES
+        )
+        print(f"[OK] Telegram webhook set to {webhook_url}")
+
+async def stop_webhook(application: Application):
+    await application.stop()
+    await application.shutdown()
@@ -0,0 +1,255 @@
+"""
+Test script for the async market data fetcher in ai_chat_api
+Upstream calls go to an in-process mock transport (no network)
+"""
+
+import asyncio
+import json
+import time
+import httpx
+from fastapi.testclient import TestClient
+import ai_chat_api
+from ai_chat_api import BinanceDataFetcher
+
+RESPONSES = {
+    "/api/v3/ticker/24hr": {"lastPrice": "65000", "priceChangePercent": "1.5", "volume": "1000",
+                            "quoteVolume": "65000000", "highPrice": "66000", "lowPrice": "64000"},
+    "/api/v3/depth": {"bids": [["64990", "3"], ["64980", "8"]], "asks": [["65010", "5"], ["65020", "2"]]},
+    "/fapi/v1/premiumIndex": {"lastFundingRate": "0.0001", "markPrice": "65005"},
+    "/fapi/v1/openInterest": {"openInterest": "12345"}
+}
+
+def mock_client(delays: dict, requests: list) -> httpx.AsyncClient:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.path)
+        await asyncio.sleep(delays.get(request.url.path, 0.2))
+        return httpx.Response(200, json=RESPONSES[request.url.path])
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+def test_get_all_data_concurrent_with_timeouts():
+    """The four calls overlap; a call past the deadline only drops its own fields"""
+    print("="*60)
+    print("Testing Async Market Data Fetcher")
+    print("="*60)
+
+    requests = []
+    BinanceDataFetcher.cache.clear()
+
+    async def run():
+        BinanceDataFetcher._client = mock_client({"/fapi/v1/openInterest": 5}, requests)
+        try:
+            started = time.perf_counter()
+            data, same = await asyncio.gather(
+                BinanceDataFetcher.get_all_data("BTCUSDT"),
+                BinanceDataFetcher.get_all_data("BTCUSDT")
+            )
+            return data, same, time.perf_counter() - started
+        finally:
+            await BinanceDataFetcher.close()
+
+    original_timeout = ai_chat_api.UPSTREAM_TIMEOUT
+    ai_chat_api.UPSTREAM_TIMEOUT = 0.5
+    try:
+        data, same, elapsed = asyncio.run(run())
+    finally:
+        ai_chat_api.UPSTREAM_TIMEOUT = original_timeout
+
+    print(f"✅ Fetched in {elapsed:.2f}s: {data}")
+    assert data["price"] == 65000.0
+    assert data["top_buy_wall"] == {"price": 64980.0, "amount": 8.0}
+    assert data["funding_rate"] == 0.01
+    assert "open_interest" not in data  # timed out
+    assert elapsed < 1.0  # concurrent: one deadline, not 3 x 0.2s + 0.5s
+    assert same is data and len(requests) == 4  # second caller coalesced
+    assert BinanceDataFetcher._client is None
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModel:
+    """Stands in for the Gemini model: a fixed answer, streamed in three chunks"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def generate_content(self, contents, stream=False):
+        self.calls += 1
+        if not stream:
+            return FakeChunk("🎯 **TÌNH HÌNH HIỆN TẠI**\nBTC sideways")
+        return iter([FakeChunk("🎯 **TÌNH HÌNH"), FakeChunk(" HIỆN TẠI**\n"), FakeChunk("BTC sideways")])
+
+def parse_events(body: str) -> list:
+    events = []
+    for message in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in message.split("\n"))
+        events.append((fields["event"], json.loads(fields["data"])))
+    return events
+
+def test_analyze_stream_sends_market_data_then_chunks():
+    """/analyze-stream: market_data event first, then one chunk event per Gemini chunk, then done"""
+    original_model = ai_chat_api.analyzer.model
+    ai_chat_api.analyzer.model = FakeModel()
+    ai_chat_api.analyzer.answer_cache.clear()
+    BinanceDataFetcher.cache.clear()
+    requests = []
+    BinanceDataFetcher._client = mock_client({}, requests)
+    try:
+        client = TestClient(ai_chat_api.app)
+        response = client.post("/analyze-stream", data={"text": "BTC thế nào?"})
+        # Asked again right away: market data comes from the cache
+        client.post("/analyze-stream", data={"text": "phân tích BTC"})
+        health = client.get("/health").json()
+    finally:
+        ai_chat_api.analyzer.model = original_model
+        asyncio.run(BinanceDataFetcher.close())
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+    print(f"✅ Events: {[event for event, _ in events]}")
+    assert events[0][0] == "market_data"
+    assert events[0][1]["symbol"] == "BTCUSDT" and events[0][1]["market_data"]["open_interest"] == 12345.0
+    assert [event for event, _ in events[1:]] == ["chunk", "chunk", "chunk", "done"]
+    assert "".join(data["text"] for _, data in events[1:4]) == "🎯 **TÌNH HÌNH HIỆN TẠI**\nBTC sideways"
+    assert len(requests) == 4
+    print(f"✅ Market data cache: {health['market_data_cache']}")
+    assert health['market_data_cache']['hits'] == 4 and health['market_data_cache']['hit_ratio'] > 0
+
+def test_answer_cache_skips_model():
+    """Rephrased question in the same market state reuses the answer; no_cache / images go to the model"""
+    analyzer = ai_chat_api.AIAnalyzer()
+    analyzer.model = FakeModel()
+    market = {'symbol': 'BTCUSDT', 'price': 65432.1, 'funding_rate': 0.01}
+
+    first = analyzer.analyze("Phân tích BTC", market)
+    again = analyzer.analyze("phân tích btc?", {**market, 'price': 65420.0})
+    assert again == first and analyzer.model.calls == 1
+
+    analyzer.analyze("phân tích btc", market, use_cache=False)
+    assert analyzer.model.calls == 2
+
+    # Streaming reads and fills the same cache
+    assert "".join(analyzer.analyze_stream("PHÂN TÍCH BTC", market)) == first
+    assert "".join(analyzer.analyze_stream("btc thế nào", market)) == first
+    assert analyzer.model.calls == 3
+    assert analyzer.analyze("BTC thế nào", market) == first and analyzer.model.calls == 3
+
+    metrics = analyzer.answer_cache.get_metrics()
+    print(f"✅ Answer cache: {metrics}")
+    assert metrics['hits'] == 3 and metrics['misses'] == 2 and metrics['bypassed'] == 1
+
+def test_analyze_does_not_block_event_loop():
+    """/analyze and /analyze-json run the blocking model call in a thread (the bot shares this loop)"""
+    print("="*60)
+    print("Testing Analyze Off The Event Loop")
+    print("="*60)
+
+    class SlowModel(FakeModel):
+        def generate_content(self, contents, stream=False):
+            time.sleep(0.3)  # blocking Gemini call
+            return super().generate_content(contents, stream)
+
+    async def run():
+        stalls = []
+
+        async def latency_probe():
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(0.01)
+                stalls.append(time.monotonic() - started - 0.01)
+
+        probe = asyncio.create_task(latency_probe())
+        transport = httpx.ASGITransport(app=ai_chat_api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            responses = await asyncio.gather(
+                client.post("/analyze", data={"text": "xin chào", "no_cache": "true"}),
+                client.post("/analyze-json", json={"text": "xin chào", "no_cache": True})
+            )
+        probe.cancel()
+        return responses, max(stalls)
+
+    original_model = ai_chat_api.analyzer.model
+    ai_chat_api.analyzer.model = SlowModel()
+    try:
+        responses, worst_stall = asyncio.run(run())
+    finally:
+        ai_chat_api.analyzer.model = original_model
+
+    print(f"✅ Worst loop stall during two model calls: {worst_stall * 1000:.0f}ms")
+    assert [response.status_code for response in responses] == [200, 200]
+    assert all(response.json()["analysis"].endswith("BTC sideways") for response in responses)
+    assert worst_stall < 0.1
+
+def test_analyze_stream_reports_errors():
+    """A model or market data failure ends the stream with error + done(success=false)"""
+    print("="*60)
+    print("Testing Stream Errors")
+    print("="*60)
+
+    class FailingModel(FakeModel):
+        def generate_content(self, contents, stream=False):
+            def chunks():
+                yield FakeChunk("🎯 **TÌNH HÌNH")
+                raise RuntimeError("quota exceeded")
+            return chunks()
+
+    async def failing_fetch(symbol):
+        raise RuntimeError("binance down")
+
+    original_model, original_fetch = ai_chat_api.analyzer.model, BinanceDataFetcher.get_all_data
+    ai_chat_api.analyzer.model = FailingModel()
+    try:
+        client = TestClient(ai_chat_api.app)
+        mid_stream = parse_events(client.post("/analyze-stream", data={"text": "xin chào", "no_cache": "true"}).text)
+        BinanceDataFetcher.get_all_data = failing_fetch
+        before_data = parse_events(client.post("/analyze-stream", data={"text": "BTC?", "no_cache": "true"}).text)
+    finally:
+        ai_chat_api.analyzer.model = original_model
+        BinanceDataFetcher.get_all_data = original_fetch
+
+    print(f"✅ Model failure: {[event for event, _ in mid_stream]}, fetch failure: {[event for event, _ in before_data]}")
+    assert [event for event, _ in mid_stream] == ["market_data", "chunk", "error", "done"]
+    assert mid_stream[2][1] == {"message": "quota exceeded"} and mid_stream[3][1] == {"success": False}
+    assert before_data == [("error", {"message": "binance down"}), ("done", {"success": False})]
+
+def test_analyze_stream_closes_model_stream_on_disconnect():
+    """A client that goes away mid-answer stops the Gemini iterator"""
+    closed = []
+
+    class EndlessModel(FakeModel):
+        def generate_content(self, contents, stream=False):
+            def chunks():
+                try:
+                    while True:
+                        yield FakeChunk("...")
+                finally:
+                    closed.append(True)
+            return chunks()
+
+    async def run():
+        response = await ai_chat_api.analyze_stream(text="xin chào", image=None, no_cache=True)
+        events = response.body_iterator
+        received = [await events.__anext__() for _ in range(3)]  # market_data + 2 chunks
+        await events.aclose()  # what the server does when the client disconnects
+        return received
+
+    original_model = ai_chat_api.analyzer.model
+    ai_chat_api.analyzer.model = EndlessModel()
+    try:
+        received = asyncio.run(run())
+    finally:
+        ai_chat_api.analyzer.model = original_model
+
+    assert received[0].startswith("event: market_data") and received[2].startswith("event: chunk")
+    assert closed == [True]
+    print("✅ Model stream closed after disconnect")
+
+if __name__ == "__main__":
+    test_get_all_data_concurrent_with_timeouts()
+    test_analyze_stream_sends_market_data_then_chunks()
+    test_answer_cache_skips_model()
+    test_analyze_does_not_block_event_loop()
+    test_analyze_stream_reports_errors()
+    test_analyze_stream_closes_model_stream_on_disconnect()
+    print("\n✅ All ai_chat_api tests passed!")
@@ -0,0 +1,330 @@
+"""
+Test script for the alert bot scan loop
+Run this to verify that a slow scan does not block the bot's event loop (no exchange calls)
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+import alert_bot
+import user_db
+from telegram.error import ChatMigrated
+from cooldown_ledger import CooldownLedger
+from delivery_queue import DeliveryQueue
+
+class FakeIndex:
+    """Subscription index stand-in with a fixed scan set and subscribers"""
+
+    def __init__(self, symbols, users=()):
+        self._symbols = set(symbols)
+        self._users = list(users)
+
+    def refresh_if_changed(self):
+        return False
+
+    def symbols(self):
+        return set(self._symbols)
+
+    def subscribers(self, symbol):
+        return list(self._users)
+
+def test_scan_does_not_block_event_loop():
+    """Commands keep being served while coins are analyzed in worker threads"""
+    print("="*60)
+    print("Testing Scan Worker Pool")
+    print("="*60)
+
+    analyzed = []
+
+    def slow_analysis(symbol):
+        time.sleep(0.2)  # blocking ccxt call
+        analyzed.append(symbol)
+        return {'risk_score': 0, 'severity': 'info', 'signals': []}
+
+    async def run():
+        # Simulated command handler: measure the worst event loop stall during the scan
+        stalls = []
+
+        async def command_latency_probe():
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(0.01)
+                stalls.append(time.monotonic() - started - 0.01)
+
+        probe = asyncio.create_task(command_latency_probe())
+        started = time.monotonic()
+        await alert_bot.scan_and_alert()
+        elapsed = time.monotonic() - started
+        probe.cancel()
+        return elapsed, max(stalls)
+
+    symbols = [f"COIN{i}/USDT" for i in range(8)]
+    original_analyze, original_index, original_ledger = (
+        alert_bot.analyze_symbol, alert_bot.subscription_index, alert_bot.cooldown_ledger
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        alert_bot.analyze_symbol = slow_analysis
+        alert_bot.subscription_index = FakeIndex(symbols)
+        alert_bot.cooldown_ledger = CooldownLedger(os.path.join(tmp, 'scanner.db'))
+        try:
+            elapsed, worst_stall = asyncio.run(run())
+        finally:
+            alert_bot.cooldown_ledger.close()
+            alert_bot.analyze_symbol = original_analyze
+            alert_bot.subscription_index = original_index
+            alert_bot.cooldown_ledger = original_ledger
+
+    print(f"✅ Scanned {len(analyzed)} coins in {elapsed:.2f}s, worst loop stall {worst_stall * 1000:.0f}ms")
+    assert sorted(analyzed) == sorted(symbols)
+    assert worst_stall < 0.1
+    # 8 x 0.2s sequentially would take 1.6s
+    assert elapsed < 1.6
+
+def test_outbox_writes_do_not_block_event_loop():
+    """A contended outbox write (busy timeout) doesn't stall the handlers sharing the loop"""
+    def contended_merge(render, window):
+        time.sleep(0.3)  # waiting on BEGIN IMMEDIATE
+        return 0
+
+    def contended_claim(worker_id, limit, lease):
+        time.sleep(0.3)
+        return []
+
+    async def run():
+        stalls = []
+
+        async def command_latency_probe():
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(0.01)
+                stalls.append(time.monotonic() - started - 0.01)
+
+        probe = asyncio.create_task(command_latency_probe())
+        drain = asyncio.create_task(alert_bot.drain_outbox(None, 'worker-1', poll_interval=0.05))
+        await asyncio.sleep(1.0)
+        drain.cancel()
+        probe.cancel()
+        await asyncio.gather(drain, probe, return_exceptions=True)
+        return max(stalls)
+
+    originals = (user_db.merge_digest_alerts, user_db.claim_pending_alerts, alert_bot.delivery_queue)
+    user_db.merge_digest_alerts, user_db.claim_pending_alerts = contended_merge, contended_claim
+    alert_bot.delivery_queue = StalledQueue()
+    try:
+        worst_stall = asyncio.run(run())
+    finally:
+        user_db.merge_digest_alerts, user_db.claim_pending_alerts, alert_bot.delivery_queue = originals
+
+    print(f"✅ Worst loop stall during contended outbox writes: {worst_stall * 1000:.0f}ms")
+    assert worst_stall < 0.1
+
+class StalledQueue:
+    """Delivery queue stand-in whose messages never leave the queue (e.g. a 429 storm)"""
+
+    def __init__(self):
+        self.items = []
+
+    def free_slots(self):
+        return 10000
+
+    async def put(self, telegram_id, text, parse_mode='Markdown', on_done=None):
+        self.items.append((telegram_id, text))
+
+def test_outbox_claims_outlive_queue_wait():
+    """Rows waiting in the delivery queue are never re-claimed, and in-flight claims are capped"""
+    print("="*60)
+    print("Testing Outbox Claims vs Lease")
+    print("="*60)
+
+    lease = 0.2  # caps in-flight claims at int(0.2 * 30 * 0.5) = 3
+    queue = StalledQueue()
+    reclaimable = []
+
+    async def run():
+        drain = asyncio.create_task(alert_bot.drain_outbox(None, 'worker-1', poll_interval=0.02, lease=lease))
+        # Several leases long: every queued row must stay claimed by worker-1 the whole time
+        for _ in range(40):
+            await asyncio.sleep(0.025)
+            conn = user_db.get_connection()
+            rows = conn.execute(
+                "SELECT id FROM alert_outbox WHERE status = 'pending' AND claimed_at < ?",
+                (time.time() - lease,)
+            ).fetchall()
+            conn.close()
+            reclaimable.extend(row['id'] for row in rows)
+        drain.cancel()
+        await asyncio.gather(drain, return_exceptions=True)
+
+    original_path, original_queue = user_db.DB_PATH, alert_bot.delivery_queue
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        alert_bot.delivery_queue = queue
+        try:
+            user_db.init_db()
+            user_db.enqueue_alerts([
+                {'telegram_id': 1000 + i, 'symbol': 'BTC/USDT', 'message': f"alert {i}", 'dedupe_key': f"lease:{i}"}
+                for i in range(5)
+            ])
+            asyncio.run(run())
+            # Right after the worker stops, only the rows it never queued can be claimed
+            claimed = user_db.claim_pending_alerts('worker-2', 100, lease)
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+            alert_bot.delivery_queue = original_queue
+
+    print(f"✅ Queued {len(queue.items)} alert(s), {len(claimed)} left for another worker")
+    assert reclaimable == []
+    assert queue.items == [(1000 + i, f"alert {i}") for i in range(3)]
+    assert sorted(row['telegram_id'] for row in claimed) == [1003, 1004]
+
+class MigratedChatBot:
+    """Bot stand-in whose chats all moved to a supergroup"""
+
+    def __init__(self):
+        self.attempts = 0
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        self.attempts += 1
+        raise ChatMigrated(-100123)
+
+def test_unhandled_telegram_error_fails_row():
+    """Errors the delivery queue has no special case for still close the outbox row"""
+    print("="*60)
+    print("Testing Unhandled Delivery Errors")
+    print("="*60)
+
+    bot = MigratedChatBot()
+
+    async def run():
+        alert_bot.delivery_queue = DeliveryQueue(bot, global_rate=1000, per_chat_rate=1000)
+        await alert_bot.delivery_queue.start()
+        drain = asyncio.create_task(alert_bot.drain_outbox(bot, 'worker-1', poll_interval=0.01))
+        deadline = time.monotonic() + 5
+        while user_db.get_outbox_stats().get('failed', 0) == 0:
+            assert time.monotonic() < deadline, "outbox row was never closed"
+            await asyncio.sleep(0.01)
+        drain.cancel()
+        await asyncio.gather(drain, return_exceptions=True)
+        await alert_bot.delivery_queue.stop()
+        return user_db.get_outbox_stats()
+
+    original_path, original_queue = user_db.DB_PATH, alert_bot.delivery_queue
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        try:
+            user_db.init_db()
+            user_db.enqueue_alerts([
+                {'telegram_id': 1000, 'symbol': 'BTC/USDT', 'message': "alert", 'dedupe_key': "migrated:1"}
+            ])
+            stats = asyncio.run(run())
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+            alert_bot.delivery_queue = original_queue
+
+    print(f"✅ Outbox: {stats} after {bot.attempts} attempt(s)")
+    assert stats.get('failed') == 1 and not stats.get('pending')
+    assert bot.attempts == user_db.OUTBOX_MAX_ATTEMPTS
+
+def test_cooldown_recorded_after_enqueue():
+    """A failed enqueue leaves the cooldown free; a lost cooldown race withdraws the enqueued alert"""
+    print("="*60)
+    print("Testing Cooldown vs Outbox Ordering")
+    print("="*60)
+
+    from alert_orchestrator import AlertOrchestrator
+
+    analysis = {'risk_score': 60, 'severity': 'warning', 'signals': ['volume'], 'alert_message': "BTC alert"}
+    index = FakeIndex(["BTC/USDT"], users=[{'telegram_id': 1001, 'alert_mode': 'immediate'}])
+
+    def failing_enqueue(alerts):
+        raise RuntimeError("database is locked")
+
+    original_path, original_enqueue = user_db.DB_PATH, user_db.enqueue_alerts
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        ledger = CooldownLedger(os.path.join(tmp, 'scanner.db'))
+        orchestrator = AlertOrchestrator(ledger)
+        try:
+            user_db.init_db()
+
+            # Test 1: Outbox write fails -> cooldown not consumed, next scan retries
+            user_db.enqueue_alerts = failing_enqueue
+            try:
+                alert_bot.handle_analysis("BTC/USDT", analysis, orchestrator, index, "100")
+                assert False, "enqueue error must propagate"
+            except RuntimeError:
+                pass
+            finally:
+                user_db.enqueue_alerts = original_enqueue
+            assert ledger.last_sent("BTC/USDT", "warning") is None
+            print("✅ Failed enqueue did not record the cooldown")
+
+            # Test 2: Enqueued, then cooldown recorded; the next scan is suppressed
+            alert_bot.handle_analysis("BTC/USDT", analysis, orchestrator, index, "100")
+            assert ledger.last_sent("BTC/USDT", "warning") is not None
+            alert_bot.handle_analysis("BTC/USDT", analysis, orchestrator, index, "400")
+            assert user_db.get_outbox_stats() == {'pending': 1}
+            print("✅ Alert enqueued once, cooldown recorded after the enqueue")
+
+            # Test 3: A replica that checked before the cooldown was taken withdraws its alert
+            orchestrator.cooldown_active = lambda *args, **kwargs: False
+            alert_bot.handle_analysis("BTC/USDT", analysis, orchestrator, index, "700")
+            assert user_db.get_outbox_stats() == {'pending': 1}
+            print("✅ Losing replica withdrew its unsent alert")
+        finally:
+            ledger.close()
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+
+def test_shed_analyses_do_not_run():
+    """At the cycle deadline, analyses that have not started are dropped from the pool"""
+    print("="*60)
+    print("Testing Deadline Shedding")
+    print("="*60)
+
+    analyzed = []
+
+    def slow_analysis(symbol):
+        time.sleep(0.2)
+        analyzed.append(symbol)
+        return {'risk_score': 0, 'severity': 'info', 'signals': []}
+
+    async def run():
+        started = time.monotonic()
+        await alert_bot.scan_and_alert(deadline=time.time() + 0.3)
+        return time.monotonic() - started
+
+    symbols = [f"COIN{i}/USDT" for i in range(4 * alert_bot.SCAN_WORKERS)]
+    original_analyze, original_index, original_ledger = (
+        alert_bot.analyze_symbol, alert_bot.subscription_index, alert_bot.cooldown_ledger
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        alert_bot.analyze_symbol = slow_analysis
+        alert_bot.subscription_index = FakeIndex(symbols)
+        alert_bot.cooldown_ledger = CooldownLedger(os.path.join(tmp, 'scanner.db'))
+        try:
+            elapsed = asyncio.run(run())
+            # Whatever was still queued must not start once the scan returned
+            time.sleep(0.5)
+        finally:
+            alert_bot.cooldown_ledger.close()
+            alert_bot.analyze_symbol = original_analyze
+            alert_bot.subscription_index = original_index
+            alert_bot.cooldown_ledger = original_ledger
+
+    print(f"✅ Scan returned after {elapsed:.2f}s, {len(analyzed)}/{len(symbols)} coins analyzed")
+    assert elapsed < 0.5
+    # Two rounds of workers fit before the deadline, the rest is shed
+    assert len(analyzed) <= 2 * alert_bot.SCAN_WORKERS
+
+if __name__ == "__main__":
+    test_scan_does_not_block_event_loop()
+    test_outbox_writes_do_not_block_event_loop()
+    test_outbox_claims_outlive_queue_wait()
+    test_unhandled_telegram_error_fails_row()
+    test_cooldown_recorded_after_enqueue()
+    test_shed_analyses_do_not_run()
+    print("\n✅ All alert bot tests passed!")
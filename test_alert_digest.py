@@ -0,0 +1,40 @@
+"""
+Test script for per-user alert digests
+"""
+
+from alert_digest import build_digest_message, MAX_MESSAGE_LENGTH
+
+def _entry(symbol, risk_score):
+    return {
+        'symbol': symbol,
+        'risk_score': risk_score,
+        'severity': 'warning',
+        'message': f"full alert {symbol}",
+        'digest_line': f"⚠️ **{symbol}** - Risk {risk_score}/100"
+    }
+
+def test_digest_ranking():
+    """Coins ranked by risk score"""
+    print("="*60)
+    print("Testing Alert Digest")
+    print("="*60)
+
+    body = build_digest_message([_entry("BTC/USDT", 40), _entry("ETH/USDT", 90), _entry("SOL/USDT", 60)])
+    print(body)
+    assert body.index("ETH/USDT") < body.index("SOL/USDT") < body.index("BTC/USDT")
+    # Single alert: user gets the full alert, not a digest
+    assert build_digest_message([_entry("BTC/USDT", 40)]) == "full alert BTC/USDT"
+    print("✅ Digest ranked by risk score")
+
+def test_digest_length_limit():
+    """Digest never exceeds the Telegram message limit"""
+    entries = [_entry(f"COIN{i}/USDT", i % 100) for i in range(500)]
+    message = build_digest_message(entries)
+    assert len(message) <= MAX_MESSAGE_LENGTH
+    assert "coin khác" in message
+    print(f"✅ Digest truncated to {len(message)} chars")
+
+if __name__ == "__main__":
+    test_digest_ranking()
+    test_digest_length_limit()
+    print("\n✅ All digest tests passed!")
@@ -0,0 +1,48 @@
+"""
+Test script for the LLM answer cache
+"""
+
+import time
+from answer_cache import AnswerCache, answer_key, market_bucket, normalize_query
+
+def test_keys_ignore_formatting_and_small_ticks():
+    """Same question and market state -> same key; another price band or question -> new key"""
+    print("="*60)
+    print("Testing Answer Cache")
+    print("="*60)
+
+    market = {'symbol': 'BTCUSDT', 'price': 65432.1, 'funding_rate': 0.0100}
+    ticked = {'symbol': 'BTCUSDT', 'price': 65398.7, 'funding_rate': 0.0123}
+    moved = {'symbol': 'BTCUSDT', 'price': 66010.0, 'funding_rate': 0.0100}
+
+    assert normalize_query("  Phân tích   BTC!! ") == normalize_query("phân tích btc") == "phân tích btc"
+    assert market_bucket(market) == ('BTCUSDT', 65400.0, 0.01)
+    assert market_bucket({}) == ()
+    assert answer_key("Phân tích BTC?", market) == answer_key("phân tích btc", ticked)
+    assert answer_key("phân tích btc", market) != answer_key("phân tích btc", moved)
+    assert answer_key("phân tích btc", market) != answer_key("btc thế nào", market)
+    print("✅ Keys normalized and bucketed")
+
+def test_ttl_and_lru_eviction():
+    """Expired answers miss; the least recently used answer is evicted past maxsize"""
+    cache = AnswerCache(maxsize=2, ttl=0.1)
+    cache.put("a", "answer a")
+    cache.put("b", "answer b")
+    assert cache.get("a") == "answer a"  # a is now most recently used
+    cache.put("c", "answer c")           # evicts b
+    assert cache.get("b") is None
+    assert cache.get("c") == "answer c"
+
+    time.sleep(0.15)
+    assert cache.get("a") is None
+
+    metrics = cache.get_metrics()
+    print(f"✅ Metrics: {metrics}")
+    assert metrics['hits'] == 2 and metrics['misses'] == 2 and metrics['evictions'] == 1
+    assert metrics['entries'] == 1
+    assert not AnswerCache(ttl=0).enabled
+
+if __name__ == "__main__":
+    test_keys_ignore_formatting_and_small_ticks()
+    test_ttl_and_lru_eviction()
+    print("\n✅ All answer cache tests passed!")
@@ -0,0 +1,90 @@
+"""
+Test script for the async user_db facade
+Runs against a temporary database
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import user_db
+from async_user_db import AsyncUserDB
+
+def test_async_facade_batches_writes():
+    """Concurrent writes share transactions; a failing call doesn't abort its batch"""
+    print("="*60)
+    print("Testing Async User DB")
+    print("="*60)
+
+    async def run(db):
+        await asyncio.gather(*(db.create_user(telegram_id, f"user{telegram_id}") for telegram_id in range(1, 201)))
+        results = await asyncio.gather(
+            db.track_coin(1, "BTC/USDT"),
+            db.set_alert_mode(2, "bogus"),  # ValueError, rolled back alone
+            db.track_coin(3, "ETH/USDT"),
+            return_exceptions=True
+        )
+        coins = await db.get_tracked_coins(3)
+        user = await db.get_user(200)
+        return results, coins, user
+
+    original_path = user_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        user_db.init_db()
+        db = AsyncUserDB()
+        try:
+            results, coins, user = asyncio.run(run(db))
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+
+    stats = db.get_stats()
+    print(f"✅ Stats: {stats}")
+    assert results[0] == user_db.ADD_OK and results[2] == user_db.ADD_OK
+    assert isinstance(results[1], ValueError)
+    assert [c['symbol'] for c in coins] == ["ETH/USDT"]
+    assert user['username'] == "user200"
+    assert stats['writes'] == 203
+    assert stats['write_batches'] < stats['writes']
+
+def test_bulk_writers_use_writer_thread():
+    """Bulk writers are queued like other writes; import_users (its own batches) runs alone"""
+    async def run(db, path):
+        created, imported, tracked = await asyncio.gather(
+            db.create_users_bulk([{'telegram_id': 1, 'username': "bulk1"}, {'telegram_id': 2, 'username': "bulk2"}]),
+            db.import_users(path),
+            db.track_coin(1, "BTC/USDT")
+        )
+        coins = await db.get_tracked_coins(10)
+        return created, imported, tracked, coins
+
+    original_path = user_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        path = os.path.join(tmp, "users.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            for telegram_id in (10, 11):
+                f.write(json.dumps({'telegram_id': telegram_id, 'username': f"user{telegram_id}",
+                                    'subscription_tier': 'free', 'subscription_expires': None,
+                                    'alert_mode': 'immediate', 'symbols': ["ETH/USDT"]}) + '\n')
+        user_db.init_db()
+        db = AsyncUserDB()
+        try:
+            created, imported, tracked, coins = asyncio.run(run(db, path))
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+
+    stats = db.get_stats()
+    print(f"✅ Bulk writes: {stats}")
+    assert created == ['created', 'created']
+    assert imported['records'] == 2 and imported['coins'] == {'added': 2}
+    assert tracked == user_db.ADD_OK
+    assert [c['symbol'] for c in coins] == ["ETH/USDT"]
+    assert stats['writes'] == 3
+
+if __name__ == "__main__":
+    test_async_facade_batches_writes()
+    test_bulk_writers_use_writer_thread()
+    print("\n✅ All async user_db tests passed!")
@@ -0,0 +1,36 @@
+"""
+Test script for the persistent alert cooldown ledger
+"""
+
+import os
+import tempfile
+from cooldown_ledger import CooldownLedger
+
+def test_check_and_set():
+    """Cooldown survives a restart and is shared between replicas"""
+    print("="*60)
+    print("Testing Cooldown Ledger")
+    print("="*60)
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'scanner.db')
+    replica_a = CooldownLedger(db_path)
+    replica_b = CooldownLedger(db_path)
+
+    assert replica_a.try_acquire("BTC/USDT", "warning", 1800, now=1000)
+    # Second replica loses the race for the same slot
+    assert not replica_b.try_acquire("BTC/USDT", "warning", 1800, now=1001)
+    # Other severities have their own key
+    assert replica_b.try_acquire("BTC/USDT", "info", 3600, now=1001)
+    print("✅ Only one replica wins each (symbol, severity) slot")
+
+    # Restart: a fresh ledger still sees the cooldown
+    replica_a.close()
+    restarted = CooldownLedger(db_path)
+    assert restarted.last_sent("BTC/USDT", "warning") == 1000
+    assert not restarted.try_acquire("BTC/USDT", "warning", 1800, now=2000)
+    assert restarted.try_acquire("BTC/USDT", "warning", 1800, now=2800)
+    print("✅ Cooldown survives restart and expires on time")
+
+if __name__ == "__main__":
+    test_check_and_set()
+    print("\n✅ All cooldown ledger tests passed!")
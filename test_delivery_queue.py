@@ -0,0 +1,76 @@
+"""
+Test script for the rate-limited delivery queue
+Uses an in-memory fake bot; for a load test against a fake Bot API run:
+    python fake_telegram_server.py --load-test
+"""
+
+import asyncio
+from telegram.error import RetryAfter, Forbidden
+from delivery_queue import DeliveryQueue, TokenBucket, DELIVERED, UNREACHABLE
+
+class FakeBot:
+    def __init__(self, fail_first_with=None, blocked=()):
+        self.sent = []
+        self.fail_first_with = fail_first_with
+        self.blocked = set(blocked)
+
+    async def send_message(self, chat_id, text, parse_mode=None):
+        if chat_id in self.blocked:
+            raise Forbidden("Forbidden: bot was blocked by the user")
+        if self.fail_first_with:
+            error, self.fail_first_with = self.fail_first_with, None
+            raise error
+        self.sent.append((chat_id, text))
+
+def test_token_bucket():
+    """Reservations beyond capacity must wait 1/rate each"""
+    now = [0.0]
+    bucket = TokenBucket(rate=2, clock=lambda: now[0])
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0.5
+    assert bucket.reserve() == 1.0
+    now[0] = 2.0
+    assert bucket.reserve() == 0
+    print("✅ Token bucket reservations")
+
+def test_retry_after_and_permanent_errors():
+    """429 is retried after retry_after, blocked chats are not retried"""
+    async def run():
+        bot = FakeBot(fail_first_with=RetryAfter(0), blocked={99})
+        queue = DeliveryQueue(bot, global_rate=1000, per_chat_rate=1000, workers=2)
+        await queue.start()
+        outcomes = {}
+        await queue.put(1, "alert", on_done=lambda error, outcome: outcomes.__setitem__(1, outcome))
+        await queue.put(99, "alert", on_done=lambda error, outcome: outcomes.__setitem__(99, outcome))
+        await queue.join()
+        await queue.stop()
+        return bot, queue.get_stats(), outcomes
+
+    bot, stats, outcomes = asyncio.run(run())
+    print(f"✅ Stats: {stats}")
+    assert bot.sent == [(1, "alert")]
+    assert stats['rate_limited'] == 1
+    assert stats['retried'] == 1
+    assert stats['failed'] == 1
+    assert stats['unreachable'] == 1
+    assert outcomes == {1: DELIVERED, 99: UNREACHABLE}
+    assert stats['queue_depth'] == 0
+
+def test_backpressure():
+    """A full queue refuses put_nowait and counts the drop"""
+    async def run():
+        queue = DeliveryQueue(FakeBot(), max_queue_size=2)
+        results = [queue.put_nowait(i, "alert") for i in range(3)]
+        return results, queue.get_stats()
+
+    results, stats = asyncio.run(run())
+    assert results == [True, True, False]
+    assert stats['dropped'] == 1 and stats['queue_depth'] == 2
+    print("✅ Bounded queue applies backpressure")
+
+if __name__ == "__main__":
+    test_token_bucket()
+    test_retry_after_and_permanent_errors()
+    test_backpressure()
+    print("\n✅ All delivery queue tests passed!")
@@ -0,0 +1,113 @@
+"""
+Test script for the market data TTL cache (stale-while-revalidate)
+"""
+
+import asyncio
+import time
+from market_data_cache import MarketDataCache
+
+def test_stale_while_revalidate():
+    """Fresh hits skip the fetch; expired entries are served at once and refreshed in the background"""
+    print("="*60)
+    print("Testing Market Data Cache")
+    print("="*60)
+
+    calls = []
+
+    async def fetch(symbol):
+        calls.append(symbol)
+        await asyncio.sleep(0.1)
+        return {'price': len(calls)}
+
+    async def run(cache):
+        # Cold: concurrent callers share one fetch
+        cold = await asyncio.gather(*(cache.get(("ticker", "BTCUSDT"), 0.2, fetch, "BTCUSDT") for _ in range(5)))
+        warm = await cache.get(("ticker", "BTCUSDT"), 0.2, fetch, "BTCUSDT")
+        await asyncio.sleep(0.25)
+
+        # Expired: old value returned without waiting, refresh runs behind it
+        started = time.perf_counter()
+        stale = await cache.get(("ticker", "BTCUSDT"), 0.2, fetch, "BTCUSDT")
+        stale_wait = time.perf_counter() - started
+        await asyncio.sleep(0.15)
+        refreshed = await cache.get(("ticker", "BTCUSDT"), 0.2, fetch, "BTCUSDT")
+        return cold, warm, stale, stale_wait, refreshed
+
+    cache = MarketDataCache(max_stale=60)
+    cold, warm, stale, stale_wait, refreshed = asyncio.run(run(cache))
+
+    metrics = cache.get_metrics()
+    print(f"✅ Metrics: {metrics}")
+    assert [r['price'] for r in cold] == [1] * 5
+    assert warm['price'] == 1
+    assert stale['price'] == 1 and stale_wait < 0.05
+    assert refreshed['price'] == 2
+    assert calls == ["BTCUSDT", "BTCUSDT"]
+    assert metrics['hits'] == 2 and metrics['stale_hits'] == 1 and metrics['misses'] == 5
+    assert metrics['hit_ratio'] == 0.375
+
+def test_failed_refresh_keeps_last_value():
+    """Empty results are not cached; past max_stale the caller waits for a new fetch"""
+    responses = [{'funding_rate': 0.01}, {}, {}, {'funding_rate': 0.02}]
+
+    async def fetch(symbol):
+        return responses.pop(0)
+
+    async def run(cache):
+        first = await cache.get(("funding", "ETHUSDT"), 0.05, fetch, "ETHUSDT")
+        await asyncio.sleep(0.06)
+        await cache.get(("funding", "ETHUSDT"), 0.05, fetch, "ETHUSDT")  # stale, refresh returns {}
+        await asyncio.sleep(0.01)
+        kept = await cache.get(("funding", "ETHUSDT"), 0.05, fetch, "ETHUSDT")  # still stale, retried
+        await asyncio.sleep(0.01)
+        await asyncio.sleep(0.15)
+        expired = await cache.get(("funding", "ETHUSDT"), 0.05, fetch, "ETHUSDT")  # too old to serve
+        return first, kept, expired
+
+    cache = MarketDataCache(max_stale=0.1)
+    first, kept, expired = asyncio.run(run(cache))
+
+    assert first == kept == {'funding_rate': 0.01}
+    assert expired == {'funding_rate': 0.02}
+    assert cache.get_metrics()['refresh_failures'] == 2
+    print("✅ Failed refresh kept the last value")
+
+def test_per_call_stale_limit():
+    """Past its own max_stale a fast-moving entry is not served: the caller waits for a fresh fetch"""
+    calls = []
+
+    async def fetch(part):
+        calls.append(part)
+        await asyncio.sleep(0.1)
+        return {'value': len(calls)}
+
+    async def run(cache):
+        await cache.get(("ticker", "BTCUSDT"), 0.05, fetch, "ticker", max_stale=0.05)
+        await cache.get(("funding", "BTCUSDT"), 0.05, fetch, "funding")
+        await asyncio.sleep(0.15)
+
+        # Same age: the ticker is past its 0.05s stale limit, funding is within the cache default
+        started = time.perf_counter()
+        ticker = await cache.get(("ticker", "BTCUSDT"), 0.05, fetch, "ticker", max_stale=0.05)
+        ticker_wait = time.perf_counter() - started
+        started = time.perf_counter()
+        funding = await cache.get(("funding", "BTCUSDT"), 0.05, fetch, "funding")
+        funding_wait = time.perf_counter() - started
+        await asyncio.sleep(0.15)  # let the background funding refresh finish
+        return ticker, ticker_wait, funding, funding_wait
+
+    cache = MarketDataCache(max_stale=60)
+    ticker, ticker_wait, funding, funding_wait = asyncio.run(run(cache))
+
+    assert ticker == {'value': 3} and ticker_wait >= 0.09
+    assert funding == {'value': 2} and funding_wait < 0.05
+    assert calls == ["ticker", "funding", "ticker", "funding"]
+    metrics = cache.get_metrics()
+    assert metrics['misses'] == 3 and metrics['stale_hits'] == 1
+    print("✅ Entry past its stale limit waited for a fresh fetch")
+
+if __name__ == "__main__":
+    test_stale_while_revalidate()
+    test_failed_refresh_keeps_last_value()
+    test_per_call_stale_limit()
+    print("\n✅ All market data cache tests passed!")
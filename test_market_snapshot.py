@@ -0,0 +1,65 @@
+"""
+Test script for the background market snapshot service
+Uses a fake ticker download; no network access
+"""
+
+import asyncio
+import pandas as pd
+from market_snapshot import MarketSnapshotService
+
+def fake_tickers():
+    return pd.DataFrame([
+        {'Symbol': 'BTC/USDT', 'Price': 60000.0, 'Volume': 5_000_000_000, 'Change': 1.0},
+        {'Symbol': 'GHOST/USDT', 'Price': 3.0, 'Volume': 2_000_000, 'Change': 0.5},
+        {'Symbol': 'PUMP/USDT', 'Price': 0.1, 'Volume': 1_000_000, 'Change': 40.0},
+        {'Symbol': 'ETH/USDT', 'Price': 3000.0, 'Volume': 2_000_000_000, 'Change': 2.0},
+    ]), "Fake"
+
+def test_refresh_builds_leaderboards():
+    """A refresh precomputes both leaderboards; a failed refresh keeps the last snapshot"""
+    print("="*60)
+    print("Testing Market Snapshot")
+    print("="*60)
+
+    responses = [fake_tickers(), (pd.DataFrame(), "Error")]
+    service = MarketSnapshotService(fetch=lambda: responses.pop(0))
+    assert service.get() is None
+
+    assert service.refresh()
+    snapshot = service.get()
+    assert [row['Symbol'] for row in snapshot['ghost_towns']] == ['GHOST/USDT']
+    assert [row['Symbol'] for row in snapshot['fake_pumps']] == ['PUMP/USDT']
+    assert snapshot['source'] == "Fake"
+    print(f"✅ Leaderboards built from {len(snapshot['tickers'])} tickers")
+
+    assert not service.refresh()
+    assert service.get() is snapshot
+    print("✅ Failed refresh keeps previous snapshot")
+
+def test_background_refresh():
+    """ensure_started() refreshes in the background and is idempotent"""
+    async def run():
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return fake_tickers()
+
+        service = MarketSnapshotService(interval=0.05, fetch=fetch)
+        service.ensure_started()
+        task = service._task
+        service.ensure_started()
+        assert service._task is task
+        await asyncio.sleep(0.2)
+        task.cancel()
+        return service, calls
+
+    service, calls = asyncio.run(run())
+    assert service.get() is not None
+    assert len(calls) >= 2
+    print(f"✅ Background refreshes: {len(calls)}")
+
+if __name__ == "__main__":
+    test_refresh_builds_leaderboards()
+    test_background_refresh()
+    print("\n✅ All market snapshot tests passed!")
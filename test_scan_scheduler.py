@@ -0,0 +1,114 @@
+"""
+Test script for the candle-aligned scan scheduler
+Run this to verify scheduling logic without touching the exchange
+"""
+
+import asyncio
+from scan_scheduler import ScanScheduler, next_candle_close, get_all_metrics
+
+def test_next_candle_close():
+    """Test boundary alignment"""
+    print("="*60)
+    print("Testing Candle Alignment")
+    print("="*60)
+
+    # Mid-candle -> next 5m close + delay
+    assert next_candle_close(1000, 300, 3) == 1203
+    # Just after close but before the delay elapsed -> this candle's trigger
+    assert next_candle_close(1201, 300, 3) == 1203
+    # Exactly on the trigger -> next candle
+    assert next_candle_close(1203, 300, 3) == 1503
+    print("✅ Boundaries aligned to candle close")
+
+def test_skip_when_running():
+    """A new cycle must not start while the previous one is still running"""
+    print("="*60)
+    print("Testing Overlap Guard")
+    print("="*60)
+
+    async def run():
+        release = asyncio.Event()
+        calls = []
+
+        async def slow_scan(deadline):
+            calls.append(deadline)
+            await release.wait()
+
+        now = [1203.0]
+        scheduler = ScanScheduler(slow_scan, interval=300, close_delay=3, clock=lambda: now[0])
+
+        first = scheduler.trigger(1203)
+        await asyncio.sleep(0)
+        now[0] = 1503.5
+        second = scheduler.trigger(1503)
+
+        release.set()
+        await first
+        return scheduler.get_metrics(), calls, second
+
+    metrics, calls, second = asyncio.run(run())
+    print(f"✅ Metrics: {metrics}")
+    assert second is None
+    assert calls == [1503]
+    assert metrics['skipped'] == 1
+    assert metrics['overruns'] == 1
+    assert abs(metrics['last_overrun'] - 0.5) < 1e-9
+
+def test_missed_boundaries():
+    """Boundaries slept through are counted as skipped cycles"""
+    async def run():
+        async def scan(deadline):
+            pass
+
+        scheduler = ScanScheduler(scan, interval=300, close_delay=3, clock=lambda: 2103.0, name="test_missed")
+        await scheduler.trigger(1203)
+        await scheduler.trigger(2103)
+        return scheduler.get_metrics()
+
+    metrics = asyncio.run(run())
+    assert metrics['skipped'] == 2
+    assert metrics['cycles'] == 2
+    assert get_all_metrics()["test_missed"] == metrics  # reported on /health
+    print(f"✅ Missed boundaries counted: {metrics['skipped']}")
+
+def test_early_wakeup():
+    """A sleep that wakes 1ms before the boundary still runs each boundary exactly once"""
+    original_sleep = asyncio.sleep
+    now = [1000.0]
+    calls = []
+
+    async def early_sleep(delay):
+        # Loop timer resolution: wake 1ms before the wall clock reaches the target
+        now[0] += max(0.0, delay - 0.001)
+        await original_sleep(0)
+
+    async def run():
+        async def scan(deadline):
+            calls.append(deadline)
+
+        scheduler = ScanScheduler(scan, interval=300, close_delay=3, clock=lambda: now[0], name="test_early")
+        loop = asyncio.create_task(scheduler.run_forever())
+        for _ in range(100):
+            if len(calls) >= 3:
+                break
+            await original_sleep(0)
+        loop.cancel()
+        await asyncio.gather(loop, return_exceptions=True)
+        return scheduler.get_metrics()
+
+    asyncio.sleep = early_sleep
+    try:
+        metrics = asyncio.run(run())
+    finally:
+        asyncio.sleep = original_sleep
+
+    print(f"✅ Early wakeups: scans for {calls}, skipped {metrics['skipped']}")
+    assert len(calls) >= 3 and calls == [1503 + 300 * i for i in range(len(calls))]
+    assert metrics['skipped'] == 0
+
+if __name__ == "__main__":
+    test_next_candle_close()
+    test_skip_when_running()
+    test_missed_boundaries()
+    test_early_wakeup()
+    print("\n✅ All scheduler tests passed!")
@@ -0,0 +1,44 @@
+"""
+Test script for scanner sharding
+Uses a temporary coordination store, no exchange or Telegram access needed
+"""
+
+import os
+import tempfile
+import time
+import scan_sharding
+
+SYMBOLS = [f"COIN{i}/USDT" for i in range(200)]
+
+def test_shards_cover_all_symbols():
+    """Every symbol is owned by exactly one live worker, and a dead worker's symbols move"""
+    print("="*60)
+    print("Testing Shard Ownership")
+    print("="*60)
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'scanner.db')
+    workers = [scan_sharding.ShardCoordinator(f"worker-{i}", db_path=db_path, ttl=30) for i in range(3)]
+    for worker in workers:
+        worker.heartbeat()
+
+    claims = [worker.claim_symbols(SYMBOLS) for worker in workers]
+    print(f"✅ Claims per worker: {[len(c) for c in claims]}")
+    assert sum(len(c) for c in claims) == len(SYMBOLS)
+    assert set().union(*claims) == set(SYMBOLS)
+
+    # worker-2 stops heartbeating -> its symbols are rebalanced onto the survivors
+    conn = scan_sharding.connect(db_path)
+    conn.execute('UPDATE scanner_workers SET heartbeat_at = ? WHERE worker_id = ?', (time.time() - 60, 'worker-2'))
+    conn.commit()
+    conn.close()
+
+    survivors = [workers[0].claim_symbols(SYMBOLS), workers[1].claim_symbols(SYMBOLS)]
+    assert survivors[0] | survivors[1] == set(SYMBOLS)
+    assert not survivors[0] & survivors[1]
+    # Consistent hashing: survivors keep what they already owned
+    assert claims[0] <= survivors[0] and claims[1] <= survivors[1]
+    print(f"✅ Rebalanced after worker death: {[len(c) for c in survivors]}")
+
+if __name__ == "__main__":
+    test_shards_cover_all_symbols()
+    print("\n✅ All sharding tests passed!")
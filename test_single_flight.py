@@ -0,0 +1,137 @@
+"""
+Test script for single-flight request coalescing
+Upstream calls block on events until every caller has joined the flight, so the
+results don't depend on thread scheduling or sleep timing
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+import single_flight as single_flight_module
+from single_flight import SingleFlight, single_flight, get_all_metrics
+
+@contextmanager
+def isolated_flights():
+    """Run with an empty flight registry (decorated names from other tests/runs don't leak in)"""
+    saved = dict(single_flight_module._flights)
+    single_flight_module._flights.clear()
+    try:
+        yield
+    finally:
+        single_flight_module._flights.clear()
+        single_flight_module._flights.update(saved)
+
+def wait_until(condition, timeout: float = 5.0):
+    """Block until another thread reached a state (fails instead of hanging)"""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for callers"
+        time.sleep(0.001)
+
+def test_concurrent_calls_coalesce():
+    """A burst of identical calls runs the upstream fetch once"""
+    print("="*60)
+    print("Testing Single Flight")
+    print("="*60)
+
+    executions = []
+    release = threading.Event()
+
+    with isolated_flights():
+        @single_flight("test_fetch")
+        def fetch(symbol):
+            executions.append(symbol)
+            release.wait()
+            return {'symbol': symbol}
+
+        with ThreadPoolExecutor(max_workers=20) as pool:
+            futures = [pool.submit(fetch, symbol) for symbol in ["BTC/USDT"] * 10 + ["ETH/USDT"] * 10]
+            # Both leaders are blocked until every caller has joined a flight
+            wait_until(lambda: fetch.flight.get_metrics()['calls'] == 20)
+            release.set()
+            results = [future.result() for future in futures]
+
+        assert sorted(executions) == ["BTC/USDT", "ETH/USDT"]
+        assert results[0] is results[9]
+        metrics = get_all_metrics()["test_fetch"]
+        print(f"✅ Metrics: {metrics}")
+        assert metrics == {'calls': 20, 'executions': 2, 'coalesced': 18, 'in_flight': 0}
+
+        # Finished calls are not cached: the next call fetches again
+        fetch("BTC/USDT")
+        assert executions.count("BTC/USDT") == 2
+
+def test_errors_are_shared():
+    """Waiters receive the leader's exception"""
+    flight = SingleFlight("test_errors")
+    started = threading.Event()
+    release = threading.Event()
+
+    def failing():
+        started.set()
+        release.wait()
+        raise ValueError("upstream down")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("key", failing)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait()
+    follower = threading.Thread(target=call)
+    follower.start()
+    # Fail only once the follower is waiting on the leader's call
+    wait_until(lambda: flight.get_metrics()['coalesced'] == 1)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert errors == ["upstream down", "upstream down"]
+    assert flight.get_metrics()['executions'] == 1
+    print("✅ Errors propagated to coalesced callers")
+
+def test_async_calls_coalesce():
+    """Coroutine functions coalesce on the event loop; a cancelled caller doesn't cancel the fetch"""
+    executions = []
+    release = None  # asyncio.Event, created on the test's loop
+
+    with isolated_flights():
+        @single_flight("test_async_fetch")
+        async def fetch(symbol):
+            executions.append(symbol)
+            await release.wait()
+            return {'symbol': symbol}
+
+        async def run():
+            nonlocal release
+            release = asyncio.Event()
+            impatient = asyncio.ensure_future(fetch("BTC/USDT"))
+            results = asyncio.gather(*(fetch(s) for s in ["BTC/USDT"] * 5 + ["ETH/USDT"] * 5))
+            # Let every caller join its flight while the fetches are blocked
+            while fetch.flight.get_metrics()['calls'] < 11:
+                await asyncio.sleep(0)
+            impatient.cancel()
+            await asyncio.gather(impatient, return_exceptions=True)
+            release.set()
+            return await results
+
+        results = asyncio.run(run())
+
+        assert sorted(executions) == ["BTC/USDT", "ETH/USDT"]
+        assert results[0] is results[4] and results[0] == {'symbol': "BTC/USDT"}
+        metrics = get_all_metrics()["test_async_fetch"]
+        print(f"✅ Async metrics: {metrics}")
+        assert metrics == {'calls': 11, 'executions': 2, 'coalesced': 9, 'in_flight': 0}
+
+if __name__ == "__main__":
+    test_concurrent_calls_coalesce()
+    test_errors_are_shared()
+    test_async_calls_coalesce()
+    print("\n✅ All single flight tests passed!")
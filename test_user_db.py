@@ -3,8 +3,10 @@ Test script for user database operations
 Run this to verify database functionality before testing the bot
 """
 
+import os
 import user_db
 from datetime import datetime, timedelta
+from subscription_index import SubscriptionIndex
 
 def test_user_operations():
     """Test user CRUD operations"""
@@ -110,20 +112,703 @@ def test_subscription_upgrade():
     
     print("\n" + "="*60)
 
+def test_subscription_index():
+    """Test in-memory symbol -> subscribers index"""
+    print("="*60)
+    print("Testing Subscription Index")
+    print("="*60)
+    
+    import tempfile
+    
+    telegram_id, other_id = 123456784, 123456783
+    
+    original_path = user_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        index = None
+        try:
+            user_db.init_db()
+            user_db.create_user(telegram_id, "indexed")
+            user_db.create_user(other_id, "other")
+            user_db.update_subscription(telegram_id, 'basic', datetime.now() + timedelta(days=30))
+            for coin in ("BTC/USDT", "ETH/USDT", "XRP/USDT"):
+                user_db.add_tracked_coin(telegram_id, coin)
+            user_db.add_tracked_coin(other_id, "BTC/USDT")
+            index = SubscriptionIndex().attach()
+            
+            # Test 1: Index matches the database
+            print("\n1. Comparing index with database...")
+            assert index.symbols() == {"BTC/USDT", "ETH/USDT", "XRP/USDT"}
+            for symbol in index.symbols():
+                expected = {u['telegram_id'] for u in user_db.get_users_tracking_coin(symbol)}
+                actual = {u['telegram_id'] for u in index.subscribers(symbol)}
+                assert expected == actual, symbol
+            assert {u['telegram_id'] for u in index.subscribers("BTC/USDT")} == {telegram_id, other_id}
+            print(f"✅ Index consistent for {len(index.symbols())} symbols")
+            
+            # Test 2: Change notifications keep it current
+            print("\n2. Removing and re-adding XRP/USDT...")
+            user_db.remove_tracked_coin(telegram_id, "XRP/USDT")
+            assert telegram_id not in {u['telegram_id'] for u in index.subscribers("XRP/USDT")}
+            user_db.add_tracked_coin(telegram_id, "XRP/USDT")
+            assert telegram_id in {u['telegram_id'] for u in index.subscribers("XRP/USDT")}
+            print("✅ Index follows add/remove")
+            
+            # Test 3: Alert mode preference reaches the index
+            print("\n3. Switching to digest mode...")
+            user_db.set_alert_mode(telegram_id, 'digest')
+            assert index.subscribers("XRP/USDT")[0]['alert_mode'] == 'digest'
+            assert user_db.get_user_status(telegram_id)['alert_mode'] == 'digest'
+            user_db.set_alert_mode(telegram_id, 'immediate')
+            print("✅ Alert mode updated")
+            
+            # Test 4: Only other processes' subscription writes trigger a reload
+            print("\n4. Checking reload triggers...")
+            user_db.enqueue_alerts([{'telegram_id': telegram_id, 'symbol': 'XRP/USDT', 'message': 'index test',
+                                     'dedupe_key': 'test-index:1'}])
+            user_db.create_login_code(telegram_id)
+            assert not index.refresh_if_changed()  # outbox, login codes and own writes are not reloads
+            original_writer = user_db._writer
+            user_db._writer = (os.getpid(), 'other-process')
+            try:
+                user_db.remove_tracked_coin(telegram_id, "XRP/USDT")
+                user_db.add_tracked_coin(telegram_id, "XRP/USDT")
+            finally:
+                user_db._writer = original_writer
+            assert index.refresh_if_changed()
+            assert not index.refresh_if_changed()
+            print("✅ Reloads only for writes made elsewhere")
+        finally:
+            if index is not None:
+                user_db.remove_change_listener(index.apply_change)
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+    
+    print("\n" + "="*60)
+
+def test_alert_outbox():
+    """Test crash-safe alert outbox (enqueue -> claim -> mark)"""
+    print("="*60)
+    print("Testing Alert Outbox")
+    print("="*60)
+    
+    import tempfile
+    
+    telegram_id = 123456789
+    alerts = [
+        {'telegram_id': telegram_id, 'symbol': 'BTC/USDT', 'message': 'outbox test 1', 'dedupe_key': 'test-outbox:1'},
+        {'telegram_id': telegram_id, 'symbol': 'ETH/USDT', 'message': 'outbox test 2', 'dedupe_key': 'test-outbox:2'}
+    ]
+    
+    # Own database: fixed dedupe keys must not depend on what earlier runs left behind
+    original_path = user_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        try:
+            user_db.init_db()
+            
+            # Test 1: Enqueue is idempotent per dedupe key
+            print("\n1. Enqueueing alerts twice...")
+            assert user_db.enqueue_alerts(alerts) == 2
+            assert user_db.enqueue_alerts(alerts) == 0
+            print("✅ Duplicate scan did not enqueue twice")
+            
+            # Test 2: Claimed rows are invisible to other workers until the lease expires
+            print("\n2. Claiming alerts...")
+            claimed = user_db.claim_pending_alerts('worker-a', limit=1000)
+            assert len(claimed) == 2
+            assert not user_db.claim_pending_alerts('worker-b', limit=1000)
+            reclaimed = user_db.claim_pending_alerts('worker-b', limit=1000, lease=0)
+            assert len(reclaimed) == 2
+            print("✅ Lease respected, expired claims reclaimed")
+            
+            # Test 3: Outcomes
+            print("\n3. Marking outcomes...")
+            user_db.mark_alerts_delivered([claimed[0]['id']])
+            user_db.mark_alerts_failed([(claimed[1]['id'], 'Forbidden: bot was blocked by the user')], permanent=True)
+            assert not user_db.claim_pending_alerts('worker-c', limit=1000, lease=0)
+            stats = user_db.get_outbox_stats()
+            print(f"✅ Outbox stats: {stats}")
+            assert stats == {'delivered': 1, 'failed': 1}
+            
+            # Test 4: Retention purge only drops closed rows past the cutoff
+            print("\n4. Purging old rows...")
+            user_db.enqueue_alerts([{'telegram_id': telegram_id, 'message': 'outbox test 3', 'dedupe_key': 'test-outbox:3'}])
+            assert user_db.purge_delivered_alerts(older_than_days=7) == 0
+            conn = user_db.get_connection()
+            conn.execute("UPDATE alert_outbox SET created_at = datetime('now', '-8 days')")
+            conn.commit()
+            conn.close()
+            assert user_db.purge_delivered_alerts(older_than_days=7) == 2
+            assert user_db.get_outbox_stats() == {'pending': 1}
+            print("✅ Delivered/failed rows purged, pending kept")
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+    
+    print("\n" + "="*60)
+
+def test_digest_merge():
+    """Test that digest entries from every scanner shard merge into one message per user"""
+    print("="*60)
+    print("Testing Digest Merge")
+    print("="*60)
+    
+    import json
+    import tempfile
+    
+    def entry(symbol, risk_score):
+        return {'symbol': symbol, 'risk_score': risk_score, 'severity': 'warning',
+                'message': f"{symbol} alert", 'digest_line': f"{symbol} {risk_score}"}
+    
+    def render(entries):
+        return ', '.join(e['digest_line'] for e in sorted(entries, key=lambda e: e['symbol']))
+    
+    # Same scan cycle, two scanner shards; BTC alerted again in a later cycle
+    rows = [
+        (111, '100:shard-a', entry('BTC/USDT', 60)),
+        (111, '100:shard-b', entry('ETH/USDT', 70)),
+        (222, '100:shard-b', entry('ETH/USDT', 70)),
+        (111, '400:shard-a', entry('BTC/USDT', 80))
+    ]
+    
+    original_path = user_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        try:
+            user_db.init_db()
+            assert user_db.enqueue_alerts([
+                {'telegram_id': telegram_id, 'symbol': e['symbol'], 'message': json.dumps(e),
+                 'dedupe_key': f"{scan_key}:{e['symbol']}:{telegram_id}", 'status': 'digest'}
+                for telegram_id, scan_key, e in rows
+            ]) == 4
+            
+            # Test 1: Entries wait for the window and are never claimed on their own
+            print("\n1. Merging before the window ends...")
+            assert user_db.merge_digest_alerts(render, window=3600) == 0
+            assert not user_db.claim_pending_alerts('worker-a', limit=1000)
+            print("✅ Digest entries deferred")
+            
+            # Test 2: One message per user, newest entry per coin
+            print("\n2. Merging after the window...")
+            assert user_db.merge_digest_alerts(render, window=0) == 2
+            claimed = {row['telegram_id']: row['message'] for row in user_db.claim_pending_alerts('worker-a', limit=1000)}
+            print(f"✅ Digests: {claimed}")
+            assert claimed == {111: 'BTC/USDT 80, ETH/USDT 70', 222: 'ETH/USDT 70'}
+            assert user_db.get_outbox_stats() == {'pending': 2}
+            assert user_db.merge_digest_alerts(render, window=0) == 0
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+    
+    print("\n" + "="*60)
+
+def test_unreachable_user_pruning():
+    """Test that users who blocked the bot leave alert fan-out until they interact again"""
+    print("="*60)
+    print("Testing Unreachable User Pruning")
+    print("="*60)
+    
+    import tempfile
+    
+    telegram_id = 123456782
+    
+    def tracking(symbol):
+        return telegram_id in {u['telegram_id'] for u in user_db.get_users_tracking_coin(symbol)}
+    
+    original_path = user_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        index = None
+        try:
+            user_db.init_db()
+            user_db.create_user(telegram_id, "blocker")
+            user_db.add_tracked_coin(telegram_id, "XRP/USDT")
+            index = SubscriptionIndex().attach()
+            
+            assert tracking("XRP/USDT")
+            user_db.enqueue_alerts([{'telegram_id': telegram_id, 'symbol': 'XRP/USDT',
+                                     'message': 'prune test', 'dedupe_key': 'test-outbox:prune'}])
+            
+            # Test 1: Transient failure is recorded but keeps the user
+            print("\n1. Recording a transient failure...")
+            assert user_db.record_delivery_outcomes(failures=[(telegram_id, 'Timed out', False)]) == []
+            assert tracking("XRP/USDT")
+            assert user_db.get_user(telegram_id)['delivery_failures'] == 1
+            print("✅ User still active")
+            
+            # Test 2: Blocked bot deactivates the user and fails their pending alerts
+            print("\n2. Recording 'bot was blocked by the user'...")
+            deactivated = user_db.record_delivery_outcomes(
+                failures=[(telegram_id, 'Forbidden: bot was blocked by the user', True)]
+            )
+            assert deactivated == [telegram_id]
+            assert not tracking("XRP/USDT")
+            assert telegram_id not in {u['telegram_id'] for u in index.subscribers("XRP/USDT")}
+            assert user_db.claim_pending_alerts('worker-prune', lease=0) == []
+            print("✅ User excluded from fan-out")
+            
+            # Test 3: Interacting again restores alerts
+            print("\n3. Reactivating on interaction...")
+            assert user_db.reactivate_user(telegram_id)
+            assert not user_db.reactivate_user(telegram_id)
+            assert tracking("XRP/USDT")
+            assert telegram_id in {u['telegram_id'] for u in index.subscribers("XRP/USDT")}
+            user_db.record_delivery_outcomes(delivered=[telegram_id])
+            assert user_db.get_user(telegram_id)['delivery_failures'] == 0
+            print("✅ User active again")
+        finally:
+            if index is not None:
+                user_db.remove_change_listener(index.apply_change)
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+    
+    print("\n" + "="*60)
+
+def test_connection_pool():
+    """Test per-thread pooled connections"""
+    print("="*60)
+    print("Testing Connection Pool")
+    print("="*60)
+    
+    import threading
+    
+    conn = user_db.get_connection()
+    conn.close()
+    assert user_db.get_connection() is conn
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    
+    # Uncommitted work is discarded on close(), like a real close
+    conn.execute("INSERT INTO users (telegram_id, username) VALUES (?, ?)", (987654321, 'pooltest'))
+    conn.close()
+    assert user_db.get_user(987654321) is None
+    
+    other = []
+    thread = threading.Thread(target=lambda: other.append(user_db.get_connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+    print("✅ One reusable connection per thread")
+    
+    print("\n" + "="*60)
+
+def test_track_coin_reasons():
+    """Test atomic tier-checked add and its reason codes"""
+    print("="*60)
+    print("Testing Atomic Track Coin")
+    print("="*60)
+    
+    import threading
+    
+    telegram_id = 123456788
+    user_db.create_user(telegram_id, "racer")
+    
+    try:
+        assert user_db.track_coin(999999999, "BTC/USDT") == user_db.ADD_USER_NOT_FOUND
+        
+        # Free tier (1 coin): concurrent adds must not exceed the limit
+        results = []
+        threads = [
+            threading.Thread(target=lambda s=symbol: results.append(user_db.track_coin(telegram_id, s)))
+            for symbol in ["BTC/USDT", "ETH/USDT", "SOL/USDT", "XRP/USDT"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert results.count(user_db.ADD_OK) == 1
+        assert results.count(user_db.ADD_LIMIT_REACHED) == 3
+        assert user_db.get_tracked_coins_count(telegram_id) == 1
+        print("✅ Concurrent adds respect the free tier limit")
+        
+        tracked = user_db.get_tracked_coins(telegram_id)[0]['symbol']
+        assert user_db.track_coin(telegram_id, tracked) == user_db.ADD_ALREADY_TRACKING
+        
+        # Expired paid tier is downgraded inside the same transaction
+        user_db.update_subscription(telegram_id, 'basic', datetime.now() - timedelta(days=1))
+        assert user_db.track_coin(telegram_id, "DOGE/USDT") == user_db.ADD_LIMIT_REACHED
+        assert user_db.get_user(telegram_id)['subscription_tier'] == 'free'
+        
+        user_db.update_subscription(telegram_id, 'basic', datetime.now() + timedelta(days=30))
+        assert user_db.track_coin(telegram_id, "DOGE/USDT") == user_db.ADD_OK
+        print("✅ Reason codes: not found / limit / duplicate / expired")
+    finally:
+        conn = user_db.get_connection(telegram_id)
+        conn.execute("DELETE FROM tracked_coins WHERE telegram_id = ?", (telegram_id,))
+        conn.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
+        conn.commit()
+        conn.close()
+        user_db.clear_caches()
+    
+    print("\n" + "="*60)
+
+def test_user_cache():
+    """Test read-through user cache and its invalidation"""
+    print("="*60)
+    print("Testing User Cache")
+    print("="*60)
+    
+    telegram_id = 123456787
+    user_db.clear_caches()
+    user_db.create_user(telegram_id, "cached")
+    
+    try:
+        before = user_db.get_cache_stats()['users']
+        user_db.get_user(telegram_id)
+        user_db.get_user(telegram_id)
+        after = user_db.get_cache_stats()['users']
+        assert after['hits'] - before['hits'] >= 1
+        
+        # Callers get copies: mutating a result doesn't touch the cache
+        user_db.get_user(telegram_id)['subscription_tier'] = 'pro'
+        assert user_db.get_user(telegram_id)['subscription_tier'] == 'free'
+        print(f"✅ Cache hits: {after}")
+        
+        user_db.update_subscription(telegram_id, 'basic', datetime.now() + timedelta(days=30))
+        assert user_db.get_user(telegram_id)['subscription_tier'] == 'basic'
+        
+        assert user_db.get_tracked_coins_count(telegram_id) == 0
+        user_db.add_tracked_coin(telegram_id, "BTC/USDT")
+        assert user_db.get_tracked_coins_count(telegram_id) == 1
+        user_db.remove_tracked_coin(telegram_id, "BTC/USDT")
+        assert user_db.get_tracked_coins_count(telegram_id) == 0
+        
+        # Writes inside a batch invalidate once the batch is over
+        with user_db.batch() as run:
+            run(user_db.set_alert_mode, telegram_id, 'digest')
+        assert user_db.get_user(telegram_id)['alert_mode'] == 'digest'
+        print("✅ Writes invalidate cached rows and counts")
+        
+        # Listeners hear about batch writes once committed; rows read inside a batch aren't cached
+        events = []
+        listener = lambda event, tid, data: events.append(event)
+        user_db.add_change_listener(listener)
+        try:
+            with user_db.batch() as run:
+                run(user_db.set_alert_mode, telegram_id, 'immediate')
+                run(user_db.set_alert_mode, telegram_id, 'bogus')
+                assert events == []
+                assert user_db.get_user(telegram_id)['alert_mode'] == 'immediate'
+            assert events == ['alert_mode_updated']
+            
+            try:
+                with user_db.batch() as run:
+                    run(user_db.set_alert_mode, telegram_id, 'digest')
+                    assert user_db.get_user(telegram_id)['alert_mode'] == 'digest'
+                    raise RuntimeError("abort batch")
+            except RuntimeError:
+                pass
+            assert events == ['alert_mode_updated']
+            assert user_db.get_user(telegram_id)['alert_mode'] == 'immediate'
+        finally:
+            user_db.remove_change_listener(listener)
+        print("✅ Batch events delivered after commit only")
+    finally:
+        conn = user_db.get_connection(telegram_id)
+        conn.execute("DELETE FROM tracked_coins WHERE telegram_id = ?", (telegram_id,))
+        conn.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
+        conn.commit()
+        conn.close()
+        user_db.clear_caches()
+    
+    print("\n" + "="*60)
+
+def test_expiry_sweeper():
+    """Test bulk subscription expiry sweep and its crash-safe notices"""
+    print("="*60)
+    print("Testing Subscription Expiry Sweeper")
+    print("="*60)
+    
+    import tempfile
+    
+    expired_id, active_id = 123456786, 123456785
+    render = lambda user: f"{user['subscription_tier']} expired"
+    
+    original_path, original_enqueue = user_db.DB_PATH, user_db.enqueue_alerts
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        try:
+            user_db.init_db()
+            user_db.create_user(expired_id, "expired")
+            user_db.create_user(active_id, "active")
+            user_db.update_subscription(expired_id, 'basic', datetime.now() - timedelta(minutes=1))
+            user_db.update_subscription(active_id, 'pro', datetime.now() + timedelta(days=30))
+            
+            # Reads don't write: the downgrade waits for the sweeper
+            assert user_db.get_user_status(expired_id)['tier'] == 'basic'
+            
+            expired = user_db.expire_subscriptions()
+            assert [(u['telegram_id'], u['subscription_tier']) for u in expired] == [(expired_id, 'basic')]
+            assert user_db.get_user_status(expired_id)['tier'] == 'free'
+            assert user_db.get_user_status(expired_id)['subscription_expires'] is None
+            assert user_db.get_user_status(active_id)['tier'] == 'pro'
+            assert user_db.expire_subscriptions() == []
+            print(f"✅ Downgraded: {expired}")
+            
+            # Crash before the notice reached the outbox: the mark survives for the next sweep
+            def failing_enqueue(alerts):
+                raise RuntimeError("crashed before enqueue")
+            user_db.enqueue_alerts = failing_enqueue
+            try:
+                user_db.queue_expiry_notices(render)
+                assert False, "enqueue error must propagate"
+            except RuntimeError:
+                pass
+            finally:
+                user_db.enqueue_alerts = original_enqueue
+            assert user_db.queue_expiry_notices(render) == 1
+            assert user_db.queue_expiry_notices(render) == 0
+            notices = user_db.claim_pending_alerts('worker-a', limit=1000)
+            assert [(n['telegram_id'], n['message']) for n in notices] == [(expired_id, 'basic expired')]
+            print("✅ Expiry notice queued once, after a failed first attempt")
+            
+            # A downgrade done inline by track_coin() is marked for a notice too
+            inline_id = 123456781
+            user_db.create_user(inline_id, "inline")
+            user_db.update_subscription(inline_id, 'pro', datetime.now() - timedelta(minutes=1))
+            assert user_db.track_coin(inline_id, "BTC/USDT") == user_db.ADD_OK
+            assert user_db.get_user_status(inline_id)['tier'] == 'free'
+            assert user_db.queue_expiry_notices(render) == 1
+            notices = user_db.claim_pending_alerts('worker-a', limit=1000)
+            assert [(n['telegram_id'], n['message']) for n in notices] == [(inline_id, 'pro expired')]
+            print("✅ Inline downgrade notified")
+            
+            conn = user_db.get_connection()
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT telegram_id FROM users WHERE subscription_expires < ? AND subscription_tier != 'free'",
+                (str(datetime.now()),)
+            ).fetchall()
+            conn.close()
+            assert any('idx_users_subscription_expires' in row[-1] for row in plan)
+            print("✅ Sweep uses the subscription_expires index")
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+    
+    print("\n" + "="*60)
+
+def test_symbol_dictionary_migration():
+    """Test migrating string tracked_coins rows to symbol ids"""
+    print("="*60)
+    print("Testing Symbol Dictionary Migration")
+    print("="*60)
+    
+    import os
+    import sqlite3
+    import tempfile
+    
+    original_path = user_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        
+        # Schema version 0: symbol strings stored per row
+        conn = sqlite3.connect(user_db.DB_PATH)
+        conn.executescript('''
+            CREATE TABLE users (telegram_id INTEGER PRIMARY KEY, username TEXT,
+                                subscription_tier TEXT DEFAULT 'free', subscription_expires DATETIME,
+                                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                updated_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE tracked_coins (id INTEGER PRIMARY KEY AUTOINCREMENT, telegram_id INTEGER NOT NULL,
+                                        symbol TEXT NOT NULL, added_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                                        UNIQUE(telegram_id, symbol));
+            CREATE INDEX idx_tracked_coins_symbol ON tracked_coins(symbol);
+            INSERT INTO users (telegram_id, username, subscription_tier) VALUES (1, 'a', 'pro'), (2, 'b', 'free');
+            INSERT INTO tracked_coins (telegram_id, symbol) VALUES (1, 'BTC/USDT'), (1, 'ETH/USDT'), (2, 'BTC/USDT');
+        ''')
+        conn.close()
+        
+        try:
+            user_db.init_db()
+            user_db.init_db()  # already migrated: no-op
+            
+            assert sorted(c['symbol'] for c in user_db.get_tracked_coins(1)) == ["BTC/USDT", "ETH/USDT"]
+            assert sorted(u['telegram_id'] for u in user_db.get_users_tracking_coin("BTC/USDT")) == [1, 2]
+            assert user_db.track_coin(2, "BTC/USDT") == user_db.ADD_ALREADY_TRACKING
+            assert user_db.track_coin(1, "SOL/USDT") == user_db.ADD_OK
+            assert user_db.remove_tracked_coin(1, "BTC/USDT")
+            assert len(user_db.get_all_subscriptions()) == 3
+            
+            conn = user_db.get_connection()
+            assert conn.execute('PRAGMA user_version').fetchone()[0] == user_db.SCHEMA_VERSION
+            assert conn.execute('SELECT COUNT(*) FROM symbols').fetchone()[0] == 3
+            plan = conn.execute('''
+                EXPLAIN QUERY PLAN SELECT tc.telegram_id FROM symbols s
+                INNER JOIN tracked_coins tc ON tc.symbol_id = s.id WHERE s.symbol = ?
+            ''', ("BTC/USDT",)).fetchall()
+            conn.close()
+            assert any('idx_tracked_coins_symbol' in row[-1] for row in plan)
+            print("✅ Rows migrated, string API unchanged")
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+    
+    print("\n" + "="*60)
+
+def test_bulk_operations():
+    """Test bulk create / update / track and export-import round trip"""
+    print("="*60)
+    print("Testing Bulk Operations")
+    print("="*60)
+    
+    import os
+    import sqlite3
+    import tempfile
+    
+    original_path = user_db.DB_PATH
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        user_db.init_db()
+        
+        try:
+            outcomes = user_db.create_users_bulk([
+                {'telegram_id': 1, 'username': 'a'},
+                {'telegram_id': 2, 'username': 'b', 'alert_mode': 'digest'},
+                {'telegram_id': 1, 'username': 'dup'},
+                {'telegram_id': 3, 'alert_mode': 'bogus'}
+            ])
+            assert outcomes == [user_db.ROW_CREATED, user_db.ROW_CREATED, user_db.ROW_EXISTS, user_db.ROW_INVALID]
+            
+            outcomes = user_db.update_subscriptions_bulk([
+                (1, 'basic', datetime.now() + timedelta(days=30)),
+                (2, 'gold', None),
+                (9, 'pro', None)
+            ])
+            assert outcomes == [user_db.ROW_UPDATED, user_db.ROW_INVALID, user_db.ROW_USER_NOT_FOUND]
+            
+            outcomes = user_db.add_tracked_coins_bulk([
+                (1, "BTC/USDT"), (1, "ETH/USDT"), (1, "BTC/USDT"),
+                (2, "BTC/USDT"), (2, "ETH/USDT"),  # free tier: 1 coin
+                (9, "BTC/USDT")
+            ])
+            assert outcomes == [
+                user_db.ADD_OK, user_db.ADD_OK, user_db.ADD_ALREADY_TRACKING,
+                user_db.ADD_OK, user_db.ADD_LIMIT_REACHED,
+                user_db.ADD_USER_NOT_FOUND
+            ]
+            assert user_db.get_tracked_coins_count(1) == 2
+            print("✅ Per-row outcomes reported")
+            
+            for fmt in user_db.EXPORT_FORMATS:
+                path = os.path.join(tmp, f"users.{fmt}")
+                assert user_db.export_users(path) == 2
+                
+                user_db.close_connections()
+                user_db.DB_PATH = os.path.join(tmp, f"restored_{fmt}.db")
+                user_db.init_db()
+                summary = user_db.import_users(path, chunk_size=1)
+                assert summary['users'] == {user_db.ROW_CREATED: 2}
+                assert summary['coins'] == {user_db.ADD_OK: 3}
+                assert user_db.get_user_status(1)['tier'] == 'basic'
+                assert user_db.get_user(2)['alert_mode'] == 'digest'
+                assert sorted(c['symbol'] for c in user_db.get_tracked_coins(1)) == ["BTC/USDT", "ETH/USDT"]
+                print(f"✅ {fmt} round trip: {summary}")
+            
+            # A chunk whose coins fail is rolled back whole: no users left without their coins
+            original_add = user_db.add_tracked_coins_bulk
+            def failing_add(rows, enforce_limits=True):
+                if any(telegram_id == 2 for telegram_id, _ in rows):
+                    raise sqlite3.OperationalError("disk I/O error")
+                return original_add(rows, enforce_limits=enforce_limits)
+            
+            user_db.close_connections()
+            user_db.DB_PATH = os.path.join(tmp, "partial.db")
+            user_db.init_db()
+            user_db.add_tracked_coins_bulk = failing_add
+            try:
+                user_db.import_users(path, chunk_size=1)
+                assert False, "failed chunk must raise"
+            except sqlite3.OperationalError:
+                pass
+            finally:
+                user_db.add_tracked_coins_bulk = original_add
+            assert user_db.get_user(1) is not None and user_db.get_tracked_coins_count(1) == 2
+            assert user_db.get_user(2) is None
+            print("✅ Failed chunk rolled back with its users and subscriptions")
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH = original_path
+    
+    print("\n" + "="*60)
+
+def test_sharded_backend():
+    """Test users spread over several shard files behind the same API"""
+    print("="*60)
+    print("Testing Sharded User Database")
+    print("="*60)
+    
+    import os
+    import sqlite3
+    import tempfile
+    
+    original_path, original_shards = user_db.DB_PATH, user_db.USER_DB_SHARDS
+    with tempfile.TemporaryDirectory() as tmp:
+        user_db.DB_PATH = os.path.join(tmp, "users.db")
+        user_db.USER_DB_SHARDS = 4
+        user_db.init_db()
+        
+        try:
+            paths = user_db.shard_paths()
+            assert len(paths) == 4 and all(os.path.exists(path) for path in paths)
+            
+            for telegram_id in range(1, 41):
+                user_db.create_user(telegram_id, f"user{telegram_id}")
+                user_db.add_tracked_coin(telegram_id, "BTC/USDT")
+            
+            per_shard = []
+            for path in paths:
+                conn = sqlite3.connect(path)
+                per_shard.append(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+                conn.close()
+            assert sum(per_shard) == 40 and min(per_shard) > 0
+            print(f"✅ Users per shard: {per_shard}")
+            
+            # Cross-shard reads fan out and merge
+            assert len(user_db.get_all_users()) == 40
+            assert sorted(u['telegram_id'] for u in user_db.get_users_tracking_coin("BTC/USDT")) == list(range(1, 41))
+            assert len(user_db.get_all_subscriptions()) == 40
+            
+            # Login codes route back to the user's shard
+            code = user_db.create_login_code(7)
+            assert int(code) % 4 == user_db.shard_for(7)
+            assert user_db.verify_login_code(code) == 7
+            
+            # One batch spans every shard it touches
+            with user_db.batch() as run:
+                results = [run(user_db.set_alert_mode, telegram_id, 'digest') for telegram_id in range(1, 9)]
+                results.append(run(user_db.set_alert_mode, 9, 'bogus'))
+            assert all(error is None for _, error in results[:-1]) and isinstance(results[-1][1], ValueError)
+            assert all(user_db.get_user(telegram_id)['alert_mode'] == 'digest' for telegram_id in range(1, 9))
+            
+            outcomes = user_db.add_tracked_coins_bulk([(telegram_id, "ETH/USDT") for telegram_id in range(1, 41)],
+                                                      enforce_limits=False)
+            assert outcomes == [user_db.ADD_OK] * 40
+            print("✅ Fan-out reads, login codes, batches and bulk ops across shards")
+        finally:
+            user_db.close_connections()
+            user_db.DB_PATH, user_db.USER_DB_SHARDS = original_path, original_shards
+    
+    print("\n" + "="*60)
+
 def cleanup():
     """Clean up test data"""
     print("\n" + "="*60)
     print("Cleaning up test data...")
     print("="*60)
     
-    import sqlite3
-    conn = sqlite3.connect(user_db.DB_PATH)
-    cursor = conn.cursor()
+    # Delete test user and their tracked coins (on the user's shard)
+    telegram_id = 123456789
+    conn = user_db.get_connection(telegram_id)
+    conn.execute("DELETE FROM tracked_coins WHERE telegram_id = ?", (telegram_id,))
+    conn.execute("DELETE FROM users WHERE telegram_id = ?", (telegram_id,))
+    conn.commit()
+    conn.close()
     
-    # Delete test user and their tracked coins (CASCADE will handle tracked_coins)
-    cursor.execute("DELETE FROM users WHERE telegram_id = ?", (123456789,))
+    # The outbox lives in the main database
+    conn = user_db.get_connection()
+    conn.execute("DELETE FROM alert_outbox WHERE dedupe_key LIKE 'test-outbox:%'")
     conn.commit()
     conn.close()
+    user_db.clear_caches()
     
     print("✅ Test data cleaned up")
 
@@ -134,6 +819,17 @@ if __name__ == "__main__":
         test_user_operations()
         test_coin_tracking()
         test_subscription_upgrade()
+        test_subscription_index()
+        test_alert_outbox()
+        test_digest_merge()
+        test_unreachable_user_pruning()
+        test_connection_pool()
+        test_track_coin_reasons()
+        test_user_cache()
+        test_expiry_sweeper()
+        test_symbol_dictionary_migration()
+        test_bulk_operations()
+        test_sharded_backend()
         
         print("\n\n✅ All tests completed successfully!")
         print("\nYou can now:")
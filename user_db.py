@@ -3,16 +3,31 @@ User Database Module for Crypto Radar
 Manages users, subscriptions, and tracked coins using SQLite
 """
 
+import csv
+import json
 import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Callable
 import os
 import random
-import string
+import threading
+import time
+import weakref
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 # Database file path
 DB_PATH = os.path.join(os.path.dirname(__file__), 'data', 'users.db')
 
+# Users (with their watchlists and login codes) are spread over this many SQLite files
+# by telegram_id hash; each file has its own write lock. The alert outbox always stays in DB_PATH.
+# Measured with bench_user_db.py on one host, sharding gave no write gain (16 threads:
+# 1 shard 12.5k-15.5k ops/s, 4 shards 12.1k-14.2k): in one process writes are bound by the GIL,
+# not the file lock. Keep 1 unless a multi-core benchmark shows the lock is the bottleneck.
+USER_DB_SHARDS = int(os.getenv('USER_DB_SHARDS', 1))
+
 # Subscription tier limits
 TIER_LIMITS = {
     'free': 1,
@@ -20,12 +35,73 @@ TIER_LIMITS = {
     'pro': float('inf')
 }
 
+# track_coin() result codes
+ADD_OK = 'added'
+ADD_USER_NOT_FOUND = 'user_not_found'
+ADD_ALREADY_TRACKING = 'already_tracking'
+ADD_LIMIT_REACHED = 'limit_reached'
+
+# Per-row outcomes of the bulk operations (add_tracked_coins_bulk uses the ADD_* codes)
+ROW_CREATED = 'created'
+ROW_UPDATED = 'updated'
+ROW_EXISTS = 'already_exists'
+ROW_USER_NOT_FOUND = ADD_USER_NOT_FOUND
+ROW_INVALID = 'invalid'
+
+# Bulk export / import
+EXPORT_FORMATS = ('csv', 'jsonl')
+EXPORT_FIELDS = ['telegram_id', 'username', 'subscription_tier', 'subscription_expires', 'alert_mode', 'symbols']
+IMPORT_CHUNK_SIZE = 50000
+
+# TIER_LIMITS as a SQL expression over users u (unlimited tiers never block)
+_TIER_LIMIT_SQL = "CASE u.subscription_tier " + " ".join(
+    f"WHEN '{tier}' THEN {2**63 - 1 if limit == float('inf') else limit}" for tier, limit in TIER_LIMITS.items()
+) + " ELSE 0 END"
+
+# create_login_code() redraws a code already held by another user up to this many times
+LOGIN_CODE_ATTEMPTS = 5
+
+# Alert delivery preference: one message per alert, or one merged digest per scan
+ALERT_MODES = ('immediate', 'digest')
+
+# Alert outbox: claims expire after OUTBOX_LEASE seconds (crashed delivery worker),
+# transient failures are retried up to OUTBOX_MAX_ATTEMPTS times
+OUTBOX_LEASE = 300
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETENTION_DAYS = int(os.getenv('OUTBOX_RETENTION_DAYS', 7))  # closed rows kept for inspection
+
+# In-process cache of user rows and tracked-coin counts (read-through, invalidated on writes).
+# The TTL bounds how long a write made by another process can go unseen.
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 30))
+
+# Schema version stored in PRAGMA user_version (1: tracked_coins references the symbols dictionary)
+SCHEMA_VERSION = 1
+
+# Clustered by user (count / list are PK range scans); symbols are stored once in `symbols`
+_TRACKED_COINS_SQL = '''
+    CREATE TABLE {table} (
+        telegram_id INTEGER NOT NULL,
+        symbol_id INTEGER NOT NULL,
+        added_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (telegram_id, symbol_id),
+        FOREIGN KEY (telegram_id) REFERENCES users(telegram_id) ON DELETE CASCADE,
+        FOREIGN KEY (symbol_id) REFERENCES symbols(id)
+    ) WITHOUT ROWID
+'''
+
 def init_db():
-    """Initialize database with required tables"""
+    """Initialize the main database and every user shard with the required tables"""
     # Create data directory if it doesn't exist
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
     
-    conn = sqlite3.connect(DB_PATH)
+    for path in dict.fromkeys([DB_PATH] + shard_paths()):
+        _init_file(path)
+
+def _init_file(path: str):
+    # Every file gets the full schema; unused tables stay empty
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=WAL')
     cursor = conn.cursor()
     
     # Users table
@@ -35,23 +111,40 @@ def init_db():
             username TEXT,
             subscription_tier TEXT DEFAULT 'free',
             subscription_expires DATETIME,
+            alert_mode TEXT DEFAULT 'immediate',
+            is_active INTEGER DEFAULT 1,
+            delivery_failures INTEGER DEFAULT 0,
+            last_delivery_error TEXT,
+            last_delivered_at DATETIME,
+            expired_tier TEXT,
+            expired_at DATETIME,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
             updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
     ''')
     
-    # Tracked coins table
+    # Migrate databases created before these columns existed
+    _add_missing_column(cursor, 'users', 'alert_mode', "TEXT DEFAULT 'immediate'")
+    _add_missing_column(cursor, 'users', 'is_active', "INTEGER DEFAULT 1")
+    _add_missing_column(cursor, 'users', 'delivery_failures', "INTEGER DEFAULT 0")
+    _add_missing_column(cursor, 'users', 'last_delivery_error', "TEXT")
+    _add_missing_column(cursor, 'users', 'last_delivered_at', "DATETIME")
+    _add_missing_column(cursor, 'users', 'expired_tier', "TEXT")      # downgraded, expiry notice not queued yet
+    _add_missing_column(cursor, 'users', 'expired_at', "DATETIME")
+    
+    # Symbol dictionary: each symbol string is stored once, rows reference it by id
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tracked_coins (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER NOT NULL,
-            symbol TEXT NOT NULL,
-            added_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (telegram_id) REFERENCES users(telegram_id) ON DELETE CASCADE,
-            UNIQUE(telegram_id, symbol)
+        CREATE TABLE IF NOT EXISTS symbols (
+            id INTEGER PRIMARY KEY,
+            symbol TEXT NOT NULL UNIQUE
         )
     ''')
     
+    # Tracked coins table
+    cursor.execute(_TRACKED_COINS_SQL.format(table='IF NOT EXISTS tracked_coins'))
+    conn.commit()
+    _migrate_schema(conn, path)
+    
     # Auth codes table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS auth_codes (
@@ -62,47 +155,505 @@ def init_db():
         )
     ''')
     
-    # Create indexes for better query performance
+    # Alert outbox: scanner enqueues rendered alerts, delivery worker drains them
+    # (status: 'digest' entry -> merged into one 'pending' row per user -> 'delivered' / 'failed')
     cursor.execute('''
-        CREATE INDEX IF NOT EXISTS idx_tracked_coins_telegram_id 
-        ON tracked_coins(telegram_id)
+        CREATE TABLE IF NOT EXISTS alert_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            symbol TEXT,
+            message TEXT NOT NULL,
+            dedupe_key TEXT UNIQUE,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            claimed_by TEXT,
+            claimed_at REAL,
+            last_error TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            delivered_at DATETIME
+        )
     ''')
     
+    # Subscription-relevant writes counted per writer process (see _mark_changed)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_counters (
+            writer TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    
+    # Create indexes for better query performance
+    # (tracked_coins by telegram_id is served by its primary key)
     cursor.execute('''
         CREATE INDEX IF NOT EXISTS idx_tracked_coins_symbol 
-        ON tracked_coins(symbol)
+        ON tracked_coins(symbol_id)
+    ''')
+    
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_alert_outbox_status 
+        ON alert_outbox(status, id)
+    ''')
+    
+    # Expiry sweeper range scan
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_subscription_expires 
+        ON users(subscription_expires)
     ''')
     
     conn.commit()
     conn.close()
 
-def get_connection():
-    """Get database connection"""
-    conn = sqlite3.connect(DB_PATH)
+def _migrate_schema(conn, path: str):
+    """Bring a database created by an older version up to SCHEMA_VERSION (one transaction)"""
+    if conn.execute('PRAGMA user_version').fetchone()[0] >= SCHEMA_VERSION:
+        return
+    
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(tracked_coins)')]
+    script = ''
+    if 'symbol' in columns:
+        # v0 -> v1: tracked_coins.symbol TEXT -> symbol_id INTEGER
+        script += f'''
+            INSERT OR IGNORE INTO symbols (symbol) SELECT DISTINCT symbol FROM tracked_coins ORDER BY symbol;
+            {_TRACKED_COINS_SQL.format(table='tracked_coins_v1')};
+            INSERT OR IGNORE INTO tracked_coins_v1 (telegram_id, symbol_id, added_at)
+                SELECT tc.telegram_id, s.id, tc.added_at
+                FROM tracked_coins tc INNER JOIN symbols s ON s.symbol = tc.symbol;
+            DROP TABLE tracked_coins;
+            ALTER TABLE tracked_coins_v1 RENAME TO tracked_coins;
+        '''
+    
+    try:
+        conn.executescript(f'''
+            BEGIN IMMEDIATE;
+            {script}
+            PRAGMA user_version = {SCHEMA_VERSION};
+            COMMIT;
+        ''')
+    except sqlite3.Error:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    
+    if script:
+        print(f"[OK] Migrated {path} to schema version {SCHEMA_VERSION}")
+
+def _add_missing_column(cursor, table: str, column: str, definition: str):
+    """ALTER TABLE ... ADD COLUMN if the column doesn't exist yet"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+# ==================== SHARDING ====================
+
+def shard_paths() -> List[str]:
+    """
+    Database file of every user shard, in shard order
+    Unsharded (USER_DB_SHARDS=1) that's just DB_PATH; otherwise users.<i>-of-<n>.db next to it.
+    The file name includes the shard count so a different count never reads a wrong layout
+    (move users between layouts with export_users() / import_users()).
+    """
+    if USER_DB_SHARDS <= 1:
+        return [DB_PATH]
+    root, ext = os.path.splitext(DB_PATH)
+    return [f"{root}.{shard}-of-{USER_DB_SHARDS}{ext}" for shard in range(USER_DB_SHARDS)]
+
+def shard_for(telegram_id: int) -> int:
+    """Shard index holding telegram_id (stable across processes, unlike hash())"""
+    if USER_DB_SHARDS <= 1:
+        return 0
+    return zlib.crc32(int(telegram_id).to_bytes(8, 'little', signed=True)) % USER_DB_SHARDS
+
+_fan_out_executor = None  # (pid, shard count, ThreadPoolExecutor)
+
+def _fan_out(fn: Callable[[int], object], shards=None) -> list:
+    """
+    Run fn(shard) for every shard (or the given ones) and return the results in that order
+    Shards are queried in parallel, each on its own pooled connection; a single shard, or a
+    call made inside batch() (which must stay on this thread's transaction), runs inline.
+    """
+    global _fan_out_executor
+    shards = list(range(len(shard_paths())) if shards is None else shards)
+    if len(shards) <= 1 or _in_batch():
+        return [fn(shard) for shard in shards]
+    
+    key = (os.getpid(), USER_DB_SHARDS)
+    with _pool_lock:
+        if _fan_out_executor is None or _fan_out_executor[:2] != key:
+            if _fan_out_executor is not None and _fan_out_executor[0] == key[0]:
+                _fan_out_executor[2].shutdown(wait=False)
+            executor = ThreadPoolExecutor(max_workers=USER_DB_SHARDS, thread_name_prefix="user-db-shard")
+            _fan_out_executor = (*key, executor)
+        executor = _fan_out_executor[2]
+    return list(executor.map(fn, shards))
+
+def _group_by_shard(items: List, telegram_id_of: Callable) -> Dict[int, List[int]]:
+    """shard -> indexes of the items whose telegram_id lives there"""
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(shard_for(telegram_id_of(item)), []).append(index)
+    return groups
+
+def _bulk_by_shard(items: List, telegram_id_of: Callable, fn: Callable[[int, List], List[str]]) -> List[str]:
+    """Run fn(shard, shard_items) per shard and put the per-row outcomes back in input order"""
+    groups = _group_by_shard(items, telegram_id_of)
+    outcomes = [None] * len(items)
+    results = _fan_out(lambda shard: fn(shard, [items[index] for index in groups[shard]]), groups)
+    for shard, shard_outcomes in zip(groups, results):
+        for index, outcome in zip(groups[shard], shard_outcomes):
+            outcomes[index] = outcome
+    return outcomes
+
+# ==================== CONNECTION POOL ====================
+
+class _PooledConnection(sqlite3.Connection):
+    """
+    Per-thread persistent connection: close() hands it back instead of closing it
+    Inside batch(), commit() / rollback() / BEGIN only affect the current call's savepoint
+    """
+    
+    batching = False
+    
+    def begin_immediate(self):
+        """Take the write lock now (no-op inside a batch, which already holds it)"""
+        if not self.batching:
+            self.execute('BEGIN IMMEDIATE')
+    
+    def commit(self):
+        if not self.batching:
+            super().commit()
+    
+    def rollback(self):
+        if self.batching:
+            self.execute(f'ROLLBACK TO {_SAVEPOINT}')
+        else:
+            super().rollback()
+    
+    def close(self):
+        # Same effect as closing for the caller: uncommitted work is discarded
+        if self.in_transaction and not self.batching:
+            self.rollback()
+    
+    def really_close(self):
+        super().close()
+
+_SAVEPOINT = 'user_db_call'
+
+_pool = threading.local()
+_pool_lock = threading.Lock()
+_pool_connections = weakref.WeakSet()  # connections die with their thread
+_pool_generation = 0  # bumped by close_connections() so every thread reconnects
+
+def _open_connection(db_path: str) -> _PooledConnection:
+    conn = sqlite3.connect(
+        db_path,
+        timeout=10,
+        factory=_PooledConnection,
+        cached_statements=256,  # prepared statements reused across calls on this connection
+        check_same_thread=False  # only so close_connections() can close it from another thread
+    )
     conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+    # Readers don't block the writer. WAL is persistent (set by init_db); switching needs an
+    # exclusive lock, so only do it if the file isn't in WAL mode yet
+    if conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+        conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')  # safe with WAL, fsync only at checkpoints
+    conn.execute('PRAGMA cache_size=-8000')  # 8 MB page cache
+    conn.execute('PRAGMA temp_store=MEMORY')
+    with _pool_lock:
+        _pool_connections.add(conn)
+    return conn
+
+def _pooled_connection(db_path: str) -> _PooledConnection:
+    key = (os.getpid(), _pool_generation)
+    # New connections after fork (never share a SQLite handle across processes)
+    # or close_connections()
+    if getattr(_pool, 'key', None) != key:
+        _pool.conns, _pool.key = {}, key
+    conn = _pool.conns.get(db_path)
+    if conn is None:
+        conn = _pool.conns[db_path] = _open_connection(db_path)
+    
+    batch_conns = getattr(_pool, 'batch_conns', None)
+    if batch_conns is not None:
+        # Inside batch(): the first use of each database joins the batch transaction,
+        # and every database touched by the current call gets the call's savepoint
+        if not conn.batching:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.batching = True
+            batch_conns.append(conn)
+        call_conns = _pool.call_conns
+        if call_conns is not None and all(c is not conn for c in call_conns):
+            conn.execute(f'SAVEPOINT {_SAVEPOINT}')
+            call_conns.append(conn)
     return conn
 
+def get_connection(telegram_id: int = None):
+    """
+    Get this thread's connection to the shard holding `telegram_id`
+    (the main database, which also holds the alert outbox, when telegram_id is None).
+    Opened on first use, reused afterwards; callers still call conn.close() when done,
+    which only rolls back uncommitted work.
+    """
+    if telegram_id is None:
+        return _pooled_connection(DB_PATH)
+    return _pooled_connection(shard_paths()[shard_for(telegram_id)])
+
+def _in_batch() -> bool:
+    return getattr(_pool, 'batch_conns', None) is not None
+
+def _shard_connection(shard: int):
+    return _pooled_connection(shard_paths()[shard])
+
+@contextmanager
+def batch():
+    """
+    Run several user_db calls as one write transaction per database on this thread
+    (one commit / fsync per database for the whole batch). Each call gets its own savepoint,
+    so a failing call is rolled back alone and reported without aborting the others.
+    With several shards the batch commits shard by shard (not atomically across shards).
+    
+    Usage:
+        with user_db.batch() as run:
+            results = [run(user_db.set_alert_mode, 1, 'digest'), ...]  # (result, error) pairs
+    """
+    if _in_batch():
+        raise RuntimeError("user_db.batch() cannot be nested")
+    
+    def run(fn: Callable, *args, **kwargs):
+        _pool.call_conns = call_conns = []
+        events = len(_pool.pending_events)
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            for conn in call_conns:
+                conn.execute(f'ROLLBACK TO {_SAVEPOINT}')
+                conn.execute(f'RELEASE {_SAVEPOINT}')
+            # The call's writes are gone: so are its change events
+            del _pool.pending_events[events:]
+            return None, e
+        finally:
+            _pool.call_conns = None
+        for conn in call_conns:
+            conn.execute(f'RELEASE {_SAVEPOINT}')
+        return result, None
+    
+    _pool.batch_conns, _pool.call_conns, _pool.pending_invalidations, _pool.pending_events = [], None, [], []
+    conns = _pool.batch_conns
+    committed = False
+    try:
+        yield run
+        for conn in conns:
+            conn.batching = False
+            conn.commit()
+        committed = True
+    except BaseException:
+        for conn in conns:
+            conn.batching = False
+            if conn.in_transaction:
+                conn.rollback()
+        raise
+    finally:
+        invalidations, events = _pool.pending_invalidations, _pool.pending_events
+        _pool.batch_conns = _pool.pending_invalidations = _pool.pending_events = None
+        for telegram_id, user, count in invalidations:
+            _invalidate_user(telegram_id, user, count)
+        for event, telegram_id, data in events:
+            if committed:
+                _notify(event, telegram_id, **data)
+            else:
+                # Listeners only hear about committed writes; cached rows are dropped either way
+                _invalidate_user(telegram_id, user=event in _USER_EVENTS, count=event in _COUNT_EVENTS)
+
+def close_connections():
+    """Close every pooled connection of this process and drop cached rows (shutdown, tests)"""
+    global _pool_generation
+    with _pool_lock:
+        connections = list(_pool_connections)
+        _pool_connections.clear()
+        _pool_generation += 1
+    for conn in connections:
+        try:
+            conn.really_close()
+        except sqlite3.Error:
+            pass
+    clear_caches()
+
+# ==================== USER CACHE ====================
+
+class _LRUCache:
+    """
+    Thread-safe LRU cache with TTL and hit/miss metrics
+    A value read from the DB is only stored if no invalidation happened while it was
+    being read (generation check), so a racing write can't leave a stale entry behind.
+    """
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'evictions': 0}
+    
+    def get(self, key):
+        """Returns (hit, value, generation); pass generation back to put()"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.stats['hits'] += 1
+                return True, entry[1], self._generation
+            self.stats['misses'] += 1
+            return False, None, self._generation
+    
+    def put(self, key, value, generation: int):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.stats['evictions'] += 1
+    
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+            self.stats['invalidations'] += 1
+    
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+    
+    def get_stats(self) -> Dict:
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'size': len(self._data),
+                'hit_ratio': round(self.stats['hits'] / lookups, 3) if lookups else 0.0
+            }
+
+# TTL bounds staleness from writes made by other processes (web app <-> bot)
+_user_cache = _LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)          # telegram_id -> user row
+_tracked_count_cache = _LRUCache(USER_CACHE_SIZE, USER_CACHE_TTL)  # telegram_id -> tracked coin count
+
+# Change events that make cached entries stale
+_USER_EVENTS = {'user_created', 'subscription_updated', 'alert_mode_updated', 'user_deactivated', 'user_reactivated'}
+_COUNT_EVENTS = {'coin_added', 'coin_removed'}
+
+def _invalidate_user(telegram_id: int, user: bool = True, count: bool = False):
+    pending = getattr(_pool, 'pending_invalidations', None)
+    if pending is not None:
+        # Not committed yet: invalidate after the batch commits
+        pending.append((telegram_id, user, count))
+        return
+    if user:
+        _user_cache.invalidate(telegram_id)
+    if count:
+        _tracked_count_cache.invalidate(telegram_id)
+
+def get_cache_stats() -> Dict:
+    """Hit/miss metrics of the user and tracked-count caches"""
+    return {'users': _user_cache.get_stats(), 'tracked_counts': _tracked_count_cache.get_stats()}
+
+def clear_caches():
+    _user_cache.clear()
+    _tracked_count_cache.clear()
+
+# ==================== CHANGE NOTIFICATIONS ====================
+
+# Callbacks notified after a write commits: callback(event, telegram_id, data)
+# Events: 'user_created', 'subscription_updated', 'alert_mode_updated', 'coin_added', 'coin_removed',
+#         'user_deactivated', 'user_reactivated'
+_change_listeners: List[Callable[[str, int, Dict], None]] = []
+
+def add_change_listener(callback: Callable[[str, int, Dict], None]):
+    """Register a callback for user / watchlist changes made in this process"""
+    if callback not in _change_listeners:
+        _change_listeners.append(callback)
+
+def remove_change_listener(callback: Callable[[str, int, Dict], None]):
+    """Unregister a change callback"""
+    if callback in _change_listeners:
+        _change_listeners.remove(callback)
+
+_writer = None  # (pid, writer id of this process in change_counters)
+
+def _writer_id() -> str:
+    global _writer
+    if _writer is None or _writer[0] != os.getpid():
+        _writer = (os.getpid(), f"{os.getpid()}-{random.getrandbits(48):012x}")
+    return _writer[1]
+
+def _mark_changed(conn):
+    """
+    Count a write that changes users' subscriptions (same transaction as the write)
+    Listeners in this process learn about it through _notify(); other processes see the
+    counter of this writer move (get_change_version) and know they have to reload
+    """
+    conn.execute('''
+        INSERT INTO change_counters (writer, version) VALUES (?, 1)
+        ON CONFLICT(writer) DO UPDATE SET version = version + 1
+    ''', (_writer_id(),))
+
+def get_change_version() -> tuple:
+    """Per shard: number of subscription writes made by other processes (moves only on their writes)"""
+    def query(shard: int) -> int:
+        conn = _shard_connection(shard)
+        row = conn.execute(
+            'SELECT COALESCE(SUM(version), 0) FROM change_counters WHERE writer != ?', (_writer_id(),)
+        ).fetchone()
+        conn.close()
+        return row[0]
+    
+    return tuple(_fan_out(query))
+
+def _notify(event: str, telegram_id: int, **data):
+    pending = getattr(_pool, 'pending_events', None)
+    if pending is not None:
+        # Inside batch(): delivered once the batch commits
+        pending.append((event, telegram_id, data))
+        return
+    _invalidate_user(telegram_id, user=event in _USER_EVENTS, count=event in _COUNT_EVENTS)
+    for callback in list(_change_listeners):
+        try:
+            callback(event, telegram_id, data)
+        except Exception as e:
+            print(f"[ERROR] Change listener failed for {event}: {e}")
+
 # ==================== AUTH OPERATIONS ====================
 
 def create_login_code(telegram_id: int) -> str:
     """Generate a 6-digit login code valid for 5 minutes"""
-    code = ''.join(random.choices(string.digits, k=6))
     expires_at = datetime.now() + timedelta(minutes=5)
     
-    conn = get_connection()
+    conn = get_connection(telegram_id)
     cursor = conn.cursor()
     
-    # Clean up old codes for this user
-    cursor.execute('DELETE FROM auth_codes WHERE telegram_id = ?', (telegram_id,))
-    
-    # Insert new code
-    cursor.execute('''
-        INSERT INTO auth_codes (code, telegram_id, expires_at)
-        VALUES (?, ?, ?)
-    ''', (code, telegram_id, expires_at))
-    
-    conn.commit()
-    conn.close()
+    try:
+        # Clean up old codes for this user
+        cursor.execute('DELETE FROM auth_codes WHERE telegram_id = ?', (telegram_id,))
+        
+        # Insert new code (draw again if another user holds the same one)
+        for attempt in range(LOGIN_CODE_ATTEMPTS):
+            # code % USER_DB_SHARDS is the user's shard, so verify_login_code() goes straight there
+            code = f"{random.randrange(shard_for(telegram_id), 10**6, max(USER_DB_SHARDS, 1)):06d}"
+            try:
+                cursor.execute('''
+                    INSERT INTO auth_codes (code, telegram_id, expires_at)
+                    VALUES (?, ?, ?)
+                ''', (code, telegram_id, expires_at))
+                break
+            except sqlite3.IntegrityError:
+                if attempt == LOGIN_CODE_ATTEMPTS - 1:
+                    raise
+        
+        conn.commit()
+    finally:
+        conn.close()
     
     return code
 
@@ -111,7 +662,7 @@ def verify_login_code(code: str) -> Optional[int]:
     Verify login code. Returns telegram_id if valid, None otherwise.
     Deletes code after successful verification.
     """
-    conn = get_connection()
+    conn = _shard_connection(int(code) % USER_DB_SHARDS if USER_DB_SHARDS > 1 and code.isdigit() else 0)
     cursor = conn.cursor()
     
     cursor.execute('SELECT telegram_id, expires_at FROM auth_codes WHERE code = ?', (code,))
@@ -145,7 +696,7 @@ def create_user(telegram_id: int, username: str = None) -> Dict:
     Create a new user with free tier
     Returns user data or None if user already exists
     """
-    conn = get_connection()
+    conn = get_connection(telegram_id)
     cursor = conn.cursor()
     
     try:
@@ -155,6 +706,7 @@ def create_user(telegram_id: int, username: str = None) -> Dict:
         ''', (telegram_id, username))
         conn.commit()
         
+        _notify('user_created', telegram_id, username=username, subscription_tier='free')
         return get_user(telegram_id)
     except sqlite3.IntegrityError:
         # User already exists
@@ -163,8 +715,14 @@ def create_user(telegram_id: int, username: str = None) -> Dict:
         conn.close()
 
 def get_user(telegram_id: int) -> Optional[Dict]:
-    """Get user by telegram_id"""
-    conn = get_connection()
+    """Get user by telegram_id (read-through cache, bypassed inside batch(): rows may be uncommitted)"""
+    batching = _in_batch()
+    if not batching:
+        hit, user, generation = _user_cache.get(telegram_id)
+        if hit:
+            return dict(user)
+    
+    conn = get_connection(telegram_id)
     cursor = conn.cursor()
     
     cursor.execute('SELECT * FROM users WHERE telegram_id = ?', (telegram_id,))
@@ -172,19 +730,25 @@ def get_user(telegram_id: int) -> Optional[Dict]:
     conn.close()
     
     if row:
-        return dict(row)
+        user = dict(row)
+        if not batching:
+            _user_cache.put(telegram_id, user, generation)
+        return dict(user)
     return None
 
 def get_all_users() -> List[Dict]:
-    """Get all users from database"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM users')
-    rows = cursor.fetchall()
-    conn.close()
+    """Get all users from database (every shard, queried in parallel)"""
+    def query(shard: int) -> List[Dict]:
+        conn = _shard_connection(shard)
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT * FROM users')
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
     
-    return [dict(row) for row in rows]
+    return [user for users in _fan_out(query) for user in users]
 
 
 def update_subscription(telegram_id: int, tier: str, expires_at: datetime = None) -> bool:
@@ -196,7 +760,7 @@ def update_subscription(telegram_id: int, tier: str, expires_at: datetime = None
     if tier not in TIER_LIMITS:
         raise ValueError(f"Invalid tier: {tier}. Must be one of {list(TIER_LIMITS.keys())}")
     
-    conn = get_connection()
+    conn = get_connection(telegram_id)
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -206,11 +770,142 @@ def update_subscription(telegram_id: int, tier: str, expires_at: datetime = None
             updated_at = CURRENT_TIMESTAMP
         WHERE telegram_id = ?
     ''', (tier, expires_at, telegram_id))
+    if cursor.rowcount > 0:
+        _mark_changed(conn)
+    
+    conn.commit()
+    success = cursor.rowcount > 0
+    conn.close()
+    
+    if success:
+        _notify('subscription_updated', telegram_id, subscription_tier=tier)
+    return success
+
+def expire_subscriptions(now: datetime = None) -> List[Dict]:
+    """
+    Downgrade every expired paid subscription to free (one transaction, one bulk UPDATE)
+    Run periodically by the expiry sweeper so read paths never have to write
+    The same UPDATE marks each user for an expiry notice (see queue_expiry_notices)
+    Returns the downgraded users: [{'telegram_id', 'subscription_tier', 'subscription_expires'}]
+    (subscription_tier is the tier they had before the downgrade)
+    """
+    now = str(now or datetime.now())
+    
+    def sweep(shard: int) -> List[Dict]:
+        conn = _shard_connection(shard)
+        cursor = conn.cursor()
+        
+        try:
+            conn.begin_immediate()
+            cursor.execute('''
+                SELECT telegram_id, subscription_tier, subscription_expires
+                FROM users
+                WHERE subscription_expires < ? AND subscription_tier != 'free'
+            ''', (now,))
+            expired = [dict(row) for row in cursor.fetchall()]
+            
+            if expired:
+                cursor.execute('''
+                    UPDATE users 
+                    SET subscription_tier = 'free', subscription_expires = NULL,
+                        expired_tier = subscription_tier, expired_at = subscription_expires,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE subscription_expires < ? AND subscription_tier != 'free'
+                ''', (now,))
+                _mark_changed(conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return expired
+    
+    expired = [user for users in _fan_out(sweep) for user in users]
+    for user in expired:
+        _notify('subscription_updated', user['telegram_id'], subscription_tier='free')
+    return expired
+
+def queue_expiry_notices(render: Callable[[Dict], str]) -> int:
+    """
+    Enqueue one notice per downgrade marked by expire_subscriptions(), then clear the marks
+    render(user) builds the message for {'telegram_id', 'subscription_tier', 'subscription_expires'}.
+    A mark is only cleared once its notice is in the outbox, and the dedupe key makes a
+    repeated enqueue a no-op, so a crash anywhere in between never loses a notice.
+    Returns number of users notified
+    """
+    # Outbox first: inside batch() each database commits in first-use order,
+    # so the notices are committed before the marks are cleared
+    get_connection().close()
+    
+    def pending(shard: int) -> List[Dict]:
+        conn = _shard_connection(shard)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT telegram_id, expired_tier AS subscription_tier, expired_at AS subscription_expires
+            FROM users
+            WHERE expired_tier IS NOT NULL
+        ''')
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return rows
+    
+    users = [user for rows in _fan_out(pending) for user in rows]
+    if not users:
+        return 0
+    
+    enqueue_alerts([
+        {
+            'telegram_id': user['telegram_id'],
+            'symbol': None,
+            'message': render(user),
+            # One notice per expiry, even if several sweepers race
+            'dedupe_key': f"expired:{user['telegram_id']}:{user['subscription_expires']}"
+        }
+        for user in users
+    ])
+    
+    def clear(shard: int):
+        conn = _shard_connection(shard)
+        # A newer downgrade (different expired_at) keeps its mark
+        conn.executemany('''
+            UPDATE users SET expired_tier = NULL, expired_at = NULL
+            WHERE telegram_id = ? AND expired_at = ?
+        ''', [(user['telegram_id'], user['subscription_expires'])
+              for user in users if shard_for(user['telegram_id']) == shard])
+        conn.commit()
+        conn.close()
+    
+    _fan_out(clear, sorted({shard_for(user['telegram_id']) for user in users}))
+    return len(users)
+
+def set_alert_mode(telegram_id: int, mode: str) -> bool:
+    """
+    Set how alerts are delivered to the user
+    mode: 'immediate' (one message per alert) or 'digest' (merged per scan)
+    """
+    if mode not in ALERT_MODES:
+        raise ValueError(f"Invalid alert mode: {mode}. Must be one of {list(ALERT_MODES)}")
+    
+    conn = get_connection(telegram_id)
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        UPDATE users 
+        SET alert_mode = ?,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE telegram_id = ?
+    ''', (mode, telegram_id))
+    if cursor.rowcount > 0:
+        _mark_changed(conn)
     
     conn.commit()
     success = cursor.rowcount > 0
     conn.close()
     
+    if success:
+        _notify('alert_mode_updated', telegram_id, alert_mode=mode)
     return success
 
 def check_subscription_expired(telegram_id: int) -> bool:
@@ -218,6 +913,7 @@ def check_subscription_expired(telegram_id: int) -> bool:
     Check if user's subscription has expired
     If expired, downgrade to free tier
     Returns True if expired and downgraded
+    Read paths no longer call this: expire_subscriptions() downgrades everyone in bulk
     """
     user = get_user(telegram_id)
     if not user:
@@ -243,10 +939,6 @@ def can_add_coin(telegram_id: int) -> bool:
     if not user:
         return False
     
-    # Check if subscription expired
-    check_subscription_expired(telegram_id)
-    user = get_user(telegram_id)  # Refresh user data
-    
     tier = user['subscription_tier']
     limit = TIER_LIMITS.get(tier, 0)
     
@@ -254,8 +946,14 @@ def can_add_coin(telegram_id: int) -> bool:
     return current_count < limit
 
 def get_tracked_coins_count(telegram_id: int) -> int:
-    """Get number of coins user is tracking"""
-    conn = get_connection()
+    """Get number of coins user is tracking (read-through cache, bypassed inside batch())"""
+    batching = _in_batch()
+    if not batching:
+        hit, count, generation = _tracked_count_cache.get(telegram_id)
+        if hit:
+            return count
+    
+    conn = get_connection(telegram_id)
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -267,58 +965,116 @@ def get_tracked_coins_count(telegram_id: int) -> int:
     result = cursor.fetchone()
     conn.close()
     
-    return result['count'] if result else 0
+    count = result['count'] if result else 0
+    if not batching:
+        _tracked_count_cache.put(telegram_id, count, generation)
+    return count
 
-def add_tracked_coin(telegram_id: int, symbol: str) -> bool:
+def track_coin(telegram_id: int, symbol: str) -> str:
     """
-    Add a coin to user's tracking list
-    Returns True if successful, False if limit reached or already tracking
-    """
-    if not can_add_coin(telegram_id):
-        return False
+    Add a coin to user's tracking list in one BEGIN IMMEDIATE transaction:
+    expired subscriptions are downgraded, then a single conditional INSERT checks
+    the tier limit and duplicates, so concurrent adds can't exceed the limit
     
-    conn = get_connection()
+    Returns:
+        str: ADD_OK, ADD_USER_NOT_FOUND, ADD_ALREADY_TRACKING or ADD_LIMIT_REACHED
+    """
+    conn = get_connection(telegram_id)
     cursor = conn.cursor()
     
     try:
+        conn.begin_immediate()
+        
+        # Same rule and expiry notice marks as expire_subscriptions()
         cursor.execute('''
-            INSERT INTO tracked_coins (telegram_id, symbol)
-            VALUES (?, ?)
+            UPDATE users 
+            SET subscription_tier = 'free', subscription_expires = NULL,
+                expired_tier = subscription_tier, expired_at = subscription_expires,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE telegram_id = ? AND subscription_tier != 'free' 
+              AND subscription_expires IS NOT NULL AND subscription_expires < ?
+        ''', (telegram_id, str(datetime.now())))
+        expired = cursor.rowcount > 0
+        
+        cursor.execute('INSERT OR IGNORE INTO symbols (symbol) VALUES (?)', (symbol,))
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO tracked_coins (telegram_id, symbol_id)
+            SELECT u.telegram_id, s.id
+            FROM users u, symbols s
+            WHERE u.telegram_id = ? AND s.symbol = ?
+              AND (SELECT COUNT(*) FROM tracked_coins tc WHERE tc.telegram_id = u.telegram_id) < {_TIER_LIMIT_SQL}
         ''', (telegram_id, symbol))
+        
+        if cursor.rowcount > 0:
+            result = ADD_OK
+        else:
+            # Nothing inserted: find out why (same transaction, same snapshot)
+            cursor.execute('''
+                SELECT EXISTS(SELECT 1 FROM users WHERE telegram_id = ?) AS user_exists,
+                       EXISTS(SELECT 1 FROM tracked_coins tc INNER JOIN symbols s ON s.id = tc.symbol_id
+                              WHERE tc.telegram_id = ? AND s.symbol = ?) AS tracking
+            ''', (telegram_id, telegram_id, symbol))
+            row = cursor.fetchone()
+            if not row['user_exists']:
+                result = ADD_USER_NOT_FOUND
+            elif row['tracking']:
+                result = ADD_ALREADY_TRACKING
+            else:
+                result = ADD_LIMIT_REACHED
+        
+        if expired or result == ADD_OK:
+            _mark_changed(conn)
         conn.commit()
-        return True
-    except sqlite3.IntegrityError:
-        # Already tracking this coin
-        return False
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         conn.close()
+    
+    if expired:
+        _notify('subscription_updated', telegram_id, subscription_tier='free')
+    if result == ADD_OK:
+        _notify('coin_added', telegram_id, symbol=symbol)
+    return result
+
+def add_tracked_coin(telegram_id: int, symbol: str) -> bool:
+    """
+    Add a coin to user's tracking list
+    Returns True if successful, False if limit reached or already tracking
+    """
+    return track_coin(telegram_id, symbol) == ADD_OK
 
 def remove_tracked_coin(telegram_id: int, symbol: str) -> bool:
     """Remove a coin from user's tracking list"""
-    conn = get_connection()
+    conn = get_connection(telegram_id)
     cursor = conn.cursor()
     
     cursor.execute('''
         DELETE FROM tracked_coins 
-        WHERE telegram_id = ? AND symbol = ?
+        WHERE telegram_id = ? AND symbol_id = (SELECT id FROM symbols WHERE symbol = ?)
     ''', (telegram_id, symbol))
+    if cursor.rowcount > 0:
+        _mark_changed(conn)
     
     conn.commit()
     success = cursor.rowcount > 0
     conn.close()
     
+    if success:
+        _notify('coin_removed', telegram_id, symbol=symbol)
     return success
 
 def get_tracked_coins(telegram_id: int) -> List[Dict]:
     """Get all coins tracked by a user"""
-    conn = get_connection()
+    conn = get_connection(telegram_id)
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT symbol, added_at 
-        FROM tracked_coins 
-        WHERE telegram_id = ?
-        ORDER BY added_at DESC
+        SELECT s.symbol, tc.added_at 
+        FROM tracked_coins tc
+        INNER JOIN symbols s ON s.id = tc.symbol_id
+        WHERE tc.telegram_id = ?
+        ORDER BY tc.added_at DESC
     ''', (telegram_id,))
     
     rows = cursor.fetchall()
@@ -330,21 +1086,51 @@ def get_users_tracking_coin(symbol: str) -> List[Dict]:
     """
     Get all users tracking a specific coin
     Returns list of user dictionaries
+    Sharded: every shard is queried in parallel and the results are concatenated
     """
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT u.telegram_id, u.username, u.subscription_tier
-        FROM users u
-        INNER JOIN tracked_coins tc ON u.telegram_id = tc.telegram_id
-        WHERE tc.symbol = ?
-    ''', (symbol,))
+    def query(shard: int) -> List[Dict]:
+        conn = _shard_connection(shard)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT u.telegram_id, u.username, u.subscription_tier, u.alert_mode
+            FROM symbols s
+            INNER JOIN tracked_coins tc ON tc.symbol_id = s.id
+            INNER JOIN users u ON u.telegram_id = tc.telegram_id
+            WHERE s.symbol = ? AND u.is_active = 1
+        ''', (symbol,))
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
     
-    rows = cursor.fetchall()
-    conn.close()
+    return [user for users in _fan_out(query) for user in users]
+
+def get_all_subscriptions() -> List[Dict]:
+    """
+    Get every (user, tracked coin) pair in one query
+    Used to build the in-memory symbol -> subscribers index
+    (one query per shard, run in parallel)
+    """
+    def query(shard: int) -> List[Dict]:
+        conn = _shard_connection(shard)
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            SELECT s.symbol, u.telegram_id, u.username, u.subscription_tier, u.alert_mode
+            FROM tracked_coins tc
+            INNER JOIN symbols s ON s.id = tc.symbol_id
+            INNER JOIN users u ON u.telegram_id = tc.telegram_id
+            WHERE u.is_active = 1
+        ''')
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
     
-    return [dict(row) for row in rows]
+    return [row for rows in _fan_out(query) for row in rows]
 
 def get_user_status(telegram_id: int) -> Dict:
     """
@@ -354,10 +1140,6 @@ def get_user_status(telegram_id: int) -> Dict:
     if not user:
         return None
     
-    # Check expiration
-    check_subscription_expired(telegram_id)
-    user = get_user(telegram_id)  # Refresh
-    
     tier = user['subscription_tier']
     limit = TIER_LIMITS.get(tier, 0)
     tracked_count = get_tracked_coins_count(telegram_id)
@@ -369,8 +1151,645 @@ def get_user_status(telegram_id: int) -> Dict:
         'tracked_count': tracked_count,
         'limit': limit,
         'slots_available': limit - tracked_count,
-        'subscription_expires': user['subscription_expires']
+        'subscription_expires': user['subscription_expires'],
+        'alert_mode': user['alert_mode']
     }
 
+# ==================== DELIVERY OUTCOMES ====================
+
+def record_delivery_outcomes(delivered: List[int] = (), failures: List[tuple] = ()) -> List[int]:
+    """
+    Record alert delivery results per user (one transaction per shard)
+    delivered: telegram_ids that received a message
+    failures: [(telegram_id, error, unreachable)]
+    Unreachable users (blocked the bot, chat gone) are marked inactive: they drop out of
+    get_users_tracking_coin() and their pending outbox alerts are failed until they interact again.
+    Returns telegram_ids that were deactivated
+    """
+    if not delivered and not failures:
+        return []
+    
+    def record(shard: int) -> List[int]:
+        conn = _shard_connection(shard)
+        cursor = conn.cursor()
+        
+        cursor.executemany('''
+            UPDATE users 
+            SET delivery_failures = 0, last_delivered_at = CURRENT_TIMESTAMP
+            WHERE telegram_id = ?
+        ''', [(telegram_id,) for telegram_id in delivered if shard_for(telegram_id) == shard])
+        
+        deactivated = []
+        for telegram_id, error, unreachable in failures:
+            if shard_for(telegram_id) != shard:
+                continue
+            cursor.execute('''
+                UPDATE users 
+                SET delivery_failures = delivery_failures + 1, last_delivery_error = ?
+                WHERE telegram_id = ?
+            ''', (error, telegram_id))
+            
+            if unreachable:
+                cursor.execute('''
+                    UPDATE users SET is_active = 0, updated_at = CURRENT_TIMESTAMP
+                    WHERE telegram_id = ? AND is_active = 1
+                ''', (telegram_id,))
+                if cursor.rowcount > 0:
+                    deactivated.append(telegram_id)
+        
+        if deactivated:
+            _mark_changed(conn)
+        conn.commit()
+        conn.close()
+        return deactivated
+    
+    shards = sorted({shard_for(telegram_id) for telegram_id in delivered} |
+                    {shard_for(telegram_id) for telegram_id, _, _ in failures})
+    deactivated = [telegram_id for ids in _fan_out(record, shards) for telegram_id in ids]
+    
+    if deactivated:
+        # Don't spend API calls on alerts that can no longer be delivered
+        conn = get_connection()
+        conn.executemany('''
+            UPDATE alert_outbox 
+            SET status = 'failed', last_error = 'recipient inactive', claimed_at = NULL
+            WHERE telegram_id = ? AND status IN ('pending', 'digest')
+        ''', [(telegram_id,) for telegram_id in deactivated])
+        conn.commit()
+        conn.close()
+    
+    for telegram_id in set(delivered) | {failure[0] for failure in failures}:
+        _invalidate_user(telegram_id)
+    for telegram_id in deactivated:
+        _notify('user_deactivated', telegram_id)
+    return deactivated
+
+def reactivate_user(telegram_id: int) -> bool:
+    """
+    Mark an inactive user active again (called whenever the user interacts with the bot)
+    Returns True if the user was inactive
+    """
+    conn = get_connection(telegram_id)
+    cursor = conn.cursor()
+    
+    # Read first: the common case (already active) stays a read
+    cursor.execute('SELECT is_active FROM users WHERE telegram_id = ?', (telegram_id,))
+    row = cursor.fetchone()
+    if not row or row['is_active']:
+        conn.close()
+        return False
+    
+    cursor.execute('''
+        UPDATE users 
+        SET is_active = 1, delivery_failures = 0, updated_at = CURRENT_TIMESTAMP
+        WHERE telegram_id = ? AND is_active = 0
+    ''', (telegram_id,))
+    if cursor.rowcount > 0:
+        _mark_changed(conn)
+    
+    conn.commit()
+    success = cursor.rowcount > 0
+    conn.close()
+    
+    if success:
+        _notify('user_reactivated', telegram_id)
+    return success
+
+# ==================== ALERT OUTBOX OPERATIONS ====================
+
+def enqueue_alerts(alerts: List[Dict]) -> int:
+    """
+    Enqueue rendered alerts in one transaction
+    alerts: [{'telegram_id', 'symbol', 'message', 'dedupe_key', optional 'status'}]
+    Rows whose dedupe_key already exists are ignored, so a retried scan never enqueues twice.
+    status 'digest' defers a row until merge_digest_alerts (message is the JSON digest entry).
+    Returns number of rows actually enqueued
+    """
+    if not alerts:
+        return 0
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    before = conn.total_changes
+    cursor.executemany('''
+        INSERT OR IGNORE INTO alert_outbox (telegram_id, symbol, message, dedupe_key, status)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(a['telegram_id'], a.get('symbol'), a['message'], a.get('dedupe_key'), a.get('status', 'pending'))
+          for a in alerts])
+    
+    conn.commit()
+    inserted = conn.total_changes - before
+    conn.close()
+    
+    return inserted
+
+def cancel_pending_alerts(dedupe_keys: List[str]) -> int:
+    """
+    Withdraw enqueued alerts that no delivery worker has claimed yet
+    Returns number of rows removed
+    """
+    if not dedupe_keys:
+        return 0
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    before = conn.total_changes
+    cursor.executemany('''
+        DELETE FROM alert_outbox
+        WHERE dedupe_key = ? AND status IN ('pending', 'digest') AND claimed_at IS NULL
+    ''', [(key,) for key in dedupe_keys])
+    
+    conn.commit()
+    removed = conn.total_changes - before
+    conn.close()
+    
+    return removed
+
+def merge_digest_alerts(render: Callable[[List[Dict]], str], window: float) -> int:
+    """
+    Turn deferred digest entries into one pending alert per user
+    Every scanner shard writes its entries with status 'digest'; once a user's oldest entry is
+    `window` seconds old, all of the user's entries are rendered by render(entries) into a single
+    message (a newer entry for the same coin replaces the older one).
+    Returns number of digests enqueued
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        conn.begin_immediate()
+        cursor.execute('''
+            SELECT id, telegram_id, message
+            FROM alert_outbox
+            WHERE status = 'digest' AND telegram_id IN (
+                SELECT telegram_id FROM alert_outbox
+                WHERE status = 'digest'
+                GROUP BY telegram_id
+                HAVING MIN(created_at) <= datetime('now', ?)
+            )
+            ORDER BY id
+        ''', (f'-{int(window)} seconds',))
+        rows = cursor.fetchall()
+        
+        entries = {}  # telegram_id -> (first entry id, symbol -> entry)
+        for row in rows:
+            _, by_symbol = entries.setdefault(row['telegram_id'], (row['id'], {}))
+            entry = json.loads(row['message'])
+            by_symbol[entry['symbol']] = entry
+        
+        cursor.executemany('''
+            INSERT OR IGNORE INTO alert_outbox (telegram_id, symbol, message, dedupe_key)
+            VALUES (?, NULL, ?, ?)
+        ''', [(telegram_id, render(list(by_symbol.values())), f"digest:{telegram_id}:{first_id}")
+              for telegram_id, (first_id, by_symbol) in entries.items()])
+        cursor.executemany('DELETE FROM alert_outbox WHERE id = ?', [(row['id'],) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    return len(entries)
+
+def claim_pending_alerts(worker_id: str, limit: int = 100, lease: int = OUTBOX_LEASE) -> List[Dict]:
+    """
+    Claim up to `limit` pending alerts for a delivery worker (oldest first)
+    Claims left by a crashed worker are reclaimed once their lease expires
+    """
+    now = time.time()
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    try:
+        conn.begin_immediate()
+        cursor.execute('''
+            SELECT id, telegram_id, symbol, message, attempts
+            FROM alert_outbox
+            WHERE status = 'pending'
+              AND (claimed_at IS NULL OR claimed_at < ?)
+            ORDER BY id
+            LIMIT ?
+        ''', (now - lease, limit))
+        rows = [dict(row) for row in cursor.fetchall()]
+        
+        cursor.executemany('''
+            UPDATE alert_outbox SET claimed_by = ?, claimed_at = ? WHERE id = ?
+        ''', [(worker_id, now, row['id']) for row in rows])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    return rows
+
+def renew_alert_claims(worker_id: str, alert_ids: List[int], now: float = None):
+    """Extend the lease of alerts this worker claimed and still holds (queued, not sent yet)"""
+    if not alert_ids:
+        return
+    
+    now = now if now is not None else time.time()
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.executemany('''
+        UPDATE alert_outbox SET claimed_at = ?
+        WHERE id = ? AND claimed_by = ? AND status = 'pending'
+    ''', [(now, alert_id, worker_id) for alert_id in alert_ids])
+    
+    conn.commit()
+    conn.close()
+
+def mark_alerts_delivered(alert_ids: List[int]):
+    """Mark alerts as delivered (one transaction)"""
+    if not alert_ids:
+        return
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.executemany('''
+        UPDATE alert_outbox 
+        SET status = 'delivered', delivered_at = CURRENT_TIMESTAMP, claimed_at = NULL
+        WHERE id = ?
+    ''', [(alert_id,) for alert_id in alert_ids])
+    
+    conn.commit()
+    conn.close()
+
+def mark_alerts_failed(failures: List[tuple], permanent: bool = False):
+    """
+    Record failed deliveries: failures = [(alert_id, error)]
+    Transient failures go back to pending until OUTBOX_MAX_ATTEMPTS, permanent ones are closed
+    """
+    if not failures:
+        return
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.executemany('''
+        UPDATE alert_outbox 
+        SET attempts = attempts + 1,
+            last_error = ?,
+            claimed_at = NULL,
+            status = CASE WHEN ? OR attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+        WHERE id = ?
+    ''', [(error, permanent, OUTBOX_MAX_ATTEMPTS, alert_id) for alert_id, error in failures])
+    
+    conn.commit()
+    conn.close()
+
+def get_outbox_stats() -> Dict:
+    """Count outbox rows per status"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT status, COUNT(*) AS count FROM alert_outbox GROUP BY status')
+    rows = cursor.fetchall()
+    conn.close()
+    
+    return {row['status']: row['count'] for row in rows}
+
+def purge_delivered_alerts(older_than_days: int = OUTBOX_RETENTION_DAYS) -> int:
+    """
+    Delete delivered/failed outbox rows older than N days (run periodically by the bot)
+    The cutoff is computed by SQLite: created_at is CURRENT_TIMESTAMP, which is UTC
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        DELETE FROM alert_outbox 
+        WHERE status IN ('delivered', 'failed') AND created_at < datetime('now', ?)
+    ''', (f'-{older_than_days} days',))
+    
+    conn.commit()
+    deleted = cursor.rowcount
+    conn.close()
+    
+    return deleted
+
+# ==================== BULK OPERATIONS ====================
+
+def _in_list(values) -> str:
+    """Bind a Python list as one parameter: ... IN (SELECT value FROM json_each(?))"""
+    return json.dumps(list(values))
+
+def create_users_bulk(users: List[Dict]) -> List[str]:
+    """
+    Create many free-tier users with executemany in one transaction per shard
+    users: [{'telegram_id', 'username', 'alert_mode' (optional)}]
+    Returns one outcome per row: ROW_CREATED, ROW_EXISTS or ROW_INVALID (unknown alert_mode)
+    """
+    if not users:
+        return []
+    
+    return _bulk_by_shard(users, lambda user: user['telegram_id'], _create_users_bulk_shard)
+
+def _create_users_bulk_shard(shard: int, users: List[Dict]) -> List[str]:
+    conn = _shard_connection(shard)
+    cursor = conn.cursor()
+    
+    try:
+        conn.begin_immediate()
+        cursor.execute(
+            'SELECT telegram_id FROM users WHERE telegram_id IN (SELECT value FROM json_each(?))',
+            (_in_list(u['telegram_id'] for u in users),)
+        )
+        seen = {row['telegram_id'] for row in cursor.fetchall()}
+        
+        outcomes, rows = [], []
+        for user in users:
+            telegram_id, alert_mode = user['telegram_id'], user.get('alert_mode') or 'immediate'
+            if alert_mode not in ALERT_MODES:
+                outcomes.append(ROW_INVALID)
+            elif telegram_id in seen:
+                outcomes.append(ROW_EXISTS)
+            else:
+                seen.add(telegram_id)
+                rows.append((telegram_id, user.get('username'), alert_mode))
+                outcomes.append(ROW_CREATED)
+        
+        cursor.executemany('''
+            INSERT INTO users (telegram_id, username, subscription_tier, alert_mode)
+            VALUES (?, ?, 'free', ?)
+        ''', rows)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    for telegram_id, username, _ in rows:
+        _notify('user_created', telegram_id, username=username, subscription_tier='free')
+    return outcomes
+
+def update_subscriptions_bulk(updates: List[tuple]) -> List[str]:
+    """
+    Update many subscriptions with executemany in one transaction per shard
+    updates: [(telegram_id, tier, expires_at)] (same arguments as update_subscription)
+    Returns one outcome per row: ROW_UPDATED, ROW_USER_NOT_FOUND or ROW_INVALID (unknown tier)
+    """
+    if not updates:
+        return []
+    
+    return _bulk_by_shard(updates, lambda update: update[0], _update_subscriptions_bulk_shard)
+
+def _update_subscriptions_bulk_shard(shard: int, updates: List[tuple]) -> List[str]:
+    conn = _shard_connection(shard)
+    cursor = conn.cursor()
+    
+    try:
+        conn.begin_immediate()
+        cursor.execute(
+            'SELECT telegram_id FROM users WHERE telegram_id IN (SELECT value FROM json_each(?))',
+            (_in_list(telegram_id for telegram_id, _, _ in updates),)
+        )
+        existing = {row['telegram_id'] for row in cursor.fetchall()}
+        
+        outcomes, rows = [], []
+        for telegram_id, tier, expires_at in updates:
+            if tier not in TIER_LIMITS:
+                outcomes.append(ROW_INVALID)
+            elif telegram_id not in existing:
+                outcomes.append(ROW_USER_NOT_FOUND)
+            else:
+                rows.append((tier, expires_at, telegram_id))
+                outcomes.append(ROW_UPDATED)
+        
+        cursor.executemany('''
+            UPDATE users 
+            SET subscription_tier = ?, 
+                subscription_expires = ?,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE telegram_id = ?
+        ''', rows)
+        if rows:
+            _mark_changed(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    for tier, _, telegram_id in rows:
+        _notify('subscription_updated', telegram_id, subscription_tier=tier)
+    return outcomes
+
+def add_tracked_coins_bulk(pairs: List[tuple], enforce_limits: bool = True) -> List[str]:
+    """
+    Add many (telegram_id, symbol) pairs with executemany in one transaction per shard
+    Tier limits are checked against counts taken inside the same transaction
+    (an expired paid tier counts as free, as in track_coin)
+    
+    Args:
+        pairs: [(telegram_id, symbol)]
+        enforce_limits: False to skip the tier limit (admin restore)
+    
+    Returns:
+        list: one of ADD_OK, ADD_USER_NOT_FOUND, ADD_ALREADY_TRACKING, ADD_LIMIT_REACHED per pair
+    """
+    if not pairs:
+        return []
+    
+    return _bulk_by_shard(
+        pairs, lambda pair: pair[0],
+        lambda shard, shard_pairs: _add_tracked_coins_bulk_shard(shard, shard_pairs, enforce_limits)
+    )
+
+def _add_tracked_coins_bulk_shard(shard: int, pairs: List[tuple], enforce_limits: bool) -> List[str]:
+    now = str(datetime.now())
+    conn = _shard_connection(shard)
+    cursor = conn.cursor()
+    
+    try:
+        conn.begin_immediate()
+        telegram_ids = _in_list({telegram_id for telegram_id, _ in pairs})
+        symbols = {symbol for _, symbol in pairs}
+        
+        cursor.execute('''
+            SELECT u.telegram_id, u.subscription_tier, u.subscription_expires,
+                   (SELECT COUNT(*) FROM tracked_coins tc WHERE tc.telegram_id = u.telegram_id) AS tracked
+            FROM users u
+            WHERE u.telegram_id IN (SELECT value FROM json_each(?))
+        ''', (telegram_ids,))
+        limits, counts = {}, {}
+        for row in cursor.fetchall():
+            expired = row['subscription_expires'] is not None and row['subscription_expires'] < now
+            limits[row['telegram_id']] = TIER_LIMITS.get('free' if expired else row['subscription_tier'], 0)
+            counts[row['telegram_id']] = row['tracked']
+        
+        cursor.executemany('INSERT OR IGNORE INTO symbols (symbol) VALUES (?)', [(s,) for s in symbols])
+        cursor.execute(
+            'SELECT id, symbol FROM symbols WHERE symbol IN (SELECT value FROM json_each(?))',
+            (_in_list(symbols),)
+        )
+        symbol_ids = {row['symbol']: row['id'] for row in cursor.fetchall()}
+        
+        cursor.execute(
+            'SELECT telegram_id, symbol_id FROM tracked_coins WHERE telegram_id IN (SELECT value FROM json_each(?))',
+            (telegram_ids,)
+        )
+        tracked = {(row['telegram_id'], row['symbol_id']) for row in cursor.fetchall()}
+        
+        outcomes, rows, added = [], [], []
+        for telegram_id, symbol in pairs:
+            key = (telegram_id, symbol_ids[symbol])
+            if telegram_id not in limits:
+                outcomes.append(ADD_USER_NOT_FOUND)
+            elif key in tracked:
+                outcomes.append(ADD_ALREADY_TRACKING)
+            elif enforce_limits and counts[telegram_id] >= limits[telegram_id]:
+                outcomes.append(ADD_LIMIT_REACHED)
+            else:
+                tracked.add(key)
+                counts[telegram_id] += 1
+                rows.append(key)
+                added.append((telegram_id, symbol))
+                outcomes.append(ADD_OK)
+        
+        cursor.executemany('INSERT INTO tracked_coins (telegram_id, symbol_id) VALUES (?, ?)', rows)
+        if rows:
+            _mark_changed(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    for telegram_id, symbol in added:
+        _notify('coin_added', telegram_id, symbol=symbol)
+    return outcomes
+
+def _file_format(path: str, fmt: str = None) -> str:
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    if fmt == 'ndjson':
+        fmt = 'jsonl'
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported format: {fmt}. Must be one of {list(EXPORT_FORMATS)}")
+    return fmt
+
+def export_users(path: str, fmt: str = None) -> int:
+    """
+    Export every user with their tracked symbols, one record per user
+    fmt: 'csv' or 'jsonl' (default: from the file extension)
+    CSV stores symbols space-separated; JSONL stores them as a list
+    Returns number of users exported
+    """
+    fmt = _file_format(path, fmt)
+    
+    exported = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=EXPORT_FIELDS) if fmt == 'csv' else None
+        if writer:
+            writer.writeheader()
+        
+        # Shard by shard (sorted by telegram_id within a shard), streamed row by row
+        for shard in range(len(shard_paths())):
+            conn = _shard_connection(shard)
+            cursor = conn.cursor()
+            
+            cursor.execute('''
+                SELECT u.telegram_id, u.username, u.subscription_tier, u.subscription_expires, u.alert_mode,
+                       (SELECT group_concat(s.symbol, ' ') FROM tracked_coins tc
+                        INNER JOIN symbols s ON s.id = tc.symbol_id
+                        WHERE tc.telegram_id = u.telegram_id) AS symbols
+                FROM users u
+                ORDER BY u.telegram_id
+            ''')
+            
+            try:
+                for row in cursor:
+                    record = dict(row)
+                    if writer:
+                        writer.writerow({**record, 'symbols': record['symbols'] or ''})
+                    else:
+                        record['symbols'] = record['symbols'].split(' ') if record['symbols'] else []
+                        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    exported += 1
+            finally:
+                conn.close()
+    
+    return exported
+
+def _read_records(path: str, fmt: str):
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'jsonl':
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for row in csv.DictReader(f):
+                yield {
+                    **row,
+                    'telegram_id': int(row['telegram_id']),
+                    'username': row.get('username') or None,
+                    'subscription_expires': row.get('subscription_expires') or None,
+                    'symbols': (row.get('symbols') or '').split()
+                }
+
+def import_users(path: str, fmt: str = None, chunk_size: int = IMPORT_CHUNK_SIZE,
+                 enforce_limits: bool = True) -> Dict:
+    """
+    Import users, subscriptions and tracked symbols from an export_users() file
+    Each chunk of `chunk_size` records goes through the three bulk functions inside one batch():
+    one transaction per shard for users, subscriptions and coins together, so a failed chunk is
+    rolled back whole (never users without their coins) and doesn't undo earlier chunks.
+    Memory stays flat on million-row files.
+    Existing users keep their row but get the file's subscription and symbols added.
+    
+    Returns:
+        dict: outcome counts per stage, e.g. {'users': {'created': 10}, 'coins': {'added': 12}, ...}
+    """
+    fmt = _file_format(path, fmt)
+    summary = {'records': 0, 'users': {}, 'subscriptions': {}, 'coins': {}}
+    
+    def count(stage: str, outcomes: List[str]):
+        for outcome in outcomes:
+            summary[stage][outcome] = summary[stage].get(outcome, 0) + 1
+    
+    def flush(chunk: List[Dict]):
+        with batch() as run:
+            def stage(fn: Callable, *args, **kwargs) -> List[str]:
+                result, error = run(fn, *args, **kwargs)
+                if error is not None:
+                    raise error  # rolls back the whole chunk
+                return result
+            
+            users = stage(create_users_bulk, chunk)
+            subscriptions = stage(update_subscriptions_bulk, [
+                (r['telegram_id'], r.get('subscription_tier') or 'free', r.get('subscription_expires'))
+                for r in chunk if (r.get('subscription_tier') or 'free') != 'free' or r.get('subscription_expires')
+            ])
+            coins = stage(
+                add_tracked_coins_bulk,
+                [(r['telegram_id'], symbol) for r in chunk for symbol in r.get('symbols') or []],
+                enforce_limits=enforce_limits
+            )
+        
+        count('users', users)
+        count('subscriptions', subscriptions)
+        count('coins', coins)
+        summary['records'] += len(chunk)
+    
+    chunk = []
+    for record in _read_records(path, fmt):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    
+    return summary
+
 # Initialize database on module import
 init_db()